@@ -4,6 +4,9 @@ from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 from auth.firebase import verify_firebase_token
+from utils.log import get_logger
+
+logger = get_logger("auth")
 
 http_bearer = HTTPBearer(auto_error=False)
 ALLOW_DEV_AUTH_BYPASS = os.getenv("ALLOW_DEV_AUTH_BYPASS", "false").lower() == "true"
@@ -24,12 +27,10 @@ async def require_firebase_user(
         )
 
     id_token = credentials.credentials
-    
-    print(f"DEBUG: Received bearer token prefix: {id_token[:8]}...")
 
     # --- DEV BYPASS FOR TESTING ---
     if ALLOW_DEV_AUTH_BYPASS and id_token.strip() == "test-token":
-        print("⚠ USING DEV BYPASS TOKEN")
+        logger.warning("Using dev bypass token")
         mock_user = {
             "uid": "test-user-123",
             "email": "test@stemly.app",
@@ -45,7 +46,7 @@ async def require_firebase_user(
     try:
         firebase_user = verify_firebase_token(id_token)
     except Exception as exc:  # firebase_admin raises several custom exceptions
-        print(f"DEBUG: Auth middleware failed: {exc}")
+        logger.info("Token rejected: %s", exc, extra={"path": request.url.path})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid or expired Firebase ID token. Error: {exc}",
@@ -6,6 +6,10 @@ import firebase_admin
 from firebase_admin import auth as firebase_auth
 from firebase_admin import credentials
 
+from utils.log import get_logger
+
+logger = get_logger("auth")
+
 SERVICE_ACCOUNT_FILE_ENV = "FIREBASE_CREDENTIALS_FILE"
 SERVICE_ACCOUNT_JSON_ENV = "FIREBASE_CREDENTIALS_JSON"
 
@@ -54,7 +58,7 @@ def verify_firebase_token(id_token: str) -> Dict[str, Optional[str]]:
     try:
         decoded = firebase_auth.verify_id_token(id_token, app=app)
     except Exception as e:
-        print(f"🔥 FIREBASE VERIFICATION ERROR: {str(e)}")
+        logger.debug("Firebase verification error: %s", e)
         raise e
 
     return {
@@ -11,10 +11,132 @@ load_dotenv()
 # Gemini API Configuration
 GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
 GEMINI_FALLBACK_API_KEY = os.getenv("GEMINI_FALLBACK_API_KEY")
-GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+# Key pool (services/key_pool.py): GEMINI_API_KEYS is a comma-separated list;
+# the primary and fallback keys above are folded in for compatibility.
+GEMINI_API_KEYS = list(dict.fromkeys(
+    k.strip()
+    for k in [GEMINI_API_KEY, GEMINI_FALLBACK_API_KEY, *os.getenv("GEMINI_API_KEYS", "").split(",")]
+    if k and k.strip()
+))
+GEMINI_KEY_RPM_LIMIT = int(os.getenv("GEMINI_KEY_RPM_LIMIT", "0")) or None  # per key; 0 = unlimited
+GEMINI_KEY_RATE_LIMIT_COOLDOWN = float(os.getenv("GEMINI_KEY_RATE_LIMIT_COOLDOWN", "30"))
+GEMINI_KEY_AUTH_COOLDOWN = float(os.getenv("GEMINI_KEY_AUTH_COOLDOWN", "600"))
+# Point at scripts/mock_llm_server.py (e.g. http://localhost:9000/v1beta) for
+# offline development and load tests.
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
 GEMINI_MODEL = "gemini-2.5-flash"  # Latest Gemini 2.5 Flash model
 GEMINI_VISION_MODEL = "gemini-2.5-flash"  # Same model handles vision
 
+# Pooled HTTP client used by services/llm_gateway.py
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+
+# Circuit breakers (services/circuit_breaker.py), one per upstream: open after
+# this many consecutive failed calls, reject calls (serving local fallbacks)
+# for CIRCUIT_OPEN_SECONDS, then let CIRCUIT_HALF_OPEN_PROBES probe calls through.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1"))
+
+# Time budget for POST /upload (services/deadline.py): Gemini calls, retries
+# and key failover stop when it runs out and the keyword topic is returned.
+SCAN_DEADLINE_SECONDS = float(os.getenv("SCAN_DEADLINE_SECONDS", "25"))
+# The shared detection keeps going this much longer after the request gives
+# up, so a slow Gemini answer is still cached for the next upload of the page.
+SCAN_DETECT_GRACE_SECONDS = float(os.getenv("SCAN_DETECT_GRACE_SECONDS", "5"))
+
+# Largest accepted scan image (services/storage.py). Larger uploads are
+# rejected with 413 from Content-Length, before the body is read.
+SCAN_MAX_BYTES = int(os.getenv("SCAN_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# Hedged topic detection (services/ai_detector.py): for borderline scans (short
+# or noisy OCR, weak keyword match) Gemini text and vision run concurrently and
+# the first confident answer wins. Vision starts DETECT_HEDGE_DELAY seconds
+# after text (0 = at the same time).
+DETECT_HEDGE_ENABLED = os.getenv("DETECT_HEDGE_ENABLED", "true").lower() == "true"
+DETECT_HEDGE_DELAY = float(os.getenv("DETECT_HEDGE_DELAY", "0"))
+DETECT_HEDGE_MAX_OCR_CHARS = int(os.getenv("DETECT_HEDGE_MAX_OCR_CHARS", "80"))
+DETECT_HEDGE_MIN_ALPHA_RATIO = float(os.getenv("DETECT_HEDGE_MIN_ALPHA_RATIO", "0.6"))
+DETECT_HEDGE_WEAK_KEYWORD_HITS = int(os.getenv("DETECT_HEDGE_WEAK_KEYWORD_HITS", "1"))
+
+# Logging (utils/log.py): JSON lines on stdout via a background writer thread.
+# LOG_LEVELS overrides the level per category, e.g. "llm=DEBUG,auth=WARNING"
+# (categories: app, api, auth, db, llm, detect, notes, quiz, chat, visualiser,
+# jobs). Debug payload dumps are sampled at LOG_PAYLOAD_SAMPLE_RATE.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json | text
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.05"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+
+# Prometheus metrics at GET /metrics (services/metrics.py). Off by default:
+# the series expose routes, models and masked pool keys. When METRICS_TOKEN is
+# set, scrapers must send "Authorization: Bearer <token>".
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# LLM response cache (services/llm_cache.py). Leave the DB path empty to keep
+# the cache in memory only.
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_DB_PATH = os.getenv("LLM_CACHE_DB_PATH", "")
+
+# Scan detection cache (services/detection_cache.py): topic/variables per
+# image SHA-256, in memory (this many entries) and in MongoDB when configured.
+DETECTION_CACHE_MAX_ENTRIES = int(os.getenv("DETECTION_CACHE_MAX_ENTRIES", "10000"))
+
+# Near-duplicate scans (services/similar_scans.py): Hamming distance between
+# 64-bit perceptual hashes. Within REUSE a scan reuses an earlier scan's
+# detection; within SEARCH it is listed by GET /scan/similar. Distances up to
+# 7 keep lookups under a millisecond at 1M scans (scripts/bench_phash_index.py);
+# 10 takes about 2 ms but also finds more heavily re-cropped or re-lit copies.
+SCAN_SIMILAR_ENABLED = os.getenv("SCAN_SIMILAR_ENABLED", "true").lower() == "true"
+SCAN_SIMILAR_REUSE_DISTANCE = int(os.getenv("SCAN_SIMILAR_REUSE_DISTANCE", "6"))
+SCAN_SIMILAR_SEARCH_DISTANCE = int(os.getenv("SCAN_SIMILAR_SEARCH_DISTANCE", "7"))
+
+# Images sent to Gemini Vision (services/vision_image.py): upright, cropped to
+# the content, longest edge at most MAX_EDGE pixels, re-encoded as jpeg or
+# webp, metadata stripped. Prepared images are cached per image SHA-256 up to
+# CACHE_MAX_BYTES in memory.
+VISION_IMAGE_MAX_EDGE = int(os.getenv("VISION_IMAGE_MAX_EDGE", "1536"))
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "jpeg").lower()
+VISION_IMAGE_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", "85"))
+VISION_IMAGE_CROP = os.getenv("VISION_IMAGE_CROP", "true").lower() == "true"
+VISION_IMAGE_CACHE_MAX_BYTES = int(os.getenv("VISION_IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Prompt prefix caching (services/prompt_registry.py): "gemini" uses Gemini
+# context caches for the static part of each prompt template, "local" is an
+# in-process stand-in for tests/offline development, "off" sends it inline.
+# Prefixes estimated below PROMPT_CACHE_MIN_TOKENS (Gemini's minimum cache
+# size) are never uploaded. Every current template (notes, quiz, visualiser
+# chat) is below 1024 tokens, so "gemini" would create no context cache today;
+# the default is "off" and only Gemini's implicit prefix caching applies.
+PROMPT_CACHE_BACKEND = os.getenv("PROMPT_CACHE_BACKEND", "off").lower()
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+
+# Quiz bank (services/quiz_bank.py): questions are served from Mongo when a
+# topic has enough stock, and a background worker tops topics back up.
+QUIZ_BANK_ENABLED = os.getenv("QUIZ_BANK_ENABLED", "true").lower() == "true"
+QUIZ_BANK_MIN_STOCK = int(os.getenv("QUIZ_BANK_MIN_STOCK", "30"))
+QUIZ_BANK_TARGET_STOCK = int(os.getenv("QUIZ_BANK_TARGET_STOCK", "60"))
+QUIZ_BANK_BATCH_SIZE = int(os.getenv("QUIZ_BANK_BATCH_SIZE", "15"))
+QUIZ_BANK_REFILL_INTERVAL = float(os.getenv("QUIZ_BANK_REFILL_INTERVAL", "300"))
+QUIZ_BANK_MAX_TOPICS_PER_CYCLE = int(os.getenv("QUIZ_BANK_MAX_TOPICS_PER_CYCLE", "20"))
+
+# POST /quiz/batch: topics per request and how many are generated at once
+QUIZ_BATCH_MAX_TOPICS = int(os.getenv("QUIZ_BATCH_MAX_TOPICS", "20"))
+QUIZ_BATCH_CONCURRENCY = int(os.getenv("QUIZ_BATCH_CONCURRENCY", "5"))
+
+# Background jobs (services/job_queue.py, needs MONGO_URI). Set the in-process
+# concurrency to 0 when jobs are handled by separate `python worker.py` processes.
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", str(7 * 24 * 3600)))
+
 # Legacy aliases for compatibility (redirecting to Gemini)
 OPENROUTER_API_KEY = GEMINI_API_KEY
 LOCAL_MODEL = GEMINI_MODEL
@@ -25,11 +147,12 @@ GENERAL_MODEL = GEMINI_MODEL
 # Legacy keys (deprecated, kept for import compatibility)
 FALLBACK_GROQ_API_KEY = None
 AIML_API_KEY = os.getenv("AIML_API_KEY")  # For image generation only
+AIML_BASE_URL = os.getenv("AIML_BASE_URL", "https://api.aimlapi.com/v1").rstrip("/")
 OPENROUTER_API_KEY_LEGACY = os.getenv("OPENROUTER_API_KEY")
 
 def is_ai_enabled() -> bool:
-    """Returns True if Gemini API key is configured."""
-    return bool(GEMINI_API_KEY)
+    """Returns True if at least one Gemini API key is configured."""
+    return bool(GEMINI_API_KEYS)
 
 def get_gemini_url(model: str = None) -> str:
     """Get the full Gemini API URL for generateContent."""
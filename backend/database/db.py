@@ -5,19 +5,24 @@ from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo.server_api import ServerApi
 
+from services.metrics import MongoCommandMetrics
+from utils.log import get_logger
+
 load_dotenv()
 
+logger = get_logger("db")
+
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_ALLOW_INVALID_CERTS = os.getenv("MONGO_ALLOW_INVALID_CERTS", "false").lower() == "true"
 
 if not MONGO_URI:
-    print("⚠ MONGO_URI not set in .env - database disabled")
+    logger.warning("MONGO_URI not set in .env - database disabled")
     client = None
     db = None
 else:
     try:
         if MONGO_ALLOW_INVALID_CERTS:
-            print("⚠ MongoDB running with invalid TLS certs allowed (development only).")
+            logger.warning("MongoDB running with invalid TLS certs allowed (development only).")
         client = AsyncIOMotorClient(
             MONGO_URI,
             tlsCAFile=certifi.where(),
@@ -26,9 +31,10 @@ else:
             socketTimeoutMS=20000,
             retryWrites=True,
             tlsAllowInvalidCertificates=MONGO_ALLOW_INVALID_CERTS,
+            event_listeners=[MongoCommandMetrics()],
         )
         db = client["stemly_db"]
     except Exception as e:
-        print(f"❌ Critical error initializing MongoDB: {e}")
+        logger.critical("Error initializing MongoDB: %s", e)
         client = None
         db = None
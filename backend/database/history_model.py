@@ -1,15 +1,34 @@
 # backend/database/history_model.py
 
 from datetime import datetime
-from typing import List
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pymongo import ASCENDING
+
+from utils.log import get_logger
 
 from .db import db
 
+logger = get_logger("db")
+
 # Handle case where db is None
 scans_collection = db["scans"] if db is not None else None
 
 
-async def save_scan_history(user_id: str, topic: str, variables: list, image_path: str):
+async def ensure_scan_indexes():
+    if scans_collection is None:
+        return
+    await scans_collection.create_index([("user_id", ASCENDING), ("image_sha256", ASCENDING)])
+
+
+async def save_scan_history(
+    user_id: str,
+    topic: str,
+    variables: list,
+    image_path: str,
+    image_sha256: Optional[str] = None,
+    phash: Optional[str] = None,
+):
     if not user_id:
         raise ValueError("user_id is required to save scan history.")
 
@@ -20,9 +39,13 @@ async def save_scan_history(user_id: str, topic: str, variables: list, image_pat
         "image_path": image_path,
         "timestamp": datetime.utcnow(),
     }
+    if image_sha256:
+        doc["image_sha256"] = image_sha256
+    if phash:
+        doc["phash"] = phash  # 16 hex digits, see utils/phash.py
 
     if scans_collection is None:
-        print("⚠ Database disabled, skipping save_scan_history")
+        logger.debug("Database disabled, skipping save_scan_history")
         return "no-db-record"
 
     result = await scans_collection.insert_one(doc)
@@ -43,4 +66,29 @@ async def get_user_history(user_id: str) -> List[dict]:
         doc["_id"] = str(doc["_id"])
         history.append(doc)
 
-    return history
\ No newline at end of file
+    return history
+
+
+async def get_scans_by_hash(user_id: str, image_hashes: List[str]) -> Dict[str, dict]:
+    """Latest history record of each given image for a user, keyed by image hash."""
+    if scans_collection is None or not user_id or not image_hashes:
+        return {}
+
+    latest: Dict[str, dict] = {}
+    cursor = scans_collection.find(
+        {"user_id": user_id, "image_sha256": {"$in": image_hashes}}
+    ).sort("timestamp", -1)
+    async for doc in cursor:
+        if doc["image_sha256"] not in latest:
+            doc["_id"] = str(doc["_id"])
+            latest[doc["image_sha256"]] = doc
+    return latest
+
+
+async def iter_scan_hashes() -> AsyncIterator[Dict[str, Any]]:
+    """(user_id, image_sha256, image_path, phash) of every hashed scan, for the similar-scan index."""
+    if scans_collection is None:
+        return
+    projection = {"_id": 0, "user_id": 1, "image_sha256": 1, "image_path": 1, "phash": 1}
+    async for doc in scans_collection.find({"phash": {"$exists": True}}, projection):
+        yield doc
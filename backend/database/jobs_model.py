@@ -0,0 +1,208 @@
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+from .db import db
+
+# Handle case where db is None (MongoDB disabled)
+jobs_collection = db["jobs"] if db is not None else None
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+TERMINAL_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+async def ensure_job_indexes():
+    if jobs_collection is None:
+        return
+    await jobs_collection.create_index(
+        [("status", ASCENDING), ("available_at", ASCENDING)]
+    )
+    await jobs_collection.create_index(
+        [("status", ASCENDING), ("lease_expires_at", ASCENDING)]
+    )
+    await jobs_collection.create_index(
+        [("user_id", ASCENDING), ("created_at", DESCENDING)]
+    )
+    # Finished jobs are removed by Mongo once their results expire
+    await jobs_collection.create_index("expires_at", expireAfterSeconds=0)
+
+
+async def enqueue_job(
+    user_id: str, kind: str, params: Dict[str, Any], max_attempts: int = 3
+) -> str:
+    if not user_id:
+        raise ValueError("user_id is required to enqueue a job.")
+    if jobs_collection is None:
+        raise RuntimeError("Job queue requires MongoDB.")
+
+    now = datetime.utcnow()
+    job_id = uuid.uuid4().hex
+    await jobs_collection.insert_one(
+        {
+            "_id": job_id,
+            "user_id": user_id,
+            "kind": kind,
+            "params": params,
+            "status": JOB_QUEUED,
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "available_at": now,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+    )
+    return job_id
+
+
+async def claim_job(
+    worker_id: str, kinds: List[str], lease_seconds: float
+) -> Optional[dict]:
+    """
+    Atomically lease the oldest runnable job: a queued one whose retry delay has
+    passed, or a running one whose worker stopped renewing its lease and that
+    still has attempts left (``fail_abandoned_jobs`` fails the rest).
+    """
+    if jobs_collection is None:
+        return None
+
+    now = datetime.utcnow()
+    return await jobs_collection.find_one_and_update(
+        {
+            "kind": {"$in": kinds},
+            "$or": [
+                {"status": JOB_QUEUED, "available_at": {"$lte": now}},
+                {
+                    "status": JOB_RUNNING,
+                    "lease_expires_at": {"$lt": now},
+                    "$expr": {"$lt": ["$attempts", "$max_attempts"]},
+                },
+            ],
+        },
+        {
+            "$set": {
+                "status": JOB_RUNNING,
+                "lease_owner": worker_id,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def renew_lease(job_id: str, worker_id: str, lease_seconds: float) -> bool:
+    """Extend a lease; False means another worker has taken the job over."""
+    now = datetime.utcnow()
+    result = await jobs_collection.update_one(
+        {"_id": job_id, "status": JOB_RUNNING, "lease_owner": worker_id},
+        {
+            "$set": {
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "updated_at": now,
+            }
+        },
+    )
+    return result.modified_count == 1
+
+
+async def complete_job(
+    job_id: str, worker_id: str, result: Any, retention_seconds: float
+) -> bool:
+    now = datetime.utcnow()
+    update = await jobs_collection.update_one(
+        {"_id": job_id, "status": JOB_RUNNING, "lease_owner": worker_id},
+        {
+            "$set": {
+                "status": JOB_SUCCEEDED,
+                "result": result,
+                "error": None,
+                "lease_owner": None,
+                "lease_expires_at": None,
+                "updated_at": now,
+                "expires_at": now + timedelta(seconds=retention_seconds),
+            }
+        },
+    )
+    return update.modified_count == 1
+
+
+async def fail_job(
+    job_id: str,
+    worker_id: str,
+    error: str,
+    retry_delay: Optional[float],
+    retention_seconds: float,
+) -> bool:
+    """Requeue the job after ``retry_delay`` seconds, or mark it failed if None."""
+    now = datetime.utcnow()
+    if retry_delay is not None:
+        fields = {
+            "status": JOB_QUEUED,
+            "available_at": now + timedelta(seconds=retry_delay),
+        }
+    else:
+        fields = {
+            "status": JOB_FAILED,
+            "expires_at": now + timedelta(seconds=retention_seconds),
+        }
+    update = await jobs_collection.update_one(
+        {"_id": job_id, "status": JOB_RUNNING, "lease_owner": worker_id},
+        {
+            "$set": {
+                **fields,
+                "error": error,
+                "lease_owner": None,
+                "lease_expires_at": None,
+                "updated_at": now,
+            }
+        },
+    )
+    return update.modified_count == 1
+
+
+async def fail_abandoned_jobs(retention_seconds: float) -> int:
+    """
+    Mark running jobs whose lease lapsed on their last attempt as failed, so a
+    job that crashes or hangs its worker is not retried forever.
+    """
+    if jobs_collection is None:
+        return 0
+    now = datetime.utcnow()
+    update = await jobs_collection.update_many(
+        {
+            "status": JOB_RUNNING,
+            "lease_expires_at": {"$lt": now},
+            "$expr": {"$gte": ["$attempts", "$max_attempts"]},
+        },
+        {
+            "$set": {
+                "status": JOB_FAILED,
+                "error": "Worker stopped responding on the final attempt (lease expired).",
+                "lease_owner": None,
+                "lease_expires_at": None,
+                "updated_at": now,
+                "expires_at": now + timedelta(seconds=retention_seconds),
+            }
+        },
+    )
+    return update.modified_count
+
+
+async def get_job(job_id: str, user_id: str) -> Optional[dict]:
+    if jobs_collection is None:
+        return None
+    return await jobs_collection.find_one(
+        {"_id": job_id, "user_id": user_id},
+        {"params": 0, "lease_owner": 0},
+    )
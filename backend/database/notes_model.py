@@ -1,8 +1,12 @@
 from datetime import datetime
 from typing import Any, Dict, Optional
 
+from utils.log import get_logger
+
 from .db import db
 
+logger = get_logger("db")
+
 # Handle case where db is None
 notes_collection = db["notes"] if db is not None else None
 
@@ -25,7 +29,7 @@ async def save_notes_entry(
     }
 
     if notes_collection is None:
-        print("⚠ Database disabled, skipping save_notes_entry")
+        logger.debug("Database disabled, skipping save_notes_entry")
         return "no-db-record"
 
     result = await notes_collection.insert_one(doc)
@@ -0,0 +1,122 @@
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .db import db
+
+# Handle case where db is None (MongoDB disabled)
+quiz_bank_collection = db["quiz_bank"] if db is not None else None
+# One document per (topic, difficulty) that students have asked for; the
+# refill worker keeps each of them stocked.
+quiz_bank_topics_collection = db["quiz_bank_topics"] if db is not None else None
+
+
+def question_hash(topic_key: str, difficulty: str, question: str) -> str:
+    normalized = " ".join(question.split()).lower()
+    return hashlib.sha256(
+        f"{topic_key}|{difficulty}|{normalized}".encode("utf-8")
+    ).hexdigest()
+
+
+async def ensure_quiz_bank_indexes():
+    if quiz_bank_collection is None:
+        return
+    await quiz_bank_collection.create_index(
+        [("topic_key", ASCENDING), ("difficulty", ASCENDING)]
+    )
+    await quiz_bank_collection.create_index("question_hash", unique=True)
+    await quiz_bank_topics_collection.create_index([("request_count", DESCENDING)])
+
+
+async def sample_questions(topic_key: str, difficulty: str, count: int) -> List[dict]:
+    """Random sample of up to ``count`` banked questions for a topic."""
+    if quiz_bank_collection is None:
+        return []
+
+    pipeline = [
+        {"$match": {"topic_key": topic_key, "difficulty": difficulty}},
+        {"$sample": {"size": count}},
+        {
+            "$project": {
+                "_id": 0,
+                "question": 1,
+                "options": 1,
+                "correct_index": 1,
+                "explanation": 1,
+                "takeaway": 1,
+            }
+        },
+    ]
+    return [doc async for doc in quiz_bank_collection.aggregate(pipeline)]
+
+
+async def count_questions(topic_key: str, difficulty: str) -> int:
+    if quiz_bank_collection is None:
+        return 0
+    return await quiz_bank_collection.count_documents(
+        {"topic_key": topic_key, "difficulty": difficulty}
+    )
+
+
+async def insert_questions(
+    topic_key: str, topic: str, difficulty: str, questions: List[dict]
+) -> int:
+    """Add questions to the bank, skipping ones already stored. Returns how many were new."""
+    if quiz_bank_collection is None or not questions:
+        return 0
+
+    now = datetime.utcnow()
+    docs = [
+        {
+            **q,
+            "topic_key": topic_key,
+            "topic": topic,
+            "difficulty": difficulty,
+            "question_hash": question_hash(topic_key, difficulty, q["question"]),
+            "created_at": now,
+        }
+        for q in questions
+    ]
+    try:
+        result = await quiz_bank_collection.insert_many(docs, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        # Duplicate questions are expected; everything else was still inserted
+        return e.details.get("nInserted", 0)
+
+
+async def record_topic_demand(demand: Dict[Tuple[str, str], Tuple[str, int]]):
+    """Add request counts, {(topic_key, difficulty): (topic, requests)}, in one bulk write."""
+    if quiz_bank_topics_collection is None or not demand:
+        return
+    now = datetime.utcnow()
+    await quiz_bank_topics_collection.bulk_write(
+        [
+            UpdateOne(
+                {"_id": f"{topic_key}|{difficulty}"},
+                {
+                    "$set": {
+                        "topic_key": topic_key,
+                        "difficulty": difficulty,
+                        "last_requested": now,
+                    },
+                    "$setOnInsert": {"topic": topic},
+                    "$inc": {"request_count": requests},
+                },
+                upsert=True,
+            )
+            for (topic_key, difficulty), (topic, requests) in demand.items()
+        ],
+        ordered=False,
+    )
+
+
+async def get_demanded_topics(limit: int = 50) -> List[Dict]:
+    """Most-requested (topic, difficulty) pairs, busiest first."""
+    if quiz_bank_topics_collection is None:
+        return []
+    cursor = quiz_bank_topics_collection.find({}).sort("request_count", -1).limit(limit)
+    return [doc async for doc in cursor]
@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .db import db
+
+# Handle case where db is None (MongoDB disabled)
+# One document per distinct scan image, keyed by the SHA-256 of its bytes
+scan_detections_collection = db["scan_detections"] if db is not None else None
+
+
+async def get_detection(image_sha256: str) -> Optional[Dict[str, Any]]:
+    if scan_detections_collection is None:
+        return None
+    return await scan_detections_collection.find_one(
+        {"_id": image_sha256}, {"topic": 1, "variables": 1}
+    )
+
+
+async def save_detection(image_sha256: str, topic: str, variables: List[str]) -> None:
+    if scan_detections_collection is None:
+        return
+    now = datetime.utcnow()
+    await scan_detections_collection.update_one(
+        {"_id": image_sha256},
+        {
+            "$set": {"topic": topic, "variables": variables, "updated_at": now},
+            "$setOnInsert": {"created_at": now},
+        },
+        upsert=True,
+    )
@@ -1,8 +1,12 @@
 from datetime import datetime
 from typing import Dict, Optional
 
+from utils.log import get_logger
+
 from .db import db
 
+logger = get_logger("db")
+
 # Handle case where db is None (MongoDB disabled)
 users_collection = db["users"] if db is not None else None
 
@@ -46,7 +50,7 @@ async def record_user_login(user_info: Dict[str, Optional[str]]):
         )
     except Exception as e:
         # DB Error should not block the user from using the app
-        print(f"⚠ WARNING: Failed to record user login: {e}")
+        logger.warning("Failed to record user login: %s", e, extra={"user_id": uid})
         return
 
 
@@ -1,8 +1,12 @@
 from datetime import datetime
 from typing import Any, Dict, List
 
+from utils.log import get_logger
+
 from .db import db
 
+logger = get_logger("db")
+
 # Handle case where db is None
 visualiser_collection = db["visualiser"] if db is not None else None
 
@@ -19,7 +23,7 @@ async def save_visualiser_entry(user_id: str, template_id: str, parameters: Dict
     }
 
     if visualiser_collection is None:
-        print("⚠ Database disabled, skipping save_visualiser_entry")
+        logger.debug("Database disabled, skipping save_visualiser_entry")
         return "no-db-record"
 
     result = await visualiser_collection.insert_one(doc)
@@ -1,16 +1,85 @@
-from fastapi import FastAPI
+import secrets
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 # Routers
 from auth import auth_router
-from routers import notes, scan, visualiser, visualiser_engine, chat
+from routers import notes, scan, visualiser, visualiser_engine, chat, jobs
 from routers.quiz_router import router as quiz_router
+from config import (
+    JOB_WORKER_CONCURRENCY,
+    METRICS_ENABLED,
+    METRICS_TOKEN,
+    QUIZ_BANK_ENABLED,
+    is_ai_enabled,
+)
+from database.jobs_model import ensure_job_indexes, jobs_collection
+from database.history_model import ensure_scan_indexes, scans_collection
+from database.quiz_bank_model import ensure_quiz_bank_indexes, quiz_bank_collection
+from services.ai_quiz import generate_question_batch
+from services.llm_gateway import close_client
+from services import metrics
+from services.job_queue import create_worker
+from services.prompt_registry import prompt_registry
+from services.quiz_bank import quiz_bank_refiller
+from services.similar_scans import similar_scans
+from services.storage import UploadSizeLimit
+from utils.log import get_logger, shutdown_logging
+
+logger = get_logger("app")
+
+
+# ----------------------------
+# Lifespan (startup / shutdown)
+# ----------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if QUIZ_BANK_ENABLED and quiz_bank_collection is not None:
+        try:
+            await ensure_quiz_bank_indexes()
+        except Exception as e:
+            logger.warning("Could not create quiz bank indexes: %s", e)
+        if is_ai_enabled():
+            quiz_bank_refiller.start(generate_question_batch)
+
+    if scans_collection is not None:
+        try:
+            await ensure_scan_indexes()
+        except Exception as e:
+            logger.warning("Could not create scan indexes: %s", e)
+        similar_scans.start()
+
+    job_worker = None
+    if jobs_collection is not None:
+        try:
+            await ensure_job_indexes()
+        except Exception as e:
+            logger.warning("Could not create job indexes: %s", e)
+        if JOB_WORKER_CONCURRENCY > 0:
+            job_worker = create_worker(JOB_WORKER_CONCURRENCY)
+            job_worker.start()
+
+    yield
+
+    if job_worker is not None:
+        await job_worker.stop()
+    await quiz_bank_refiller.stop()
+    await similar_scans.stop()
+    await prompt_registry.close()
+    saved = prompt_registry.stats()["input_tokens_saved"]
+    logger.info("Prompt caching saved %d input tokens this run", saved, extra={"input_tokens_saved": saved})
+    # Release pooled keep-alive connections to the LLM providers
+    await close_client()
+    shutdown_logging()
+
 
 # ----------------------------
 # App Initialization
 # ----------------------------
-app = FastAPI(title="Stemly Backend")
+app = FastAPI(title="Stemly Backend", lifespan=lifespan)
 
 # ----------------------------
 # CORS (Flutter Friendly)
@@ -23,6 +92,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized scans from Content-Length before the multipart body is read
+app.add_middleware(UploadSizeLimit, paths={"/scan/upload"})
+
+# ----------------------------
+# Metrics (Prometheus, GET /metrics)
+# ----------------------------
+if METRICS_ENABLED:
+    app.add_middleware(metrics.RequestLatency)
+
+    @app.get("/metrics", include_in_schema=False)
+    def prometheus_metrics(authorization: str = Header(None)):
+        if METRICS_TOKEN and not secrets.compare_digest(
+            (authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode()
+        ):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+        body, content_type = metrics.render()
+        return Response(content=body, media_type=content_type)
+
 # ----------------------------
 # Static Files
 # ----------------------------
@@ -40,6 +127,7 @@ app.include_router(visualiser_engine.router)
 # NEW: Quiz router (prefix already defined in quiz_router.py)
 app.include_router(quiz_router)
 app.include_router(chat.router)
+app.include_router(jobs.router)
 
 # ----------------------------
 # Root Route
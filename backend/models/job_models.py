@@ -0,0 +1,27 @@
+from datetime import datetime
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field
+
+from models.quiz import MAX_QUIZ_QUESTIONS
+
+
+class QuizJobRequest(BaseModel):
+    topic: str
+    count: int = Field(5, ge=1, le=MAX_QUIZ_QUESTIONS)
+    difficulty: str = "mixed"
+
+
+class ImageJobRequest(BaseModel):
+    prompt: str
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    attempts: int
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
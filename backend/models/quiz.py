@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 
@@ -29,3 +29,17 @@ class QuizResult(BaseModel):
     score: int
     total: int
     correct_questions: List[int]
+
+
+# generate_quiz_with_ai only honours counts in this range
+MAX_QUIZ_QUESTIONS = 20
+
+
+class QuizBatchItem(BaseModel):
+    topic: str
+    count: int = Field(5, ge=1, le=MAX_QUIZ_QUESTIONS)
+
+
+class QuizBatchRequest(BaseModel):
+    items: List[QuizBatchItem]
+    difficulty: str = "mixed"
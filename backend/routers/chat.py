@@ -4,9 +4,11 @@ from typing import Optional, Dict, Any
 from auth.auth_middleware import require_firebase_user
 from config import OLLAMA_BASE_URL, LOCAL_MODEL
 from pydantic import Field
-import json
-import re
-import requests
+from services.llm_gateway import post_json
+from utils.json_stream import parse_model
+from utils.log import get_logger, log_payload
+
+logger = get_logger("api")
 
 router = APIRouter(
     prefix="/chat",
@@ -34,18 +36,6 @@ class ChatResponse(BaseModel):
     )
 
 
-def clean_json_output(text: str):
-    """Remove markdown code blocks from JSON output."""
-    text = text.strip()
-    text = re.sub(r"```json", "", text)
-    text = re.sub(r"```", "", text)
-    text = text.strip()
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        return None
-
-
 async def handle_unified_chat(
     user_prompt: str,
     topic: str,
@@ -99,14 +89,14 @@ async def handle_unified_chat(
     }
     
     try:
-        r = requests.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload, timeout=120)
+        r = await post_json(f"{OLLAMA_BASE_URL}/api/generate", payload, timeout=120)
         r.raise_for_status()
         data = r.json()
         raw = data.get("response", "")
         
-        parsed = clean_json_output(raw)
+        parsed = parse_model(raw, ChatResponse)
         if parsed:
-            return ChatResponse(**parsed)
+            return parsed
         else:
             return ChatResponse(
                 response="I'm sorry, I couldn't process that.",
@@ -114,7 +104,7 @@ async def handle_unified_chat(
             )
 
     except Exception as e:
-        print(f"❌ Chat Error: {e}")
+        logger.error("Chat error: %s", e)
         return ChatResponse(
             response="Error communicating with AI Assistant.",
             update_type="explanation"
@@ -128,10 +118,8 @@ async def chat_ask(
     x_ai_api_key: str = Header(None, alias="X-AI-API-Key")
 ):
     user_id = request.state.user["uid"]
-    print(f"💬 Chat request from {user_id}: {req.user_prompt}")
-    
-    if x_ai_api_key:
-        print(f"DEBUG: Using custom AI API Key: {x_ai_api_key[:5]}...")
+    logger.info("Chat request", extra={"user_id": user_id, "topic": req.topic, "user_key": bool(x_ai_api_key)})
+    log_payload(logger, "Chat prompt", req.user_prompt, user_id=user_id)
 
     response = await handle_unified_chat(
         user_prompt=req.user_prompt,
@@ -0,0 +1,146 @@
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from auth.auth_middleware import require_firebase_user
+from config import JOB_MAX_ATTEMPTS
+from database.jobs_model import TERMINAL_STATUSES, enqueue_job, get_job, jobs_collection
+from models.job_models import ImageJobRequest, JobStatusResponse, QuizJobRequest
+from models.notes_models import NotesGenerateRequest
+from utils.file_utils import resolve_scan_path, scan_path_to_relative
+from utils.log import get_logger
+from utils.sse import SSE_HEADERS, format_sse
+
+logger = get_logger("api")
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["Jobs"],
+    dependencies=[Depends(require_firebase_user)],
+)
+
+EVENTS_POLL_INTERVAL = 1.0
+EVENTS_MAX_SECONDS = 15 * 60
+KEEPALIVE_SECONDS = 15
+
+
+async def _enqueue(request: Request, kind: str, params: dict) -> dict:
+    if jobs_collection is None:
+        raise HTTPException(
+            status_code=503, detail="Background jobs require the database."
+        )
+    try:
+        job_id = await enqueue_job(
+            request.state.user["uid"], kind, params, max_attempts=JOB_MAX_ATTEMPTS
+        )
+    except Exception as e:
+        logger.error("Error enqueueing %s job: %s", kind, e)
+        raise HTTPException(status_code=500, detail="Failed to enqueue job.")
+    return {"job_id": job_id, "status": "queued"}
+
+
+def _to_response(job: dict) -> dict:
+    return JobStatusResponse(
+        job_id=job["_id"],
+        kind=job["kind"],
+        status=job["status"],
+        attempts=job.get("attempts", 0),
+        result=job.get("result"),
+        error=job.get("error"),
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+    ).model_dump(mode="json")
+
+
+# -----------------------------------------
+# Enqueue
+# -----------------------------------------
+# Jobs run with the server's Gemini key pool: per-request X-AI-API-Key
+# headers are deliberately not persisted to the queue.
+
+
+@router.post("/notes", status_code=202)
+async def enqueue_notes_job(req: NotesGenerateRequest, request: Request):
+    image_path = req.image_path
+    if image_path:
+        try:
+            image_path = scan_path_to_relative(resolve_scan_path(image_path))
+        except ValueError:
+            pass  # Be lenient for invalid paths, like /notes/generate
+    return await _enqueue(
+        request,
+        "notes",
+        {
+            "topic": req.topic,
+            "variables": req.variables,
+            "image_path": image_path,
+            "ocr_text": req.ocr_text,
+        },
+    )
+
+
+@router.post("/quiz", status_code=202)
+async def enqueue_quiz_job(req: QuizJobRequest, request: Request):
+    return await _enqueue(request, "quiz", req.model_dump())
+
+
+@router.post("/image", status_code=202)
+async def enqueue_image_job(req: ImageJobRequest, request: Request):
+    return await _enqueue(request, "image", req.model_dump())
+
+
+# -----------------------------------------
+# Status (poll) and events (push)
+# -----------------------------------------
+
+
+@router.get("/{job_id}")
+async def get_job_status(job_id: str, request: Request):
+    job = await get_job(job_id, request.state.user["uid"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return _to_response(job)
+
+
+@router.get("/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events: a `status` event whenever the job changes state and a
+    final `done` event (same body as GET /jobs/{job_id}) once it has finished.
+    """
+    user_id = request.state.user["uid"]
+    job = await get_job(job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def event_stream():
+        current = job
+        last_status = None
+        loop = asyncio.get_running_loop()
+        started = last_sent = loop.time()
+        while True:
+            if current is None:
+                yield format_sse("error", {"detail": "Job not found."})
+                return
+            if current["status"] in TERMINAL_STATUSES:
+                yield format_sse("done", _to_response(current))
+                return
+            if current["status"] != last_status:
+                last_status = current["status"]
+                last_sent = loop.time()
+                yield format_sse("status", _to_response(current))
+            elif loop.time() - last_sent >= KEEPALIVE_SECONDS:
+                last_sent = loop.time()
+                yield ": keep-alive\n\n"
+            if (
+                loop.time() - started > EVENTS_MAX_SECONDS
+                or await request.is_disconnected()
+            ):
+                return
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+            current = await get_job(job_id, user_id)
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream", headers=SSE_HEADERS
+    )
@@ -1,11 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Header
+from fastapi.responses import StreamingResponse
 
 from auth.auth_middleware import require_firebase_user
 from config import FALLBACK_GROQ_API_KEY
 from database.notes_model import save_notes_entry
 from models.notes_models import NotesFollowUpRequest, NotesGenerateRequest
-from services.ai_notes import follow_up_notes, generate_notes
+from services.ai_notes import follow_up_notes, generate_notes, stream_notes
 from utils.file_utils import resolve_scan_path, scan_path_to_relative
+from utils.log import get_logger
+from utils.sse import SSE_HEADERS, format_sse
+
+logger = get_logger("api")
 
 router = APIRouter(
     prefix="/notes",
@@ -54,17 +59,68 @@ async def generate_notes_route(
                 image_path=relative_path or req.image_path,
             )
         except Exception as db_err:
-             print(f"⚠ Non-critical DB Error (Notes Save Failed): {db_err}")
+             logger.warning("Notes save failed: %s", db_err, extra={"user_id": user_id})
 
         # Wrap response to match Flutter's expected format
         return {"notes": notes.dict()}
 
     except Exception as e:
-        print("❌ Error in /notes/generate:", e)
+        logger.exception("Error in /notes/generate: %s", e)
         raise HTTPException(status_code=500, detail="Failed to generate notes.")
 
 
 
+# -----------------------------------------
+# 1b. Generate Full Notes (streamed)
+# -----------------------------------------
+
+@router.post("/generate/stream")
+async def generate_notes_stream_route(
+    req: NotesGenerateRequest,
+    request: Request,
+    x_ai_api_key: str = Header(None, alias="X-AI-API-Key"),
+    x_groq_api_key: str = Header(None, alias="x-groq-api-key")
+):
+    """
+    Same as /notes/generate, but sent as Server-Sent Events: one `section`
+    event per notes field as soon as Gemini finishes it, then a `done` event
+    with the full notes document.
+    """
+    api_key_to_use = x_ai_api_key or x_groq_api_key or FALLBACK_GROQ_API_KEY
+
+    relative_path = None
+    if req.image_path:
+        try:
+            relative_path = scan_path_to_relative(resolve_scan_path(req.image_path))
+        except ValueError:
+            relative_path = None
+
+    user_id = request.state.user["uid"]
+
+    async def event_stream():
+        try:
+            async for event, data in stream_notes(req.topic, req.variables, ocr_text=req.ocr_text, api_key=api_key_to_use):
+                if event != "done":
+                    yield format_sse(event, data)
+                    continue
+
+                try:
+                    await save_notes_entry(
+                        user_id=user_id,
+                        topic=req.topic,
+                        notes_payload=data.dict(),
+                        image_path=relative_path or req.image_path,
+                    )
+                except Exception as db_err:
+                    logger.warning("Notes save failed: %s", db_err, extra={"user_id": user_id})
+                yield format_sse("done", {"notes": data.dict()})
+        except Exception as e:
+            logger.exception("Error in /notes/generate/stream: %s", e)
+            yield format_sse("error", {"detail": "Failed to generate notes."})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 # -----------------------------------------
 # 2. Follow-up Question
 # -----------------------------------------
@@ -100,11 +156,11 @@ async def follow_up_notes_route(
                 image_path=image_reference,
             )
         except Exception as db_err:
-             print(f"⚠ Non-critical DB Error (Follow-up Save Failed): {db_err}")
+             logger.warning("Follow-up notes save failed: %s", db_err)
 
         # Wrap response to match Flutter's expected format
         return {"notes": notes.dict()}
 
     except Exception as e:
-        print("❌ Error in /notes/ask:", e)
+        logger.exception("Error in /notes/ask: %s", e)
         raise HTTPException(status_code=500, detail="Failed to process follow-up question.")
@@ -1,7 +1,12 @@
 from fastapi import APIRouter, Query, Depends, Header, HTTPException
 from services.quiz_service import QuizService
-from services.ai_quiz import generate_quiz_with_ai
+from services.ai_quiz import generate_quiz_batch, generate_quiz_with_ai
+from models.quiz import QuizBatchRequest
+from config import QUIZ_BATCH_MAX_TOPICS
 from auth.auth_middleware import require_firebase_user
+from utils.log import get_logger
+
+logger = get_logger("api")
 
 router = APIRouter(
     prefix="/quiz",
@@ -21,23 +26,53 @@ async def get_static_questions(topic_id: int, count: int = Query(10)):
 async def ai_generate_quiz(
     topic: str, 
     count: int = 5,
+    difficulty: str = "mixed",
     x_ai_api_key: str = Header(None, alias="X-AI-API-Key"),
     x_groq_api_key: str = Header(None, alias="x-groq-api-key")
 ):
     """
-    Generates fresh questions using AI.
+    Serves questions from the quiz bank, or generates fresh ones using AI.
     """
     # Use X-AI-API-Key first (from Flutter), then legacy header
     api_key_to_use = x_ai_api_key or x_groq_api_key
 
     try:
-        ai_quiz = await generate_quiz_with_ai(topic, count, api_key=api_key_to_use)
+        ai_quiz = await generate_quiz_with_ai(topic, count, api_key=api_key_to_use, difficulty=difficulty)
         return ai_quiz
     except Exception as e:
-        print(f"❌ Error generating quiz: {e}")
+        logger.exception("Error generating quiz: %s", e, extra={"topic": topic})
         raise HTTPException(status_code=500, detail="Failed to generate quiz")
 
 
+@router.post("/batch")
+async def ai_generate_quiz_batch(
+    payload: QuizBatchRequest,
+    x_ai_api_key: str = Header(None, alias="X-AI-API-Key"),
+    x_groq_api_key: str = Header(None, alias="x-groq-api-key")
+):
+    """
+    Generates quizzes for several topics in one request (e.g. a revision pack).
+    Returns {"quizzes": {topic: quiz}}.
+    """
+    if not payload.items:
+        raise HTTPException(status_code=400, detail="At least one topic is required")
+    if len(payload.items) > QUIZ_BATCH_MAX_TOPICS:
+        raise HTTPException(status_code=400, detail=f"At most {QUIZ_BATCH_MAX_TOPICS} topics per batch")
+
+    api_key_to_use = x_ai_api_key or x_groq_api_key
+
+    try:
+        quizzes = await generate_quiz_batch(
+            [(item.topic, item.count) for item in payload.items],
+            api_key=api_key_to_use,
+            difficulty=payload.difficulty,
+        )
+        return {"quizzes": quizzes}
+    except Exception as e:
+        logger.exception("Error generating quiz batch: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to generate quiz batch")
+
+
 @router.post("/submit")
 def submit_static_quiz(payload):
     return service.evaluate(payload)
@@ -1,9 +1,19 @@
-from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile, Header, Form
+import asyncio
+
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile, Header, Form, Query
 
 from auth.auth_middleware import require_firebase_user
-from database.history_model import get_user_history, save_scan_history
+from config import SCAN_DEADLINE_SECONDS
+from database.history_model import get_scans_by_hash, get_user_history, save_scan_history
 from services.ai_detector import detect_topic
-from services.scan_service import save_scan
+from services.deadline import request_deadline
+from services.similar_scans import similar_scans
+from services.storage import UploadError, save_scan, sync_scan
+from utils.file_utils import resolve_scan_path
+from utils.log import get_logger, log_payload
+from utils.phash import to_hex
+
+logger = get_logger("api")
 
 router = APIRouter(
     dependencies=[Depends(require_firebase_user)],
@@ -20,46 +30,78 @@ async def upload_scan(
 ):
     user_id = request.state.user["uid"]
     
-    print(f"DEBUG: upload_scan starting for user {user_id}")
-    if x_ai_api_key:
-        print(f"DEBUG: Received AI API Key: {x_ai_api_key[:5]}...")
-    
-    print(f"DEBUG: OCR Text received: {ocr_text[:50]}...")
+    logger.debug(
+        "upload_scan starting",
+        extra={"user_id": user_id, "ocr_chars": len(ocr_text), "user_key": bool(x_ai_api_key)},
+    )
+    log_payload(logger, "OCR text received", ocr_text, user_id=user_id)
 
-    # 1. Save File (still useful for history/debugging)
-    try:
-        saved_path = await save_scan(file)
-    except Exception as exc:
-        print(f"❌ Error saving scan: {exc}")
-        raise HTTPException(status_code=500, detail="Failed to save image") from exc
+    # The time budget covers saving and detection; history is saved regardless
+    with request_deadline(SCAN_DEADLINE_SECONDS):
+        # 1. Save File (streamed to disk in chunks)
+        try:
+            stored = await save_scan(file)
+        except UploadError as exc:
+            raise HTTPException(status_code=exc.status_code, detail=str(exc)) from exc
+        except Exception as exc:
+            logger.exception("Error saving scan: %s", exc, extra={"user_id": user_id})
+            raise HTTPException(status_code=500, detail="Failed to save image") from exc
 
-    # 2. Detect Topic (using LOCAL OLLAMA)
-    try:
-        # We pass ocr_text AND the saved image path for Vision fallback
-        topic, variables = await detect_topic(ocr_text, image_path=saved_path, api_key=x_ai_api_key)
-        print(f"DEBUG: Local AI success: {topic}, {variables}")
-    except Exception as exc:
-        print(f"❌ Error detecting topic: {exc}")
-        topic = "Unknown"
-        variables = []
+        # fsync runs while the image is hashed and detected
+        syncing = asyncio.create_task(sync_scan(stored))
+        try:
+            # Hashing and vision read the just-written file through a memory map
+            view = stored.view()
+            phash = await similar_scans.compute(view)
+
+            # 2. Detect Topic (Gemini text/vision, keyword fallback), bounded by the scan's deadline
+            try:
+                topic, variables = await detect_topic(
+                    ocr_text,
+                    image_path=stored.path,
+                    api_key=x_ai_api_key,
+                    image_sha256=stored.sha256,
+                    phash=phash,
+                    image_view=view,
+                )
+                logger.info(
+                    "Scan topic detected: %s", topic, extra={"user_id": user_id, "topic": topic, "variables": variables}
+                )
+            except Exception as exc:
+                logger.exception("Error detecting topic: %s", exc, extra={"user_id": user_id})
+                topic = "Unknown"
+                variables = []
+
+            try:
+                await syncing
+            except Exception as exc:
+                logger.exception("Error saving scan: %s", exc, extra={"user_id": user_id})
+                raise HTTPException(status_code=500, detail="Failed to save image") from exc
+        finally:
+            # Never leave the task orphaned (error or client disconnect above)
+            syncing.cancel()
+            await asyncio.gather(syncing, return_exceptions=True)
 
     # 3. Save History (Skip if DB is disabled, which is handled inside save_scan_history)
     try:
         record_id = await save_scan_history(
             user_id=user_id,
-            image_path=saved_path,
+            image_path=stored.path,
             topic=topic,
             variables=variables,
+            image_sha256=stored.sha256,
+            phash=to_hex(phash) if phash is not None else None,
         )
     except Exception as exc:
-        print(f"⚠ Warning: Failed to save scan history: {exc}")
+        logger.warning("Failed to save scan history: %s", exc, extra={"user_id": user_id})
         record_id = "error-saving-history"
+    similar_scans.add(user_id, stored.sha256, stored.path, phash)
 
     return {
         "status": "success",
         "topic": topic,
         "variables": variables,
-        "image_path": saved_path,
+        "image_path": stored.path,
         "history_id": record_id,
     }
 
@@ -71,6 +113,39 @@ async def history(request: Request):
     return {"history": history_data}
 
 
+@router.get("/similar")
+async def similar(
+    request: Request,
+    image_path: str = Query(..., description="image_path of a stored scan"),
+    limit: int = Query(10, ge=1, le=50),
+):
+    """The user's past scans that look like the given one (perceptual hash), nearest first."""
+    user_id = request.state.user["uid"]
+    try:
+        path = resolve_scan_path(image_path)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    phash = await similar_scans.compute(str(path))
+    if phash is None:
+        return {"similar": []}
+
+    matches = similar_scans.similar_for_user(user_id, phash, exclude_sha256=path.stem, limit=limit)
+    records = await get_scans_by_hash(user_id, [ref.image_sha256 for _, ref in matches])
+    results = []
+    for distance, ref in matches:
+        record = records.get(ref.image_sha256, {})
+        results.append({
+            "image_path": ref.image_path,
+            "distance": distance,
+            "history_id": record.get("_id"),
+            "topic": record.get("topic"),
+            "variables": record.get("variables", []),
+            "timestamp": record.get("timestamp"),
+        })
+    return {"similar": results}
+
+
 @router.get("/ping")
 def ping():
     return {"message": "Backend Connected Successfully!"}
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, Request, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 
@@ -9,7 +10,11 @@ from database.visualiser_model import (
 )
 from models.visualiser_models import VisualiserSaveRequest
 from services.ai_visualiser import generate_visualiser_image
-from services.ai_chat import process_visualiser_chat
+from services.ai_chat import process_visualiser_chat, stream_visualiser_chat
+from utils.log import get_logger
+from utils.sse import SSE_HEADERS, format_sse
+
+logger = get_logger("visualiser")
 
 # -----------------------------------------------------
 # ROUTER CONFIG
@@ -87,7 +92,7 @@ def generate_interactive_template(payload: VisualiserGenerateRequest):
     topic = payload.topic.strip().lower()
     variables = [str(v).lower() for v in payload.variables]
     
-    print(f"DEBUG VISUALISER: Raw='{topic_raw}', Cleaned='{topic}', Vars={variables}")
+    logger.debug("Template lookup: raw=%r cleaned=%r vars=%s", topic_raw, topic, variables)
 
     # =================================================
     # 1. CHEMISTRY: MOLECULES (Generic Diagram)
@@ -236,7 +241,7 @@ def generate_interactive_template(payload: VisualiserGenerateRequest):
     # =================================================
     # 9. FALLBACK
     # =================================================
-    print("DEBUG VISUALISER: No match found. Returning fallback.")
+    logger.debug("No template match for %r. Returning fallback.", topic)
     return {
         "template": {
             "templateId": "general_topic",
@@ -296,9 +301,6 @@ async def visualiser_chat(payload: VisualiserChatRequest, request: Request, x_ai
     """
     history = [{"text": m.text, "isUser": m.isUser} for m in payload.history] if payload.history else []
     
-    if x_ai_api_key:
-        print(f"💬 Chat using AI key: {x_ai_api_key[:8]}...")
-    
     result = await process_visualiser_chat(
         user_message=payload.message,
         topic=payload.topic,
@@ -308,3 +310,29 @@ async def visualiser_chat(payload: VisualiserChatRequest, request: Request, x_ai
     )
     
     return result
+
+
+@router.post("/chat/stream")
+async def visualiser_chat_stream(payload: VisualiserChatRequest, request: Request, x_ai_api_key: str = Header(None, alias="X-AI-API-Key")):
+    """
+    Streaming AI Chat for the visualiser (Server-Sent Events).
+    Sends `token` events with explanation text as it is generated, then a
+    `done` event with the same JSON /visualiser/chat returns.
+    """
+    history = [{"text": m.text, "isUser": m.isUser} for m in payload.history] if payload.history else []
+
+    async def event_stream():
+        try:
+            async for event, data in stream_visualiser_chat(
+                user_message=payload.message,
+                topic=payload.topic,
+                parameters=payload.parameters,
+                chat_history=history,
+                api_key=x_ai_api_key
+            ):
+                yield format_sse(event, data)
+        except Exception as e:
+            logger.exception("Error in /visualiser/chat/stream: %s", e)
+            yield format_sse("done", {"type": "chat", "message": "Sorry, I encountered an error. Please try again."})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
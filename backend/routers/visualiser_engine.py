@@ -5,6 +5,9 @@ from typing import Dict, Any, Optional
 from services.visualiser_loader import get_template_by_topic, fill_template_defaults
 from database.visualiser_model import save_visualiser_entry, get_visualiser_entries
 from auth.auth_middleware import require_firebase_user
+from utils.log import get_logger
+
+logger = get_logger("api")
 
 router = APIRouter(
     prefix="/visualiser",
@@ -67,7 +70,7 @@ async def update_visualiser(
         
         if not api_key_to_use:
              # Just warn or fail? Fail is better if user expects AI.
-             print("⚠ Missing API Key for visual update")
+             logger.warning("Missing API key for visual update")
              ai_response = "Please configure Groq API Key in Settings to use AI features."
         else:
             try:
@@ -81,13 +84,13 @@ async def update_visualiser(
                 )
                 updated = ai_result.get("updated_parameters", {})
                 ai_response = ai_result.get("ai_response", "Updated parameters.")
-                print(f"🤖 AI Updates: {updated}")
+                logger.debug("AI parameter updates: %s", updated, extra={"template_id": req.template_id})
             except AuthenticationError:
-                print("❌ Invalid Groq API Key")
+                logger.warning("Invalid Groq API key")
                 updated = {}
                 ai_response = "Error: Invalid Groq API Key. Please check your settings."
             except Exception as e:
-                print(f"⚠ AI Update Error: {e}")
+                logger.error("AI update error: %s", e, extra={"template_id": req.template_id})
                 updated = {}
                 ai_response = (
                     "Sorry, I encountered an error processing your request. "
@@ -0,0 +1,177 @@
+"""
+Microbenchmark the shared JSON extractor against the regex salvagers it replaced.
+
+Usage:
+    cd backend
+    python scripts/bench_json_extract.py [--size 8192] [--repeat 200]
+
+Each payload shape the models actually produce (bare JSON, fenced, wrapped in
+prose, truncated at the token limit) is parsed by every implementation; the
+table shows the mean time per call and whether a value came back.
+"""
+
+import argparse
+import json
+import re
+import sys
+import timeit
+from pathlib import Path
+
+# Add backend root to path so imports work
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.json_stream import JSONExtractor, extract_json  # noqa: E402
+
+
+# ------------------------------------------------------------------
+# Previous implementations, kept verbatim for comparison
+# ------------------------------------------------------------------
+
+
+def legacy_notes(text):
+    if not text:
+        return None
+    text = text.strip()
+    json_block_match = re.search(r"```json\s*([\s\S]*?)\s*```", text)
+    if json_block_match:
+        text = json_block_match.group(1).strip()
+    else:
+        code_block_match = re.search(r"```\s*([\s\S]*?)\s*```", text)
+        if code_block_match:
+            text = code_block_match.group(1).strip()
+        else:
+            text = re.sub(r"^```json\s*", "", text)
+            text = re.sub(r"^```\s*", "", text)
+            text = re.sub(r"\s*```$", "", text)
+            text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    match = re.search(r"\{[\s\S]*\}", text)
+    if match:
+        try:
+            return json.loads(match.group())
+        except json.JSONDecodeError:
+            pass
+    first_brace = text.find("{")
+    if first_brace != -1:
+        try:
+            return json.loads(text[first_brace:])
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+def legacy_quiz(text):
+    if not text:
+        return None
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    match = re.search(r"```json\s*([\s\S]*?)\s*```", text)
+    if match:
+        try:
+            return json.loads(match.group(1))
+        except json.JSONDecodeError:
+            pass
+    match = re.search(r"(\{[\s\S]*\})", text)
+    if match:
+        try:
+            return json.loads(match.group(1))
+        except json.JSONDecodeError:
+            pass
+    match = re.search(r"(\[[\s\S]*\])", text)
+    if match:
+        try:
+            return json.loads(match.group(1))
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+def legacy_detector(text):
+    if not text:
+        return None
+    text = text.strip()
+    text = re.sub(r"```json\s*", "", text)
+    text = re.sub(r"```\s*", "", text)
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    match = re.search(r"\{[\s\S]*\}", text)
+    if match:
+        try:
+            return json.loads(match.group())
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+def streamed(text, chunk=64):
+    """Shared extractor fed in streaming-sized chunks."""
+    extractor = JSONExtractor()
+    for i in range(0, len(text), chunk):
+        if extractor.feed(text[i : i + chunk]) is not None:
+            break
+    return extractor.value if extractor.done else extractor.repair()
+
+
+IMPLEMENTATIONS = {
+    "notes (legacy)": legacy_notes,
+    "quiz (legacy)": legacy_quiz,
+    "detector (legacy)": legacy_detector,
+    "extract_json": extract_json,
+    "JSONExtractor stream": streamed,
+}
+
+
+def build_payloads(size):
+    question = {
+        "question": "A car accelerates uniformly from rest to 20 m/s in 5 s. What is {a}?",
+        "options": ["2 m/s²", "4 m/s²", "10 m/s²", "100 m/s²"],
+        "correct_index": 1,
+        "explanation": 'Using v = u + at: a = (20-0)/5 = 4 m/s². Note the "uniformly".',
+        "takeaway": "For uniform acceleration from rest: a = v/t",
+    }
+    doc = {"topic": "Kinematics", "questions": []}
+    while len(json.dumps(doc)) < size:
+        doc["questions"].append(question)
+    body = json.dumps(doc, ensure_ascii=False)
+    return {
+        "bare": body,
+        "fenced": f"```json\n{body}\n```",
+        "prose": f"Here is your quiz {{as requested}}:\n{body}\nLet me know if you need {{more}}!",
+        "truncated": body[: int(len(body) * 0.9)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--size", type=int, default=8192, help="approximate payload size in bytes"
+    )
+    parser.add_argument("--repeat", type=int, default=200, help="calls per measurement")
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.size)
+    print(f"{'payload':<10} {'implementation':<22} {'µs/call':>10}  result")
+    for shape, text in payloads.items():
+        for name, fn in IMPLEMENTATIONS.items():
+            result = fn(text)
+            seconds = timeit.timeit(lambda: fn(text), number=args.repeat) / args.repeat
+            status = "ok" if result is not None else "FAILED"
+            if isinstance(result, dict):
+                status += f" ({len(result.get('questions', []))} questions)"
+            print(f"{shape:<10} {name:<22} {seconds * 1e6:>10.1f}  {status}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
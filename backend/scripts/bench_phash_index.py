@@ -0,0 +1,163 @@
+"""
+Benchmark the perceptual-hash index behind near-duplicate scan lookups.
+
+Usage:
+    cd backend
+    python scripts/bench_phash_index.py [--size 1000000] [--queries 2000] [--radius 4 6 7 10]
+
+Fills a ``MultiIndexHash`` with ``--size`` random 64-bit hashes, then times
+radius queries for near-duplicates planted at known distances (every one must
+be found) and for random misses, and a brute-force scan for comparison. Also
+times ``dhash`` on a synthetic 1600x1200 photo (PNG and JPEG).
+"""
+
+import argparse
+import io
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add backend root to path so imports work
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from utils.phash import MultiIndexHash, dhash  # noqa: E402
+
+
+def flip_bits(code: int, count: int, rng: random.Random) -> int:
+    for bit in rng.sample(range(64), count):
+        code ^= 1 << bit
+    return code
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def time_queries(index, queries, radius):
+    timings, hits = [], 0
+    for code in queries:
+        start = time.perf_counter()
+        found = index.search(code, radius)
+        timings.append(time.perf_counter() - start)
+        hits += bool(found)
+    return timings, hits
+
+
+def synthetic_page(width=1600, height=1200) -> Image.Image:
+    rng = random.Random(7)
+    img = Image.new("RGB", (width, height), (245, 242, 235))
+    draw = ImageDraw.Draw(img)
+    for y in range(80, height - 80, 36):
+        x = 80
+        while x < width - 200:
+            w = rng.randint(30, 160)
+            draw.rectangle([x, y, x + w, y + 14], fill=(40, 40, 60))
+            x += w + rng.randint(12, 30)
+    draw.ellipse([width - 500, 200, width - 150, 550], outline=(20, 20, 120), width=6)
+    return img
+
+
+def bench_dhash(repeat: int) -> None:
+    page = synthetic_page()
+    for fmt in ("PNG", "JPEG"):
+        buf = io.BytesIO()
+        page.save(buf, fmt)
+        data = buf.getvalue()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            dhash(data)
+        per_call = (time.perf_counter() - start) / repeat
+        print(
+            f"dhash {fmt:<5} {len(data) // 1024:>5} KB  {per_call * 1e3:>7.2f} ms/image"
+        )
+
+    # Re-encoding and resizing the same page should stay within a few bits
+    original = dhash(page)
+    buf = io.BytesIO()
+    page.resize((800, 600)).save(buf, "JPEG", quality=60)
+    print(
+        f"same page, resized + JPEG q60: {bin(original ^ dhash(buf.getvalue())).count('1')} bits apart"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--size", type=int, default=1_000_000, help="hashes in the index"
+    )
+    parser.add_argument(
+        "--queries", type=int, default=2000, help="queries per measurement"
+    )
+    parser.add_argument(
+        "--radius",
+        type=int,
+        nargs="+",
+        default=[4, 6, 7, 10],
+        help="Hamming radii to test",
+    )
+    parser.add_argument(
+        "--brute-force",
+        type=int,
+        default=20,
+        help="brute-force queries for comparison (0 = skip)",
+    )
+    parser.add_argument(
+        "--dhash-repeat",
+        type=int,
+        default=20,
+        help="dhash calls per image format (0 = skip)",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    codes = [rng.getrandbits(64) for _ in range(args.size)]
+
+    index = MultiIndexHash()
+    start = time.perf_counter()
+    for i, code in enumerate(codes):
+        index.add(code, i)
+    print(
+        f"built index of {len(index):,} hashes in {time.perf_counter() - start:.1f}s\n"
+    )
+
+    print(
+        f"{'radius':>6} {'query':<10} {'p50 µs':>9} {'p99 µs':>9} {'mean µs':>9}  found"
+    )
+    for radius in args.radius:
+        planted = [
+            flip_bits(rng.choice(codes), rng.randint(0, radius), rng)
+            for _ in range(args.queries)
+        ]
+        misses = [rng.getrandbits(64) for _ in range(args.queries)]
+        for label, queries in (("near-dup", planted), ("random", misses)):
+            timings, hits = time_queries(index, queries, radius)
+            print(
+                f"{radius:>6} {label:<10} {percentile(timings, 50) * 1e6:>9.1f} "
+                f"{percentile(timings, 99) * 1e6:>9.1f} {statistics.mean(timings) * 1e6:>9.1f}  {hits}/{len(queries)}"
+            )
+
+    if args.brute_force:
+        query = rng.getrandbits(64)
+        start = time.perf_counter()
+        for _ in range(args.brute_force):
+            [c for c in codes if bin(c ^ query).count("1") <= args.radius[0]]
+        per_query = (time.perf_counter() - start) / args.brute_force
+        print(
+            f"\nbrute force (radius {args.radius[0]}): {per_query * 1e3:.1f} ms/query"
+        )
+
+    if args.dhash_repeat:
+        print()
+        bench_dhash(args.dhash_repeat)
+
+
+if __name__ == "__main__":
+    main()
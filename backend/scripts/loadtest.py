@@ -0,0 +1,434 @@
+"""
+Endpoint load test with stored baselines.
+
+Usage:
+    cd backend
+    # 1. mock LLM, local Mongo, dev auth bypass
+    python scripts/mock_llm_server.py --port 9000 --latency 0.3 --jitter 0.3 &
+    ALLOW_DEV_AUTH_BYPASS=true MONGO_URI=mongodb://localhost:27017/stemly_bench \\
+    GEMINI_BASE_URL=http://localhost:9000/v1beta AIML_BASE_URL=http://localhost:9000/v1 \\
+        uvicorn main:app --port 8000 &
+
+    # 2. record a baseline, later compare a new run against it
+    python scripts/loadtest.py run --concurrency 20 --duration 30 --output benchmarks/main.json
+    python scripts/loadtest.py run --concurrency 20 --duration 30 --output benchmarks/branch.json
+    python scripts/loadtest.py compare benchmarks/main.json benchmarks/branch.json [--threshold 0.15]
+
+``run`` drives each scenario (scan upload, notes, quiz, visualiser generate
+and chat, scan and visualiser history) in turn with ``--concurrency`` workers
+for ``--duration`` seconds (or ``--requests`` calls), authenticating with the
+``test-token`` accepted under ``ALLOW_DEV_AUTH_BYPASS``. Each scenario records
+throughput, error rate and latency percentiles; the JSON file is the baseline.
+
+``compare`` prints both runs side by side and exits with status 1 if any
+scenario's p50/p95 latency grew, or throughput fell, by more than
+``--threshold`` (relative), or its error rate rose by more than
+``--error-threshold`` (absolute).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import struct
+import subprocess
+import sys
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+TOPICS = [
+    "Projectile Motion",
+    "Kinematics",
+    "Optics",
+    "Simple Harmonic Motion",
+    "Ohm's Law",
+    "Photosynthesis",
+]
+PERCENTILES = (50, 90, 95, 99)
+
+
+def _tiny_png(width: int = 64, height: int = 64) -> bytes:
+    """A valid grey PNG without needing Pillow."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+        )
+
+    rows = b"".join(
+        b"\x00" + bytes([random.randrange(256)]) * width for _ in range(height)
+    )
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+# ------------------------------------------------------------------
+# Scenarios: each builds one request
+# ------------------------------------------------------------------
+
+
+def scan_upload(client: httpx.AsyncClient, i: int):
+    topic = TOPICS[i % len(TOPICS)]
+    return client.post(
+        "/scan/upload",
+        files={"file": (f"bench-{i}.png", _tiny_png(), "image/png")},
+        data={"ocr_text": f"{topic}: velocity v = u + at, displacement s, time t"},
+    )
+
+
+def notes_generate(client: httpx.AsyncClient, i: int):
+    return client.post(
+        "/notes/generate",
+        json={"topic": TOPICS[i % len(TOPICS)], "variables": ["v", "t"]},
+    )
+
+
+def quiz_generate(client: httpx.AsyncClient, i: int):
+    return client.get(
+        "/quiz/generate", params={"topic": TOPICS[i % len(TOPICS)], "count": 5}
+    )
+
+
+def visualiser_generate(client: httpx.AsyncClient, i: int):
+    return client.post(
+        "/visualiser/generate",
+        json={"topic": TOPICS[i % len(TOPICS)], "variables": ["v", "theta"]},
+    )
+
+
+def visualiser_chat(client: httpx.AsyncClient, i: int):
+    message = "Set the speed to 20" if i % 2 else "Why does the ball follow a curve?"
+    return client.post(
+        "/visualiser/chat",
+        json={
+            "message": message,
+            "topic": "Projectile Motion",
+            "parameters": {"speed": 10, "angle": 45},
+        },
+    )
+
+
+def scan_history(client: httpx.AsyncClient, i: int):
+    return client.get("/scan/history")
+
+
+def visualiser_history(client: httpx.AsyncClient, i: int):
+    return client.get("/visualiser/history")
+
+
+SCENARIOS: Dict[str, Callable[[httpx.AsyncClient, int], Any]] = {
+    "scan_upload": scan_upload,
+    "notes_generate": notes_generate,
+    "quiz_generate": quiz_generate,
+    "visualiser_generate": visualiser_generate,
+    "visualiser_chat": visualiser_chat,
+    "scan_history": scan_history,
+    "visualiser_history": visualiser_history,
+}
+
+
+# ------------------------------------------------------------------
+# Runner
+# ------------------------------------------------------------------
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (
+        rank - low
+    )
+
+
+def summarise(
+    latencies: List[float], statuses: Counter, errors: int, elapsed: float
+) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    total = len(latencies)
+    summary = {
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "elapsed_s": round(elapsed, 2),
+        "statuses": {
+            str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))
+        },
+        "latency_ms": {
+            "mean": round(sum(ordered) / total * 1000, 2) if total else 0.0,
+            "max": round(ordered[-1] * 1000, 2) if total else 0.0,
+        },
+    }
+    for pct in PERCENTILES:
+        summary["latency_ms"][f"p{pct}"] = round(percentile(ordered, pct) * 1000, 2)
+    return summary
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    build: Callable[[httpx.AsyncClient, int], Any],
+    concurrency: int,
+    duration: float,
+    max_requests: Optional[int],
+    warmup: int,
+) -> Dict[str, Any]:
+    for i in range(warmup):
+        try:
+            await build(client, i)
+        except httpx.HTTPError:
+            pass
+
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    errors = 0
+    issued = 0
+    started = time.perf_counter()
+    stop_at = started + duration
+
+    async def worker():
+        nonlocal errors, issued
+        while time.perf_counter() < stop_at and (
+            max_requests is None or issued < max_requests
+        ):
+            i = issued
+            issued += 1
+            t0 = time.perf_counter()
+            try:
+                response = await build(client, i)
+                status = response.status_code
+            except httpx.HTTPError as exc:
+                status = type(exc).__name__
+            latencies.append(time.perf_counter() - t0)
+            statuses[status] += 1
+            if not isinstance(status, int) or status >= 400:
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarise(latencies, statuses, errors, time.perf_counter() - started)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        raise SystemExit(
+            f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})"
+        )
+
+    headers = {"Authorization": f"Bearer {args.token}"}
+    limits = httpx.Limits(
+        max_connections=args.concurrency, max_keepalive_connections=args.concurrency
+    )
+    results: Dict[str, Any] = {}
+    async with httpx.AsyncClient(
+        base_url=args.base_url, headers=headers, limits=limits, timeout=args.timeout
+    ) as client:
+        try:
+            (await client.get("/scan/ping")).raise_for_status()
+        except httpx.HTTPError as exc:
+            raise SystemExit(
+                f"Backend not reachable at {args.base_url} ({exc}); is ALLOW_DEV_AUTH_BYPASS=true set?"
+            )
+
+        for name in names:
+            print(
+                f"▶ {name}: {args.concurrency} workers, {args.duration:.0f}s"
+                + (f", max {args.requests} requests" if args.requests else "")
+            )
+            results[name] = await run_scenario(
+                client,
+                SCENARIOS[name],
+                args.concurrency,
+                args.duration,
+                args.requests,
+                args.warmup,
+            )
+            lat = results[name]["latency_ms"]
+            print(
+                f"  {results[name]['throughput_rps']:8.1f} req/s  p50 {lat['p50']:8.1f}ms  p95 {lat['p95']:8.1f}ms  "
+                f"p99 {lat['p99']:8.1f}ms  errors {results[name]['error_rate']:.1%}"
+            )
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "max_requests": args.requests,
+            "label": args.label,
+        },
+        "scenarios": results,
+    }
+
+
+# ------------------------------------------------------------------
+# Compare
+# ------------------------------------------------------------------
+
+
+def _relative(old: float, new: float) -> float:
+    return (new - old) / old if old else 0.0
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float,
+    error_threshold: float,
+) -> List[str]:
+    """Print a side-by-side table; return the list of regressions found."""
+    regressions = []
+    print(
+        f"{'scenario':<20} {'metric':<14} {'baseline':>10} {'current':>10} {'change':>8}"
+    )
+    print("-" * 66)
+    for name, old in baseline["scenarios"].items():
+        new = current["scenarios"].get(name)
+        if new is None:
+            print(f"{name:<20} (missing from current run)")
+            continue
+        rows = [
+            ("p50 ms", old["latency_ms"]["p50"], new["latency_ms"]["p50"], True),
+            ("p95 ms", old["latency_ms"]["p95"], new["latency_ms"]["p95"], True),
+            ("throughput", old["throughput_rps"], new["throughput_rps"], False),
+        ]
+        for metric, before, after, lower_is_better in rows:
+            change = _relative(before, after)
+            worse = change > threshold if lower_is_better else change < -threshold
+            flag = "  ❌" if worse else ""
+            print(
+                f"{name:<20} {metric:<14} {before:>10.1f} {after:>10.1f} {change:>+7.1%}{flag}"
+            )
+            if worse:
+                regressions.append(
+                    f"{name}: {metric} {before:.1f} -> {after:.1f} ({change:+.1%})"
+                )
+        error_delta = new["error_rate"] - old["error_rate"]
+        flag = "  ❌" if error_delta > error_threshold else ""
+        print(
+            f"{name:<20} {'error rate':<14} {old['error_rate']:>10.1%} "
+            f"{new['error_rate']:>10.1%} {error_delta:>+7.1%}{flag}"
+        )
+        if flag:
+            regressions.append(
+                f"{name}: error rate {old['error_rate']:.1%} -> {new['error_rate']:.1%}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser(
+        "run", help="load-test the endpoints and write a baseline"
+    )
+    run_parser.add_argument("--base-url", default="http://localhost:8000")
+    run_parser.add_argument(
+        "--token", default="test-token", help="bearer token (dev auth bypass)"
+    )
+    run_parser.add_argument("--concurrency", type=int, default=10)
+    run_parser.add_argument(
+        "--duration", type=float, default=20.0, help="seconds per scenario"
+    )
+    run_parser.add_argument(
+        "--requests", type=int, help="stop a scenario after this many requests"
+    )
+    run_parser.add_argument(
+        "--warmup", type=int, default=2, help="untimed requests before each scenario"
+    )
+    run_parser.add_argument(
+        "--timeout", type=float, default=120.0, help="per-request timeout, seconds"
+    )
+    run_parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        metavar="NAME",
+        help=f"subset of: {', '.join(SCENARIOS)}",
+    )
+    run_parser.add_argument("--label", help="free-form note stored with the baseline")
+    run_parser.add_argument("--output", help="write the results here as JSON")
+    run_parser.add_argument(
+        "--compare", metavar="BASELINE", help="compare against this baseline afterwards"
+    )
+    run_parser.add_argument("--threshold", type=float, default=0.15)
+    run_parser.add_argument("--error-threshold", type=float, default=0.01)
+
+    compare_parser = sub.add_parser(
+        "compare", help="flag regressions between two result files"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.15,
+        help="allowed relative latency/throughput change",
+    )
+    compare_parser.add_argument(
+        "--error-threshold",
+        type=float,
+        default=0.01,
+        help="allowed absolute error-rate increase",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        current = asyncio.run(run(args))
+        if args.output:
+            path = Path(args.output)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(current, indent=2))
+            print(f"💾 Results written to {path}")
+        baseline_path = args.compare
+    else:
+        current = json.loads(Path(args.current).read_text())
+        baseline_path = args.baseline
+
+    if baseline_path:
+        baseline = json.loads(Path(baseline_path).read_text())
+        regressions = compare(baseline, current, args.threshold, args.error_threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s):")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,625 @@
+"""
+Mock Gemini + AIML server for offline development, tests and load tests.
+
+Usage:
+    cd backend
+    python scripts/mock_llm_server.py [--port 9000] [--latency 0.3] [--rate-429 0.05]
+                                      [--truncate 0.1] [--replay fixtures/llm]
+
+    # then run the backend against it
+    GEMINI_BASE_URL=http://localhost:9000/v1beta AIML_BASE_URL=http://localhost:9000/v1 \\
+        uvicorn main:app --port 8000
+
+Serves the endpoints Stemly calls:
+    POST /v1beta/models/{model}:generateContent
+    POST /v1beta/models/{model}:streamGenerateContent?alt=sse
+    POST /v1beta/cachedContents
+    POST /v1/images/generations/
+
+Responses are synthesised from the prompt (notes, quiz, visualiser chat,
+topic detection and parameter JSON in the shapes the services expect), or
+replayed from fixtures. ``--record DIR --upstream-gemini URL`` proxies every
+call to the real API and saves the exchange as a fixture; ``--replay DIR``
+answers from those fixtures (falling back to synthetic answers unless
+``--strict``). Fixtures are keyed like the LLM response cache, so the same
+request always maps to the same file.
+
+Fault injection: ``--latency``/``--jitter`` delay every call, ``--rate-429``
+and ``--rate-500`` fail a share of calls, and ``--truncate`` cuts a share of
+answers at ``finishReason=MAX_TOKENS`` (continuation requests get the rest).
+The knobs can be changed while running with ``POST /mock/config`` and counts
+are at ``GET /mock/stats``.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Add backend root to path so imports work
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.llm_cache import make_cache_key  # noqa: E402
+
+SETTINGS: Dict[str, Any] = {
+    "latency": 0.0,
+    "jitter": 0.0,
+    "rate_429": 0.0,
+    "rate_500": 0.0,
+    "retry_after": 1,
+    "truncate": 0.0,
+    "stream_chunks": 8,
+    "stream_chunk_delay": 0.02,
+    "record_dir": None,
+    "replay_dir": None,
+    "strict": False,
+    "upstream_gemini": "https://generativelanguage.googleapis.com/v1beta",
+    "upstream_aiml": "https://api.aimlapi.com/v1",
+    "seed": None,
+}
+STATS: Counter = Counter()
+CACHED_PREFIXES: Dict[str, int] = {}  # cachedContents name -> prefix token count
+_rng = random.Random()
+
+app = FastAPI(title="Stemly mock LLM server")
+
+
+# ------------------------------------------------------------------
+# Synthetic answers
+# ------------------------------------------------------------------
+
+
+def _prompt_text(payload: Dict[str, Any]) -> str:
+    """System instruction plus the first user turn (continuation turns excluded)."""
+    parts = []
+    system = payload.get("systemInstruction") or {}
+    parts += [p.get("text", "") for p in system.get("parts", [])]
+    contents = payload.get("contents") or []
+    if contents:
+        parts += [
+            p.get("text", "") for p in contents[0].get("parts", []) if "text" in p
+        ]
+    return "\n".join(parts)
+
+
+def _topic_from(prompt: str) -> str:
+    match = re.search(r"Topic:\s*([^\n.]+)", prompt)
+    return match.group(1).strip() if match else "Kinematics"
+
+
+def synthesize(payload: Dict[str, Any]) -> str:
+    """A well-formed answer in the shape the calling service expects."""
+    prompt = _prompt_text(payload)
+    has_image = any(
+        "inline_data" in p or "inlineData" in p
+        for c in payload.get("contents") or []
+        for p in c.get("parts", [])
+    )
+
+    if "study notes" in prompt:
+        topic = _topic_from(prompt)
+        return json.dumps(
+            {
+                "explanation": f"{topic} describes how quantities change and relate. "
+                * 6,
+                "variable_breakdown": {
+                    "v": "velocity (m/s)",
+                    "t": "time (s)",
+                    "a": "acceleration (m/s²)",
+                },
+                "formulas": ["v = u + at", "s = ut + ½at²"],
+                "example": "A car starts from rest and accelerates at 2 m/s² for 5 s, so v = 0 + 2×5 = 10 m/s.",
+                "mistakes": ["Mixing up speed and velocity", "Forgetting units"],
+                "practice_questions": [
+                    f"Explain {topic} in one sentence.",
+                    "Calculate v after 3 s at 4 m/s².",
+                ],
+                "summary": [f"{topic} links motion quantities", "Always track units"],
+                "resources": [f"{topic} lecture notes"],
+            },
+            ensure_ascii=False,
+        )
+
+    if "MCQs" in prompt:
+        topic = _topic_from(prompt)
+        count_match = re.search(r"Number of questions:\s*(\d+)", prompt)
+        count = int(count_match.group(1)) if count_match else 5
+        questions = [
+            {
+                "question": f"[{topic}] Question {i + 1}: which statement is correct?",
+                "options": ["Statement A", "Statement B", "Statement C", "Statement D"],
+                "correct_index": i % 4,
+                "explanation": f"Statement {'ABCD'[i % 4]} follows from the definition.",
+                "takeaway": f"Key idea #{i + 1} of {topic}",
+            }
+            for i in range(count)
+        ]
+        return json.dumps({"topic": topic, "questions": questions}, ensure_ascii=False)
+
+    if "Visualization Assistant" in prompt:
+        message = ((payload.get("contents") or [{}])[0].get("parts") or [{}])[0].get(
+            "text", ""
+        )
+        numbers = re.findall(r"-?\d+(?:\.\d+)?", message.split("USER MESSAGE:")[-1])
+        if numbers and re.search(
+            r"\b(set|change|make|increase|decrease)\b", message, re.I
+        ):
+            return json.dumps(
+                {"type": "update", "changes": {"speed": float(numbers[-1])}}
+            )
+        return json.dumps(
+            {
+                "type": "chat",
+                "message": "Gravity pulls the object down while it keeps moving sideways, "
+                * 3,
+            }
+        )
+
+    if "Simulation Controller" in prompt:
+        return json.dumps(
+            {
+                "updated_parameters": {"velocity": 20},
+                "ai_response": "I have set the velocity to 20 m/s.",
+            }
+        )
+
+    if has_image or "topic classifier" in prompt or '"topic"' in prompt:
+        return json.dumps(
+            {
+                "topic": "Projectile Motion" if has_image else "Kinematics",
+                "variables": ["v", "t", "theta"],
+            }
+        )
+
+    return "This is a mock response from the Stemly mock LLM server."
+
+
+def _continuation_of(payload: Dict[str, Any]) -> Optional[str]:
+    """Partial text the client asks us to continue, if this is a continuation request."""
+    contents = payload.get("contents") or []
+    partial = "".join(
+        p.get("text", "")
+        for c in contents[1:]
+        if c.get("role") == "model"
+        for p in c.get("parts", [])
+    )
+    return partial or None
+
+
+def _usage(payload: Dict[str, Any], text: str) -> Dict[str, int]:
+    prompt_tokens = max(1, len(json.dumps(payload.get("contents") or [])) // 4)
+    usage = {
+        "promptTokenCount": prompt_tokens,
+        "candidatesTokenCount": max(1, len(text) // 4),
+        "totalTokenCount": prompt_tokens + max(1, len(text) // 4),
+    }
+    if payload.get("cachedContent"):
+        cached = CACHED_PREFIXES.get(payload["cachedContent"], 0)
+        usage["cachedContentTokenCount"] = cached
+        usage["promptTokenCount"] += cached
+    return usage
+
+
+def generate(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Synthetic generateContent body, honouring continuation and truncation settings."""
+    full = synthesize(payload)
+    partial = _continuation_of(payload)
+    text = full[len(partial) :] if partial and full.startswith(partial) else full
+    finish = "STOP"
+    if SETTINGS["truncate"] and _rng.random() < SETTINGS["truncate"] and len(text) > 40:
+        text = text[: int(len(text) * _rng.uniform(0.4, 0.8))]
+        finish = "MAX_TOKENS"
+        STATS["truncated"] += 1
+    return {
+        "candidates": [
+            {
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": finish,
+            }
+        ],
+        "usageMetadata": _usage(payload, text),
+        "modelVersion": "mock",
+    }
+
+
+# ------------------------------------------------------------------
+# Fixtures (record / replay)
+# ------------------------------------------------------------------
+
+
+def fixture_key(kind: str, model: str, payload: Dict[str, Any]) -> str:
+    if kind == "image":
+        blob = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return "image-" + hashlib.sha256(blob.encode("utf-8")).hexdigest()[:32]
+    return f"{kind}-" + make_cache_key(model, payload)[:32]
+
+
+def load_fixture(key: str) -> Optional[Dict[str, Any]]:
+    if not SETTINGS["replay_dir"]:
+        return None
+    path = Path(SETTINGS["replay_dir"]) / f"{key}.json"
+    if not path.exists():
+        STATS["fixture_miss"] += 1
+        return None
+    STATS["fixture_hit"] += 1
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_fixture(key: str, fixture: Dict[str, Any]) -> None:
+    directory = Path(SETTINGS["record_dir"])
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / f"{key}.json").write_text(
+        json.dumps(fixture, indent=2, ensure_ascii=False), encoding="utf-8"
+    )
+    STATS["recorded"] += 1
+
+
+async def _proxy(
+    url: str, payload: Dict[str, Any], headers: Dict[str, str], params=None
+) -> httpx.Response:
+    async with httpx.AsyncClient(timeout=120) as client:
+        return await client.post(url, json=payload, headers=headers, params=params)
+
+
+def _forward_headers(request: Request) -> Dict[str, str]:
+    return {
+        k: v
+        for k, v in request.headers.items()
+        if k.lower() in ("x-goog-api-key", "authorization")
+    }
+
+
+# ------------------------------------------------------------------
+# Fault injection
+# ------------------------------------------------------------------
+
+
+async def _delay() -> None:
+    seconds = SETTINGS["latency"] + _rng.uniform(0, SETTINGS["jitter"])
+    if seconds > 0:
+        await asyncio.sleep(seconds)
+
+
+def _injected_error() -> Optional[JSONResponse]:
+    roll = _rng.random()
+    if roll < SETTINGS["rate_429"]:
+        STATS["injected_429"] += 1
+        return JSONResponse(
+            {
+                "error": {
+                    "code": 429,
+                    "message": "Resource has been exhausted (mock)",
+                    "status": "RESOURCE_EXHAUSTED",
+                }
+            },
+            status_code=429,
+            headers={"Retry-After": str(SETTINGS["retry_after"])},
+        )
+    if roll < SETTINGS["rate_429"] + SETTINGS["rate_500"]:
+        STATS["injected_500"] += 1
+        return JSONResponse(
+            {"error": {"code": 500, "message": "Internal error (mock)"}},
+            status_code=500,
+        )
+    return None
+
+
+# ------------------------------------------------------------------
+# Gemini
+# ------------------------------------------------------------------
+
+
+@app.post("/v1beta/models/{target}")
+async def gemini_models(target: str, request: Request):
+    model, _, method = target.partition(":")
+    payload = await request.json()
+    STATS[method] += 1
+    await _delay()
+    error = _injected_error()
+    if error is not None:
+        return error
+    if method == "generateContent":
+        return await _generate_content(model, payload, request)
+    if method == "streamGenerateContent":
+        return await _stream_generate_content(model, payload, request)
+    return JSONResponse(
+        {"error": {"code": 404, "message": f"Unknown method {method}"}}, status_code=404
+    )
+
+
+async def _generate_content(model: str, payload: Dict[str, Any], request: Request):
+    key = fixture_key("generate", model, payload)
+    fixture = load_fixture(key)
+    if fixture is not None:
+        return JSONResponse(fixture["response"], status_code=fixture.get("status", 200))
+
+    if SETTINGS["record_dir"]:
+        upstream = await _proxy(
+            f"{SETTINGS['upstream_gemini']}/models/{model}:generateContent",
+            payload,
+            _forward_headers(request),
+        )
+        body = upstream.json()
+        save_fixture(
+            key,
+            {
+                "kind": "generate",
+                "model": model,
+                "request": payload,
+                "status": upstream.status_code,
+                "response": body,
+            },
+        )
+        return JSONResponse(body, status_code=upstream.status_code)
+
+    if SETTINGS["strict"]:
+        return JSONResponse(
+            {"error": {"code": 404, "message": f"No fixture {key}"}}, status_code=404
+        )
+    return generate(payload)
+
+
+def _sse(chunks: List[Dict[str, Any]]):
+    async def events():
+        for chunk in chunks:
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n"
+            if SETTINGS["stream_chunk_delay"]:
+                await asyncio.sleep(SETTINGS["stream_chunk_delay"])
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def _split_stream(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Cut a generateContent body into streamGenerateContent chunks."""
+    candidate = body["candidates"][0]
+    text = candidate["content"]["parts"][0]["text"]
+    size = max(1, -(-len(text) // max(1, SETTINGS["stream_chunks"])))
+    pieces = [text[i : i + size] for i in range(0, len(text), size)] or [""]
+    chunks = [
+        {"candidates": [{"content": {"role": "model", "parts": [{"text": piece}]}}]}
+        for piece in pieces
+    ]
+    chunks[-1]["candidates"][0]["finishReason"] = candidate.get("finishReason", "STOP")
+    chunks[-1]["usageMetadata"] = body.get("usageMetadata", {})
+    return chunks
+
+
+async def _stream_generate_content(
+    model: str, payload: Dict[str, Any], request: Request
+):
+    key = fixture_key("stream", model, payload)
+    fixture = load_fixture(key)
+    if fixture is not None:
+        if fixture.get("status", 200) >= 400:
+            return JSONResponse(fixture["response"], status_code=fixture["status"])
+        return _sse(fixture["chunks"])
+
+    if SETTINGS["record_dir"]:
+        upstream = await _proxy(
+            f"{SETTINGS['upstream_gemini']}/models/{model}:streamGenerateContent",
+            payload,
+            _forward_headers(request),
+            params={"alt": "sse"},
+        )
+        if upstream.is_error:
+            save_fixture(
+                key,
+                {
+                    "kind": "stream",
+                    "model": model,
+                    "request": payload,
+                    "status": upstream.status_code,
+                    "response": upstream.json(),
+                },
+            )
+            return JSONResponse(upstream.json(), status_code=upstream.status_code)
+        chunks = [
+            json.loads(line[5:].strip())
+            for line in upstream.text.splitlines()
+            if line.startswith("data:") and line[5:].strip()
+        ]
+        save_fixture(
+            key,
+            {
+                "kind": "stream",
+                "model": model,
+                "request": payload,
+                "status": 200,
+                "chunks": chunks,
+            },
+        )
+        return _sse(chunks)
+
+    if SETTINGS["strict"]:
+        return JSONResponse(
+            {"error": {"code": 404, "message": f"No fixture {key}"}}, status_code=404
+        )
+    return _sse(_split_stream(generate(payload)))
+
+
+@app.post("/v1beta/cachedContents")
+async def create_cached_content(request: Request):
+    payload = await request.json()
+    STATS["cachedContents"] += 1
+    text = "".join(
+        p.get("text", "")
+        for p in (payload.get("systemInstruction") or {}).get("parts", [])
+    )
+    name = (
+        "cachedContents/mock-" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    )
+    CACHED_PREFIXES[name] = max(1, len(text) // 4)
+    return {
+        "name": name,
+        "model": payload.get("model"),
+        "usageMetadata": {"totalTokenCount": CACHED_PREFIXES[name]},
+    }
+
+
+# ------------------------------------------------------------------
+# AIML images
+# ------------------------------------------------------------------
+
+
+@app.post("/v1/images/generations")
+@app.post("/v1/images/generations/")
+async def aiml_images(request: Request):
+    payload = await request.json()
+    STATS["images"] += 1
+    await _delay()
+    error = _injected_error()
+    if error is not None:
+        return error
+
+    key = fixture_key("image", "", payload)
+    fixture = load_fixture(key)
+    if fixture is not None:
+        return JSONResponse(fixture["response"], status_code=fixture.get("status", 200))
+    if SETTINGS["record_dir"]:
+        upstream = await _proxy(
+            f"{SETTINGS['upstream_aiml']}/images/generations/",
+            payload,
+            _forward_headers(request),
+        )
+        save_fixture(
+            key,
+            {
+                "kind": "image",
+                "request": payload,
+                "status": upstream.status_code,
+                "response": upstream.json(),
+            },
+        )
+        return JSONResponse(upstream.json(), status_code=upstream.status_code)
+    if SETTINGS["strict"]:
+        return JSONResponse(
+            {"error": {"message": f"No fixture {key}"}}, status_code=404
+        )
+
+    digest = hashlib.sha256(str(payload.get("prompt", "")).encode("utf-8")).hexdigest()[
+        :12
+    ]
+    return {"data": [{"url": f"https://mock.stemly.invalid/images/{digest}.png"}]}
+
+
+# ------------------------------------------------------------------
+# Control
+# ------------------------------------------------------------------
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    return {"settings": SETTINGS, "counts": STATS}
+
+
+@app.post("/mock/config")
+async def mock_config(request: Request):
+    """Change fault-injection settings at runtime, e.g. {"rate_429": 0.5}."""
+    updates = await request.json()
+    unknown = sorted(set(updates) - set(SETTINGS))
+    if unknown:
+        return JSONResponse(
+            {"error": f"Unknown settings: {', '.join(unknown)}"}, status_code=400
+        )
+    SETTINGS.update(updates)
+    return {"settings": SETTINGS}
+
+
+@app.post("/mock/reset")
+async def mock_reset():
+    STATS.clear()
+    return {"counts": STATS}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every call"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="extra uniform random delay, seconds"
+    )
+    parser.add_argument(
+        "--rate-429", type=float, default=0.0, help="share of calls answered with 429"
+    )
+    parser.add_argument(
+        "--rate-500", type=float, default=0.0, help="share of calls answered with 500"
+    )
+    parser.add_argument(
+        "--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s"
+    )
+    parser.add_argument(
+        "--truncate",
+        type=float,
+        default=0.0,
+        help="share of answers cut off at MAX_TOKENS",
+    )
+    parser.add_argument(
+        "--stream-chunks", type=int, default=8, help="SSE chunks per streamed answer"
+    )
+    parser.add_argument(
+        "--stream-chunk-delay",
+        type=float,
+        default=0.02,
+        help="seconds between SSE chunks",
+    )
+    parser.add_argument(
+        "--record", metavar="DIR", help="proxy to the real APIs and save fixtures here"
+    )
+    parser.add_argument(
+        "--replay", metavar="DIR", help="answer from fixtures saved with --record"
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="404 instead of synthesising unknown requests",
+    )
+    parser.add_argument("--upstream-gemini", default=SETTINGS["upstream_gemini"])
+    parser.add_argument("--upstream-aiml", default=SETTINGS["upstream_aiml"])
+    parser.add_argument(
+        "--seed", type=int, help="seed for fault injection (reproducible runs)"
+    )
+    args = parser.parse_args()
+
+    SETTINGS.update(
+        {
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "rate_429": args.rate_429,
+            "rate_500": args.rate_500,
+            "retry_after": args.retry_after,
+            "truncate": args.truncate,
+            "stream_chunks": args.stream_chunks,
+            "stream_chunk_delay": args.stream_chunk_delay,
+            "record_dir": args.record,
+            "replay_dir": args.replay,
+            "strict": args.strict,
+            "upstream_gemini": args.upstream_gemini.rstrip("/"),
+            "upstream_aiml": args.upstream_aiml.rstrip("/"),
+            "seed": args.seed,
+        }
+    )
+    if args.seed is not None:
+        _rng.seed(args.seed)
+
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
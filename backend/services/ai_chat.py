@@ -4,12 +4,33 @@ Handles both visualization control (JSON) and concept explanation (text).
 Uses Google Gemini API.
 """
 import json
-import requests
-import time
-from config import GEMINI_API_KEY, GEMINI_FALLBACK_API_KEY, GEMINI_MODEL
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 
+from config import GEMINI_MODEL
+from services.llm_gateway import (
+    CircuitOpenError,
+    LLMError,
+    LLMTimeoutError,
+    extract_text,
+    generate_content,
+    llm_available,
+    stream_generate_content,
+)
+from services import metrics
+from services.prompt_registry import PromptTemplate, prompt_registry
+from services.retry_policy import RetryPolicy
+from utils.json_stream import StringFieldStream
+from utils.log import get_logger, log_payload
 
-VISUALISER_CHAT_PROMPT = """You are an Intelligent Visualization Assistant embedded inside an educational app.
+logger = get_logger("chat")
+
+CHAT_RETRY_POLICY = RetryPolicy(max_attempts=3, total_deadline=75)
+
+
+VISUALISER_CHAT_PROMPT = prompt_registry.register(PromptTemplate(
+    name="visualiser_chat",
+    version=2,
+    prefix="""You are an Intelligent Visualization Assistant embedded inside an educational app.
 
 You have two distinct responsibilities:
 1. Visualization Controller – modify visualization parameters by editing JSON.
@@ -33,156 +54,196 @@ Use this mode if the user:
 
 👉 ALWAYS Output strictly as JSON. 
 Schema:
-{{
+{
   "type": "update" | "chat",
-  "changes": {{ "variable_name": value }},  // Only for "update" type
+  "changes": { "variable_name": value },  // Only for "update" type
   "message": "Text response here"         // Only for "chat" type
-}}
+}
 
 Examples:
 
 User: "Set speed to 50"
 JSON:
-{{
+{
   "type": "update",
-  "changes": {{ "speed": 50 }}
-}}
+  "changes": { "speed": 50 }
+}
 
 User: "Why does it curve?"
 JSON:
-{{
+{
   "type": "chat", 
   "message": "It curves because gravity acts downwards..."
-}}
-
-📊 Current Visualization State:
-Topic: {topic}
-Parameters: {parameters}
+}
 
 Rules:
-- Only modify variables from the current parameters list above.
+- Only modify variables from the current parameters list in the message.
 - Values must be numbers (integer or float).
 - No markdown formatting in the JSON output.
-- If the user asks for "gold atoms", infer proper values.
+- If the user asks for "gold atoms", infer proper values.""",
+    suffix="""{history}📊 Current Visualization State:
+Topic: {topic}
+Parameters: {parameters}
 
 USER MESSAGE:
-{user_message}"""
+{user_message}""",
+))
 
 
-async def process_visualiser_chat(
-    user_message: str,
-    topic: str,
-    parameters: dict,
-    chat_history: list = None,
-    api_key: str = None
-) -> dict:
-    """
-    Process a chat message for the visualiser using Google Gemini.
-    Returns either JSON updates or text explanation.
-    """
-    
+def _precheck(user_message: str, api_key: Optional[str]) -> Optional[dict]:
+    """Replies that don't need a model call (empty message, no key configured)."""
     if not user_message or len(user_message.strip()) < 2:
         return {"type": "chat", "message": "Please ask a question or give a command."}
     
-    # Use provided key or fall back to config
-    gemini_key = api_key if (api_key and api_key.startswith("AIza")) else GEMINI_API_KEY
-    if not gemini_key and GEMINI_FALLBACK_API_KEY and GEMINI_FALLBACK_API_KEY.startswith("AIza"):
-        gemini_key = GEMINI_FALLBACK_API_KEY
-    
-    if not gemini_key:
+    # Use provided key or fall back to the configured key pool
+    if not llm_available(api_key):
         return {"type": "chat", "message": "AI not configured. Please add your Gemini API key."}
-    
+    return None
+
+
+def _build_chat_payload(user_message: str, topic: str, parameters: dict, chat_history: list = None) -> Dict[str, Any]:
     # Format parameters for prompt
     params_str = json.dumps(parameters, indent=2) if parameters else "{}"
-    
-    full_prompt = VISUALISER_CHAT_PROMPT.format(
-        topic=topic,
-        parameters=params_str,
-        user_message=user_message.strip()
-    )
-    
-    # Add chat history context
+
+    # Recent conversation goes after the static prefix so the prefix stays cacheable
+    history_text = ""
     if chat_history:
-        history_text = "\n\nRecent conversation:\n"
+        history_text = "Recent conversation:\n"
         for msg in chat_history[-4:]:
             role = "User" if msg.get("isUser") else "Assistant"
             history_text += f"{role}: {msg.get('text', '')[:200]}\n"
-        full_prompt = history_text + "\n" + full_prompt
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={gemini_key}"
-    
-    payload = {
-        "contents": [{
-            "parts": [{"text": full_prompt}]
-        }],
-        "generationConfig": {
+        history_text += "\n"
+
+    payload = VISUALISER_CHAT_PROMPT.payload(
+        {
             "temperature": 0.3,
             "maxOutputTokens": 800,
             "response_mime_type": "application/json"
-        }
-    }
+        },
+        history=history_text,
+        topic=topic,
+        parameters=params_str,
+        user_message=user_message.strip(),
+    )
+    return payload
+
+
+async def process_visualiser_chat(
+    user_message: str,
+    topic: str,
+    parameters: dict,
+    chat_history: list = None,
+    api_key: str = None
+) -> dict:
+    """
+    Process a chat message for the visualiser using Google Gemini.
+    Returns either JSON updates or text explanation.
+    """
     
-    max_retries = 3
-    current_key = gemini_key
-    fallback_key = GEMINI_FALLBACK_API_KEY if (GEMINI_FALLBACK_API_KEY and GEMINI_FALLBACK_API_KEY.startswith("AIza")) else None
-
-    for attempt in range(max_retries):
-        try:
-            # Update URL with current key
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={current_key}"
-            
-            print(f"🤖 Visualiser Chat via Gemini: '{user_message[:50]}...'")
-            
-            response = requests.post(url, json=payload, headers={"Content-Type": "application/json"}, timeout=60)
-            
-            # Key/Permission Error Fallback
-            if response.status_code in [400, 401, 403]:
-                print(f"⚠ Gemini Key Error ({response.status_code}).")
-                if fallback_key and current_key != fallback_key:
-                    print("🔄 Switching to fallback key from environment and retrying...")
-                    current_key = fallback_key
-                    continue
-                else:
-                    print("❌ Available Gemini key failed and no alternate fallback key is configured.")
-                    break
-
-            # Handle rate limiting with retry AND Key Switch
-            if response.status_code == 429:
-                print("⏳ Rate limited (429).")
-                if fallback_key and current_key != fallback_key:
-                    print("🔄 Switching to fallback key from environment for rate limit handling...")
-                    current_key = fallback_key
-                    continue # Immediate retry with new key
-
-                wait_time = (2 ** attempt) + 1
-                print(f"⏳ Verification: Waiting {wait_time}s (attempt {attempt+1}/{max_retries})")
-                time.sleep(wait_time)
-                continue
-            
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if 'candidates' not in data or len(data['candidates']) == 0:
-                continue
-            
-            raw_response = data['candidates'][0]['content']['parts'][0]['text'].strip()
-            return _parse_chat_response(raw_response)
-            
-        except requests.exceptions.Timeout:
-            return {"type": "chat", "message": "Request timed out. Please try again."}
-        except Exception as e:
-            print(f"❌ Visualiser chat error: {e}")
-            if attempt == max_retries - 1:
-                return {"type": "chat", "message": "Sorry, I encountered an error. Please try again."}
+    early = _precheck(user_message, api_key)
+    if early:
+        return early
+
+    payload = _build_chat_payload(user_message, topic, parameters, chat_history)
     
-    return {"type": "chat", "message": "Rate limited. Please try again."}
+    try:
+        logger.info("Visualiser chat via Gemini", extra={"topic": topic, "message_chars": len(user_message)})
+        data = await generate_content(
+            payload,
+            api_key=api_key,
+            model=GEMINI_MODEL,
+            timeout=60,
+            policy=CHAT_RETRY_POLICY,
+            call_site="visualiser_chat",
+        )
+    except LLMError as e:
+        return _error_reply(e)
+
+    raw_response = extract_text(data)
+    if not raw_response:
+        return {"type": "chat", "message": "Sorry, I encountered an error. Please try again."}
+
+    return _parse_chat_response(raw_response.strip())
+
+
+async def stream_visualiser_chat(
+    user_message: str,
+    topic: str,
+    parameters: dict,
+    chat_history: list = None,
+    api_key: str = None
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Streaming variant of ``process_visualiser_chat``.
+
+    Yields ``("token", {"text": ...})`` with the ``message`` text of a chat
+    reply as Gemini writes it, then one ``("done", result)`` carrying the same
+    dict ``process_visualiser_chat`` returns. Message text is held back until
+    the reply's ``"type"`` has streamed, so ``update`` replies produce no
+    tokens: their parameter changes only arrive, all at once, in ``done``.
+    """
+    early = _precheck(user_message, api_key)
+    if early:
+        yield "done", early
+        return
+
+    payload = _build_chat_payload(user_message, topic, parameters, chat_history)
+    reply_kind = StringFieldStream("type")
+    message = StringFieldStream("message")
+    reply_type = ""
+    pending = ""
+    raw_parts = []
+
+    try:
+        logger.info("Streaming visualiser chat via Gemini", extra={"topic": topic, "message_chars": len(user_message)})
+        async for delta in stream_generate_content(
+            payload,
+            api_key=api_key,
+            model=GEMINI_MODEL,
+            timeout=60,
+            call_site="visualiser_chat_stream",
+        ):
+            raw_parts.append(delta)
+            reply_type += reply_kind.feed(delta)
+            pending += message.feed(delta)
+            if pending and reply_kind.finished and reply_type == "chat":
+                yield "token", {"text": pending}
+                pending = ""
+    except LLMError as e:
+        yield "done", _error_reply(e)
+        return
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        # Malformed SSE chunk from Gemini
+        logger.error("Malformed visualiser chat stream: %s", e, extra={"topic": topic})
+        metrics.record_fallback("visualiser_chat", "llm_error")
+        yield "done", {"type": "chat", "message": "Sorry, I encountered an error. Please try again."}
+        return
+
+    raw_response = "".join(raw_parts)
+    if not raw_response:
+        yield "done", {"type": "chat", "message": "Sorry, I encountered an error. Please try again."}
+        return
+    yield "done", _parse_chat_response(raw_response.strip())
+
+
+def _error_reply(e: LLMError) -> dict:
+    if isinstance(e, LLMTimeoutError):
+        metrics.record_fallback("visualiser_chat", "timeout")
+        return {"type": "chat", "message": "Request timed out. Please try again."}
+    if isinstance(e, CircuitOpenError):
+        metrics.record_fallback("visualiser_chat", "circuit_open")
+        return {"type": "chat", "message": "The AI tutor is temporarily unavailable. Please try again in a minute."}
+    logger.error("Visualiser chat error: %s", e)
+    metrics.record_fallback("visualiser_chat", "rate_limited" if e.status_code == 429 else "llm_error")
+    if e.status_code == 429:
+        return {"type": "chat", "message": "Rate limited. Please try again."}
+    return {"type": "chat", "message": "Sorry, I encountered an error. Please try again."}
 
 
 def _parse_chat_response(raw_response: str) -> dict:
     """Helper to parse JSON response."""
-    print(f"💎 Gemini Response: {raw_response[:200]}")
-    
+    log_payload(logger, "Raw Gemini chat response", raw_response)
+
     try:
         parsed = json.loads(raw_response)
         
@@ -202,5 +263,6 @@ def _parse_chat_response(raw_response: str) -> dict:
              return {"type": "chat", "message": raw_response[:200]}
              
     except json.JSONDecodeError:
-        print(f"❌ Failed to parse JSON: {raw_response[:100]}")
+        metrics.record_parse_failure("visualiser_chat")
+        logger.error("Failed to parse chat JSON", extra={"response_chars": len(raw_response)})
         return {"type": "chat", "message": "I couldn't understand that. Please try again."}
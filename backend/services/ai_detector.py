@@ -1,43 +1,77 @@
-import json
-import requests
-import re
-import base64
-import time
-from typing import List, Tuple
-from config import GEMINI_API_KEY, GEMINI_FALLBACK_API_KEY, GEMINI_MODEL
-
-
-def _gemini_request_with_retry(url: str, payload: dict, timeout: int = 30, max_retries: int = 3):
-    """Make Gemini API request with exponential backoff for rate limiting."""
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(
-                url, 
-                json=payload, 
-                headers={"Content-Type": "application/json"}, 
-                timeout=timeout
-            )
-            
-            if response.status_code == 429:
-                wait_time = (2 ** attempt) + 1
-                print(f"⏳ Rate limited (429). Waiting {wait_time}s (attempt {attempt+1}/{max_retries})")
-                time.sleep(wait_time)
-                continue
-                
-            response.raise_for_status()
-            return response
-            
-        except requests.exceptions.HTTPError as e:
-            if hasattr(e, 'response') and e.response is not None and e.response.status_code == 429:
-                if attempt < max_retries - 1:
-                    wait_time = (2 ** attempt) + 1
-                    print(f"⏳ Rate limited (429). Waiting {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
-            raise
-    
-    print(f"❌ Max retries ({max_retries}) exceeded for Gemini API")
-    return None
+import asyncio
+import hashlib
+from collections import Counter
+from typing import Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from config import (
+    DETECT_HEDGE_DELAY,
+    DETECT_HEDGE_ENABLED,
+    DETECT_HEDGE_MAX_OCR_CHARS,
+    DETECT_HEDGE_MIN_ALPHA_RATIO,
+    DETECT_HEDGE_WEAK_KEYWORD_HITS,
+    GEMINI_MODEL,
+    SCAN_DETECT_GRACE_SECONDS,
+)
+from services import deadline, metrics
+from services.circuit_breaker import GEMINI_TEXT, GEMINI_VISION, is_open
+from services.detection_cache import detection_cache
+from services.similar_scans import similar_scans
+from services.vision_image import vision_images
+from services.llm_gateway import CircuitOpenError, LLMError, generate_content, llm_available, user_key
+from services.retry_policy import RetryPolicy
+from services.single_flight import SingleFlight, normalize_text
+from utils.json_stream import extract_json
+from utils.log import get_logger, log_payload
+
+logger = get_logger("detect")
+
+# Text detection should be quick; vision gets a little more room per attempt.
+TEXT_RETRY_POLICY = RetryPolicy(max_attempts=3, total_deadline=45)
+VISION_RETRY_POLICY = RetryPolicy(max_attempts=3, total_deadline=90)
+TEXT_CACHE_TTL = 24 * 3600
+# Don't start a model call with less than this much of the request deadline
+# left; the keyword topic is returned instead.
+TEXT_MIN_BUDGET = 1.0
+VISION_MIN_BUDGET = 3.0
+
+detect_flights = SingleFlight("detect_topic")
+
+# Hedged text+vision detection outcomes: "hedged", "text_won", "vision_won",
+# "no_confident_answer", "<side>_cancelled", plus "reason:<why hedged>"
+HEDGE_COUNTS: Counter = Counter()
+
+UNCONFIDENT_TOPICS = frozenset({"", "Unknown", "General Science"})
+
+
+async def _gemini_request(
+    api_key: Optional[str],
+    payload: dict,
+    timeout: int,
+    policy: RetryPolicy,
+    call_site: str,
+    cache_ttl: Optional[float] = None,
+    upstream: str = GEMINI_TEXT,
+    validate: Optional[Callable[[str], bool]] = None,
+) -> Optional[dict]:
+    """Make a Gemini API request through the gateway (retries + key failover + circuit breaker)."""
+    try:
+        return await generate_content(
+            payload,
+            api_key,
+            model=GEMINI_MODEL,
+            timeout=timeout,
+            policy=policy,
+            call_site=call_site,
+            cache_ttl=cache_ttl,
+            upstream=upstream,
+            validate=validate,
+        )
+    except CircuitOpenError:
+        logger.info("%s: Gemini circuit open, using keyword detection", call_site)
+        return None
+    except LLMError as e:
+        logger.error("Gemini request failed (%s): %s", call_site, e)
+        return None
 
 
 # Keyword-based fallback for common topics
@@ -65,62 +99,129 @@ def detect_topic_from_keywords(text: str) -> str:
     for topic, keywords in TOPIC_KEYWORDS.items():
         for keyword in keywords:
             if keyword in text_lower:
-                print(f"📌 Keyword match: '{keyword}' -> {topic}")
+                logger.debug("Keyword match: %r -> %s", keyword, topic)
                 return topic
     
     return "Unknown"
 
 
-def extract_json_from_text(text: str) -> dict:
-    """Extract JSON from LLM output with multiple strategies."""
-    if not text:
-        return None
-        
-    text = text.strip()
-    
-    # Remove markdown
-    text = re.sub(r"```json\s*", "", text)
-    text = re.sub(r"```\s*", "", text)
-    text = text.strip()
-    
-    # Try direct parse
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
-    
-    # Find JSON object (GREEDY match for nested objects)
-    # This finds the string between the FIRST '{' and the LAST '}'
-    match = re.search(r'\{[\s\S]*\}', text)
-    if match:
-        try:
-            return json.loads(match.group())
-        except json.JSONDecodeError:
-            pass
-    
+def keyword_hits(text: str) -> Dict[str, int]:
+    """Number of matching keywords per topic (topics without a match are omitted)."""
+    text_lower = text.lower()
+    hits = {topic: sum(1 for k in keywords if k in text_lower) for topic, keywords in TOPIC_KEYWORDS.items()}
+    return {topic: n for topic, n in hits.items() if n}
+
+
+def _hedge_reason(ocr_text: str) -> Optional[str]:
+    """Why text-only detection is likely to be unreliable for this OCR text, if it is."""
+    stripped = ocr_text.strip()
+    if len(stripped) <= DETECT_HEDGE_MAX_OCR_CHARS:
+        return "short_ocr"
+    visible = [c for c in stripped if not c.isspace()]
+    if sum(c.isalpha() for c in visible) / len(visible) < DETECT_HEDGE_MIN_ALPHA_RATIO:
+        return "noisy_ocr"
+    if max(keyword_hits(stripped).values(), default=0) <= DETECT_HEDGE_WEAK_KEYWORD_HITS:
+        return "weak_keywords"
     return None
 
 
-async def detect_topic(ocr_text: str, image_path: str = None, api_key: str = None) -> Tuple[str, List[str]]:
+def _file_digest(path: str) -> Optional[str]:
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+async def detect_topic(
+    ocr_text: str,
+    image_path: str = None,
+    api_key: str = None,
+    image_sha256: Optional[str] = None,
+    phash: Optional[int] = None,
+    image_view: Optional[BinaryIO] = None,
+) -> Tuple[str, List[str]]:
     """
     Detect STEM topic using Google Gemini API.
     Strategy:
     1. If OCR text is available, try Text-Only model (Fast).
     2. If Text model fails (returns Unknown) OR OCR is poor, use Vision model.
+    Borderline scans (short or noisy OCR, weak keyword match) with an image
+    race both models instead and keep the first confident answer.
+
+    Concurrent uploads of the same page (same OCR text and image bytes) share
+    a single detection, and an image that was detected before (by SHA-256,
+    ``image_sha256`` if the caller already has it) returns the cached result
+    without calling Gemini (``services/detection_cache.py``). With a perceptual
+    hash (``phash``), a near-duplicate of an earlier scan reuses that scan's
+    detection (``services/similar_scans.py``). With ``image_view`` (a memory
+    map of the stored upload, ``StoredScan.view``) the vision call reads the
+    image from it instead of reopening ``image_path``.
+
+    Bounded by the request deadline (``services/deadline.py``) when one is set:
+    once it passes, the keyword-matched topic is returned.
     """
-    
-    # Use provided key or fall back to config
-    gemini_key = api_key if (api_key and api_key.startswith("AIza")) else GEMINI_API_KEY
-    fallback_key = GEMINI_FALLBACK_API_KEY if (GEMINI_FALLBACK_API_KEY and GEMINI_FALLBACK_API_KEY.startswith("AIza")) else None
+    image_digest = image_sha256
+    if image_digest is None and image_path:
+        image_digest = await asyncio.to_thread(_file_digest, image_path)
+    if image_digest:
+        cached = await detection_cache.get(image_digest)
+        if cached is not None:
+            return cached
+        similar = await similar_scans.reuse_detection(phash, image_digest)
+        if similar is not None:
+            await detection_cache.set(image_digest, *similar)
+            return similar
+    flight_key = (normalize_text(ocr_text), image_digest, user_key(api_key))
+    detection = detect_flights.do(
+        flight_key, lambda: _detect_and_cache(ocr_text, image_path, api_key, image_digest, image_view)
+    )
+    if deadline.remaining() is None:
+        return await detection
+    fallback = (detect_topic_from_keywords(ocr_text) if ocr_text else "Unknown", [])
+    result = await deadline.within_deadline(detection, fallback)
+    if result is fallback:
+        metrics.record_fallback("detect", "deadline")
+        logger.warning("Topic detection hit the request deadline. Using keyword topic: %s", fallback[0])
+    return result
 
-    if not gemini_key:
-        gemini_key = fallback_key
-    
+
+async def _detect_and_cache(
+    ocr_text: str,
+    image_path: Optional[str],
+    api_key: Optional[str],
+    image_digest: Optional[str],
+    image_view: Optional[BinaryIO] = None,
+) -> Tuple[str, List[str]]:
+    # Runs as the shared flight task under the leader's deadline plus a short
+    # grace period: a Gemini answer arriving just after the leader gave up
+    # with its keyword topic is still cached, but every call keeps shrinking
+    # its timeouts to the (extended) budget and stops once it runs out
+    with deadline.extend_deadline(SCAN_DETECT_GRACE_SECONDS):
+        topic, variables, from_model = await _detect_topic(ocr_text, image_path, api_key, image_digest, image_view)
+    if image_digest and from_model and topic not in UNCONFIDENT_TOPICS:
+        await detection_cache.set(image_digest, topic, variables)
+    return topic, variables
+
+
+async def _detect_topic(
+    ocr_text: str,
+    image_path: Optional[str],
+    api_key: Optional[str],
+    image_digest: Optional[str] = None,
+    image_view: Optional[BinaryIO] = None,
+) -> Tuple[str, List[str], bool]:
+    """Detected (topic, variables, from_model); from_model is False for keyword fallbacks."""
     # 1. Try Keyword fallback first (Fastest)
     keyword_topic = detect_topic_from_keywords(ocr_text) if ocr_text else "Unknown"
 
-    if not gemini_key:
-        return keyword_topic, []
+    # Use provided key or fall back to the configured key pool
+    if not llm_available(api_key):
+        metrics.record_fallback("detect", "no_key")
+        return keyword_topic, [], False
     
     # 2. Determine if we skip straight to Vision (Sparse text)
     skip_text_model = not ocr_text or len(ocr_text.strip()) < 10
@@ -128,52 +229,119 @@ async def detect_topic(ocr_text: str, image_path: str = None, api_key: str = Non
     topic = "Unknown"
     variables = []
 
+    # --- BORDERLINE: race TEXT and VISION, first confident answer wins ---
+    if not skip_text_model and image_path and DETECT_HEDGE_ENABLED and not is_open(GEMINI_VISION):
+        reason = _hedge_reason(ocr_text)
+        if reason:
+            logger.info("Borderline scan (%s). Racing Gemini Text and Vision", reason, extra={"hedge_reason": reason})
+            HEDGE_COUNTS[f"reason:{reason}"] += 1
+            topic, variables = await _hedged_detection(api_key, ocr_text, image_path, image_digest, image_view)
+            if topic == "Unknown":
+                metrics.record_fallback("detect", "keyword")
+                return keyword_topic, variables, False
+            return topic, variables, True
+
     # --- ATTEMPT 1: TEXT MODEL ---
     if not skip_text_model:
-        print(f"🔍 Text detected ({len(ocr_text)} chars). Using Gemini Text...")
+        logger.debug("Text detected (%d chars). Using Gemini Text", len(ocr_text))
         try:
-            topic, variables = await _query_gemini_text(gemini_key, ocr_text)
+            topic, variables = await _query_gemini_text(api_key, ocr_text)
         except Exception as e:
-            print(f"⚠ Gemini text error with primary key: {e}")
-            if fallback_key and gemini_key != fallback_key:
-                try:
-                    print("🔄 Retrying Text Model with fallback key from environment...")
-                    topic, variables = await _query_gemini_text(fallback_key, ocr_text)
-                except Exception as e2:
-                    print(f"❌ Gemini text fallback failed: {e2}")
-                    topic = "Unknown"
-            else:
-                topic = "Unknown"
+            logger.warning("Gemini text error: %s", e)
+            topic = "Unknown"
             
 
     # --- ATTEMPT 2: VISION MODEL (Fallback) ---
     if (topic == "Unknown" or topic == "General Science") and image_path:
         reason = "Short Text" if skip_text_model else "Text Model failed"
-        print(f"👁 {reason}. Using Gemini Vision...")
+        logger.debug("%s. Using Gemini Vision", reason)
         
         try:
-            topic, variables = await _query_gemini_vision(gemini_key, image_path, ocr_text)
+            topic, variables = await _query_gemini_vision(api_key, image_path, ocr_text, image_digest, image_view)
         except Exception as e:
-            print(f"❌ Gemini vision error with primary key: {e}")
-            if fallback_key and gemini_key != fallback_key:
-                try:
-                    print("🔄 Retrying Vision Model with fallback key from environment...")
-                    topic, variables = await _query_gemini_vision(fallback_key, image_path, ocr_text)
-                except Exception as e2:
-                    print(f"❌ Gemini vision fallback failed: {e2}")
+            logger.error("Gemini vision error: %s", e)
 
             
     # Final Fallback
     if topic == "Unknown":
-        topic = keyword_topic
+        metrics.record_fallback("detect", "keyword")
+        return keyword_topic, variables, False
 
-    return topic, variables
+    return topic, variables, True
+
+
+async def _quietly(side: str, query: Awaitable[Tuple[str, List[str]]]) -> Tuple[str, List[str]]:
+    try:
+        return await query
+    except Exception as e:
+        logger.warning("Gemini %s error: %s", side, e)
+        return "Unknown", []
 
 
-async def _query_gemini_text(api_key: str, text: str) -> Tuple[str, List[str]]:
+async def _hedged_detection(
+    api_key: Optional[str],
+    ocr_text: str,
+    image_path: str,
+    image_digest: Optional[str] = None,
+    image_view: Optional[BinaryIO] = None,
+) -> Tuple[str, List[str]]:
+    """
+    Run text and vision detection concurrently and return the first confident
+    topic, cancelling the other call. Vision starts ``DETECT_HEDGE_DELAY``
+    seconds after text (0 = together), so a quick confident text answer can
+    still avoid the vision call entirely.
+    """
+    HEDGE_COUNTS["hedged"] += 1
+    sides: Dict["asyncio.Task[Tuple[str, List[str]]]", str] = {
+        asyncio.create_task(_quietly("text", _query_gemini_text(api_key, ocr_text))): "text",
+    }
+    pending = set(sides)
+    best: Tuple[str, List[str]] = ("Unknown", [])
+    vision_started = False
+    hedge_delay = DETECT_HEDGE_DELAY
+    try:
+        while pending or not vision_started:
+            timeout = None
+            if not vision_started:
+                if pending and hedge_delay > 0:
+                    timeout, hedge_delay = hedge_delay, 0
+                else:
+                    vision = _query_gemini_vision(api_key, image_path, ocr_text, image_digest, image_view)
+                    task = asyncio.create_task(_quietly("vision", vision))
+                    sides[task] = "vision"
+                    pending.add(task)
+                    vision_started = True
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                continue  # hedge delay elapsed: start vision
+            for task in done:
+                topic, variables = task.result()
+                if topic not in UNCONFIDENT_TOPICS:
+                    HEDGE_COUNTS[f"{sides[task]}_won"] += 1
+                    logger.info("Gemini %s answered first: %s", sides[task], topic, extra={"winner": sides[task]})
+                    return topic, variables
+                if best[0] == "Unknown" and topic:
+                    best = (topic, variables)
+        HEDGE_COUNTS["no_confident_answer"] += 1
+        return best
+    finally:
+        for task in pending:
+            task.cancel()
+            HEDGE_COUNTS[f"{sides[task]}_cancelled"] += 1
+
+
+def _has_topic(raw_text: str) -> bool:
+    """Response cache check: only replies naming a topic are cached."""
+    parsed = extract_json(raw_text, opening="{")
+    return isinstance(parsed, dict) and bool(parsed.get("topic"))
+
+
+async def _query_gemini_text(api_key: Optional[str], text: str) -> Tuple[str, List[str]]:
     """Query Google Gemini API for text-based topic detection."""
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}"
-    
+    if deadline.expired(TEXT_MIN_BUDGET):
+        logger.info("Skipping Gemini text detection: request deadline nearly reached")
+        return "Unknown", []
+
     system_prompt = """You are an expert STEM topic classifier. Analyze the given text and return ONLY valid JSON.
 
 STRICT RULES:
@@ -198,44 +366,62 @@ Return ONLY the JSON, no markdown, no explanation."""
         }
     }
     
-    response = _gemini_request_with_retry(url, payload, timeout=30)
-    if not response:
+    data = await _gemini_request(
+        api_key,
+        payload,
+        timeout=30,
+        policy=TEXT_RETRY_POLICY,
+        call_site="detect_text",
+        cache_ttl=TEXT_CACHE_TTL,
+        validate=_has_topic,
+    )
+    if not data:
         return "Unknown", []
-    data = response.json()
     
     try:
         candidates = data.get('candidates', [])
         if not candidates:
-            print(f"⚠ Gemini Trace: No candidates in response. Data: {data}")
+            logger.warning("Gemini text detection: no candidates in response")
+            log_payload(logger, "Gemini text detection response", data)
             return "Unknown", []
             
         content = candidates[0].get('content', {})
         parts = content.get('parts', [])
         if not parts:
-            print(f"⚠ Gemini Trace: No parts in candidate content. Content: {content}")
+            logger.warning("Gemini text detection: no parts in candidate content")
+            log_payload(logger, "Gemini text detection content", content)
             return "Unknown", []
 
         raw = parts[0].get('text', '')
-        print(f"💎 Gemini Response: {raw[:100]}...")
-        parsed = extract_json_from_text(raw)
+        log_payload(logger, "Gemini text detection response", raw)
+        parsed = extract_json(raw, opening="{")
         if parsed:
             return parsed.get("topic", "Unknown"), [str(x) for x in parsed.get("variables", [])]
         else:
-            print(f"❌ Failed to extract JSON from: {raw[:200]}")
+            metrics.record_parse_failure("detect_text")
+            logger.error("Failed to extract JSON from text detection response", extra={"response_chars": len(raw)})
     except Exception as e:
-        print(f"❌ Gemini Parse Error: {e}")
+        logger.error("Gemini text detection parse error: %s", e)
         
     return "Unknown", []
 
 
-async def _query_gemini_vision(api_key: str, image_path: str, ocr_text: str = "") -> Tuple[str, List[str]]:
-    """Query Google Gemini API for vision-based topic detection."""
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}"
-    
-    with open(image_path, "rb") as img_file:
-        b64_image = base64.b64encode(img_file.read()).decode('utf-8')
+async def _query_gemini_vision(
+    api_key: Optional[str],
+    image_path: str,
+    ocr_text: str = "",
+    image_digest: Optional[str] = None,
+    image_view: Optional[BinaryIO] = None,
+) -> Tuple[str, List[str]]:
+    """
+    Query Google Gemini API for vision-based topic detection. The image is
+    sent downscaled and re-encoded (``services/vision_image.py``).
+    """
+    if deadline.expired(VISION_MIN_BUDGET):
+        logger.info("Skipping Gemini vision detection: request deadline nearly reached")
+        return "Unknown", []
 
-    mime_type = "image/png" if image_path.lower().endswith(".png") else "image/jpeg"
+    image = await vision_images.get(image_path, image_digest, image_view)
 
     system_prompt = """Analyze this physics/science image carefully. What specific topic is being shown?
 
@@ -256,8 +442,8 @@ No markdown formatting, just the raw JSON."""
                 {"text": f"{system_prompt}\nContext text: {ocr_text[:200]}"},
                 {
                     "inline_data": {
-                        "mime_type": mime_type,
-                        "data": b64_image
+                        "mime_type": image.mime_type,
+                        "data": image.data_b64
                     }
                 }
             ]
@@ -269,15 +455,17 @@ No markdown formatting, just the raw JSON."""
         }
     }
     
-    response = _gemini_request_with_retry(url, payload, timeout=60)
-    if not response:
+    data = await _gemini_request(
+        api_key, payload, timeout=60, policy=VISION_RETRY_POLICY, call_site="detect_vision", upstream=GEMINI_VISION
+    )
+    if not data:
         return "Unknown", []
-    data = response.json()
     
     try:
         candidates = data.get('candidates', [])
         if not candidates:
-            print(f"⚠ Gemini Vision Trace: No candidates in response. Data: {data}")
+            logger.warning("Gemini vision detection: no candidates in response")
+            log_payload(logger, "Gemini vision detection response", data)
             return "Unknown", []
             
         content = candidates[0].get('content', {})
@@ -285,17 +473,18 @@ No markdown formatting, just the raw JSON."""
         if not parts:
              # Safety check for 'finishReason'
             finish_reason = candidates[0].get('finishReason')
-            print(f"⚠ Gemini Vision Trace: No parts. Finish Reason: {finish_reason}")
+            logger.warning("Gemini vision detection: no parts (finish reason %s)", finish_reason)
             return "Unknown", []
 
         raw = parts[0].get('text', '')
-        print(f"💎 Gemini Vision Response: {raw[:100]}...")
-        parsed = extract_json_from_text(raw)
+        log_payload(logger, "Gemini vision detection response", raw)
+        parsed = extract_json(raw, opening="{")
         if parsed:
             return parsed.get("topic", "Unknown"), [str(x) for x in parsed.get("variables", [])]
         else:
-            print(f"❌ Failed to extract JSON from Vision response: {raw[:200]}")
+            metrics.record_parse_failure("detect_vision")
+            logger.error("Failed to extract JSON from vision detection response", extra={"response_chars": len(raw)})
     except Exception as e:
-        print(f"❌ Gemini Vision Parse Error: {e}")
+        logger.error("Gemini vision detection parse error: %s", e)
         
     return "Unknown", []
@@ -1,85 +1,63 @@
-import json
-import re
-import requests
-import time
-from typing import Optional
-from fastapi.concurrency import run_in_threadpool
-from config import GEMINI_API_KEY, GEMINI_FALLBACK_API_KEY, GEMINI_MODEL
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from config import GEMINI_MODEL
 from models.notes_models import NotesResponse
+from services.llm_gateway import (
+    LLMError,
+    extract_text,
+    generate_content,
+    llm_available,
+    stream_generate_content,
+    user_key,
+)
+from services import metrics
+from services.prompt_registry import PromptTemplate, prompt_registry
+from services.retry_policy import RetryPolicy
+from services.single_flight import SingleFlight, normalize_text
+from utils.json_stream import TopLevelObjectStream, parse_model
+from utils.log import get_logger, log_payload
 
+logger = get_logger("notes")
 
-def clean_json_output(text: str):
-    """Extract JSON from LLM output, handling markdown code blocks and various formats."""
-    if not text:
-        return None
-        
-    text = text.strip()
-    
-    # Strategy 1: Strip markdown code blocks more aggressively
-    # Handle ```json ... ``` format
-    json_block_match = re.search(r'```json\s*([\s\S]*?)\s*```', text)
-    if json_block_match:
-        text = json_block_match.group(1).strip()
-    else:
-        # Also handle ``` ... ``` without json tag
-        code_block_match = re.search(r'```\s*([\s\S]*?)\s*```', text)
-        if code_block_match:
-            text = code_block_match.group(1).strip()
-        else:
-            # Fallback: just strip the markers if they exist
-            text = re.sub(r'^```json\s*', '', text)
-            text = re.sub(r'^```\s*', '', text)
-            text = re.sub(r'\s*```$', '', text)
-            text = text.strip()
-    
-    # Strategy 2: Try direct parse
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
-    
-    # Strategy 3: Find JSON object with greedy regex (outermost braces)
-    # Use a more careful approach to find balanced braces
-    match = re.search(r'\{[\s\S]*\}', text)
-    if match:
-        json_str = match.group()
-        try:
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            # Try to fix common issues
-            pass
-    
-    # Strategy 4: Find the first { and try parsing from there
-    first_brace = text.find('{')
-    if first_brace != -1:
-        potential_json = text[first_brace:]
-        try:
-            return json.loads(potential_json)
-        except json.JSONDecodeError:
-            pass
-    
-    print(f"❌ clean_json_output: All strategies failed. Text starts with: {text[:100]}")
-    return None
-
-
-def _call_gemini_api_sync(prompt: str, system_prompt: str = "", max_tokens: int = 1000, timeout: int = 120, api_key: str = None, json_mode: bool = False):
-    """Blocking call to Google Gemini API with exponential backoff retry."""
-    key = api_key or GEMINI_API_KEY
-    fallback_key = GEMINI_FALLBACK_API_KEY if (GEMINI_FALLBACK_API_KEY and GEMINI_FALLBACK_API_KEY.startswith("AIza")) else None
-
-    if not key:
-        if fallback_key:
-            print("⚠ No primary Gemini API key configured. Using fallback key from environment.")
-            key = fallback_key
-        else:
-            print("⚠ No Gemini API key configured.")
-            return None
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={key}"
-    
+NOTES_RETRY_POLICY = RetryPolicy(max_attempts=3, total_deadline=240)
+NOTES_CACHE_TTL = 7 * 24 * 3600  # notes for a topic/context rarely need regenerating
+NOTES_MAX_TOKENS = 8192
+# Output cut off at NOTES_MAX_TOKENS is resumed instead of regenerated
+NOTES_MAX_CONTINUATIONS = 2
+
+notes_flights = SingleFlight("notes")
+
+NOTES_SYSTEM_PROMPT = prompt_registry.register(PromptTemplate(
+    name="notes",
+    version=2,
+    prefix="""Create DETAILED, STUDENT-FRIENDLY study notes in strict JSON format.
+
+Guidelines:
+- **Explanation**: Write a clear, 3-4 sentence paragraph defining the concept simply. Use analogies if helpful.
+- **Variable Breakdown**: Define each variable clearly with units.
+- **Example**: Provide a concrete, step-by-step example problem with numbers.
+- **Summary**: Key takeaways for quick revision.
+
+Output strictly as JSON:
+{
+  "explanation": "Detailed explanation of the concept...",
+  "variable_breakdown": {"v": "velocity (m/s)", "t": "time (s)"},
+  "formulas": ["F = ma"],
+  "example": "If a car accelerates...",
+  "mistakes": ["Confusing speed with velocity"],
+  "practice_questions": ["What is the force if...?", "Calculate time when..."],
+  "summary": ["Force causes acceleration", "Mass is inertia"],
+  "resources": ["Newton's Laws Video"]
+}""",
+    suffix="Topic: {topic}. Context: {context}",
+))
+
+
+def _build_payload(prompt: str, system_prompt: str = "", max_tokens: int = 1000, json_mode: bool = False) -> Dict[str, Any]:
+    """Gemini request body for ad-hoc prompts (follow-ups) that have no registered template."""
     # Combine system and user prompts
     full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
-    
+
     payload = {
         "contents": [{
             "parts": [{"text": full_prompt}]
@@ -92,69 +70,40 @@ def _call_gemini_api_sync(prompt: str, system_prompt: str = "", max_tokens: int
 
     if json_mode:
         payload["generationConfig"]["response_mime_type"] = "application/json"
-    
-    max_retries = 3
-    current_key = key
-    
-    for attempt in range(max_retries):
-        try:
-            # Update URL with current key (in case it changed)
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={current_key}"
-            
-            print(f"💎 Calling Gemini API ({GEMINI_MODEL})...")
-            response = requests.post(url, json=payload, headers={"Content-Type": "application/json"}, timeout=timeout)
-            
-            # Key/Permission Error Fallback
-            if response.status_code in [400, 401, 403]:
-                print(f"⚠ Gemini Key Error ({response.status_code}).")
-                if fallback_key and current_key != fallback_key:
-                    print("🔄 Switching to fallback key from environment and retrying...")
-                    current_key = fallback_key
-                    continue
-                else:
-                    print("❌ Available Gemini key failed and no alternate fallback key is configured.")
-                    break
-
-            # Handle rate limiting with retry AND Key Switch
-            if response.status_code == 429:
-                print("⏳ Rate limited (429).")
-                if fallback_key and current_key != fallback_key:
-                    print("🔄 Switching to fallback key from environment for rate limit handling...")
-                    current_key = fallback_key
-                    continue # Immediate retry with new key
-                
-                wait_time = (2 ** attempt) + 1
-                print(f"⏳ Verification: Waiting {wait_time}s (attempt {attempt+1}/{max_retries})")
-                time.sleep(wait_time)
-                continue
-                
-            response.raise_for_status()
-            data = response.json()
-            
-            if 'candidates' in data and len(data['candidates']) > 0:
-                return data['candidates'][0]['content']['parts'][0]['text']
-            return None
-            
-        except requests.exceptions.HTTPError as e:
-            # ... (Rest of exception handling)
-            if hasattr(e, 'response') and e.response is not None and e.response.status_code == 429:
-                if attempt < max_retries - 1:
-                    wait_time = (2 ** attempt) + 1
-                    print(f"⏳ Rate limited (429). Waiting {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
-            print(f"❌ Gemini API Error: {e}")
-            if hasattr(e, 'response') and e.response:
-                print(f"Response Body: {e.response.text}")
-             # Non-critical retry for network errors?
-             # Let's just return None to avoid infinite loops unless 429 caught above
-            return None
-        except Exception as e:
-            print(f"❌ Gemini API Error: {e}")
-            return None
-    
-    print(f"❌ Max retries ({max_retries}) exceeded for Gemini API")
-    return None
+    return payload
+
+
+async def _call_gemini_api(
+    payload: Dict[str, Any],
+    timeout: int = 120,
+    api_key: str = None,
+    cache_ttl: Optional[float] = None,
+    max_continuations: int = 1,
+    validate: Optional[Callable[[str], bool]] = None,
+):
+    """Call Google Gemini API through the shared async gateway (jittered retries + key failover)."""
+    if not llm_available(api_key):
+        logger.warning("No Gemini API key configured.")
+        return None
+
+    logger.debug("Calling Gemini API (%s)", GEMINI_MODEL)
+    try:
+        data = await generate_content(
+            payload,
+            api_key=api_key,
+            model=GEMINI_MODEL,
+            timeout=timeout,
+            policy=NOTES_RETRY_POLICY,
+            call_site="notes",
+            cache_ttl=cache_ttl,
+            max_continuations=max_continuations,
+            validate=validate,
+        )
+    except LLMError as e:
+        logger.error("Gemini API error: %s", e)
+        return None
+
+    return extract_text(data)
 
 
 async def generate_notes(
@@ -164,94 +113,187 @@ async def generate_notes(
     ocr_text: Optional[str] = None, 
     api_key: str = None
 ) -> NotesResponse:
-    
+    # The prompt only depends on topic, variables and OCR text, so concurrent
+    # requests with the same inputs share one upstream generation.
+    flight_key = (
+        normalize_text(topic),
+        tuple(sorted(normalize_text(v) for v in variables or [])),
+        normalize_text((ocr_text or "")[:1000]),
+        user_key(api_key),
+    )
+    return await notes_flights.do(
+        flight_key, lambda: _generate_notes(topic, variables, ocr_text=ocr_text, api_key=api_key)
+    )
+
+
+def _notes_payload(topic: str, variables: list, ocr_text: Optional[str] = None) -> Dict[str, Any]:
     # Context
     context = f"Topic: {topic}\nVars: {variables}"
     if ocr_text:
         context += f"\nOCR: {ocr_text[:1000]}"
 
-    system_prompt = """
-    Create DETAILED, STUDENT-FRIENDLY study notes in strict JSON format.
-    
-    Guidelines:
-    - **Explanation**: Write a clear, 3-4 sentence paragraph defining the concept simply. Use analogies if helpful.
-    - **Variable Breakdown**: Define each variable clearly with units.
-    - **Example**: Provide a concrete, step-by-step example problem with numbers.
-    - **Summary**: Key takeaways for quick revision.
-    
-    Output strictly as JSON:
-    {
-      "explanation": "Detailed explanation of the concept...",
-      "variable_breakdown": {"v": "velocity (m/s)", "t": "time (s)"},
-      "formulas": ["F = ma"],
-      "example": "If a car accelerates...",
-      "mistakes": ["Confusing speed with velocity"],
-      "practice_questions": ["What is the force if...?", "Calculate time when..."],
-      "summary": ["Force causes acceleration", "Mass is inertia"],
-      "resources": ["Newton's Laws Video"]
-    }
-    """
-    
-    user_prompt = f"Topic: {topic}. Context: {context}"
+    return NOTES_SYSTEM_PROMPT.payload(
+        {"temperature": 0.7, "maxOutputTokens": NOTES_MAX_TOKENS, "response_mime_type": "application/json"},
+        topic=topic,
+        context=context,
+    )
+
+
+def _normalize_section(key: str, value: Any) -> Any:
+    """Coerce the shapes Gemini sometimes returns into the NotesResponse field types."""
+    if key == "variable_breakdown" and isinstance(value, list):
+        return {f"var_{i}": v for i, v in enumerate(value)}
+    if key == "summary" and isinstance(value, str):
+        return [value]
+    return value
 
-    print(f"💎 Generating notes via Gemini ({GEMINI_MODEL})...")
 
-    raw_text = await run_in_threadpool(
-        _call_gemini_api_sync, 
-        user_prompt, 
-        system_prompt, 
-        8192,  # Increased from 1000 to prevent truncation
+def _normalize_sections(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: _normalize_section(k, v) for k, v in parsed.items()}
+
+
+def _parses_as_notes(raw_text: str) -> bool:
+    """Response cache check: only notes that parse are cached."""
+    return parse_model(raw_text, NotesResponse, prepare=_normalize_sections) is not None
+
+
+FAILED_NOTES_EXPLANATION = "Notes generation failed. Please try again."
+UNPARSEABLE_NOTES_EXPLANATION = "Error parsing notes."
+
+
+def is_fallback_notes(notes: NotesResponse) -> bool:
+    """True for the placeholder notes returned when generation or parsing failed."""
+    return notes.explanation in (FAILED_NOTES_EXPLANATION, UNPARSEABLE_NOTES_EXPLANATION)
+
+
+def _failed_notes() -> NotesResponse:
+    metrics.record_fallback("notes", "llm_error")
+    return NotesResponse(
+        explanation=FAILED_NOTES_EXPLANATION,
+        variable_breakdown={},
+        formulas=[],
+        example="Server error.",
+        mistakes=[],
+        practice_questions=[],
+        summary=["Could not generate notes."],
+        resources=[]
+    )
+
+
+def _unparseable_notes() -> NotesResponse:
+    metrics.record_parse_failure("notes")
+    metrics.record_fallback("notes", "unparseable")
+    return NotesResponse(
+        explanation=UNPARSEABLE_NOTES_EXPLANATION,
+        variable_breakdown={},
+        formulas=[],
+        example="",
+        mistakes=[],
+        practice_questions=[],
+        summary=["Invalid AI response."],
+        resources=[]
+    )
+
+
+async def _generate_notes(
+    topic: str,
+    variables: list,
+    ocr_text: Optional[str] = None,
+    api_key: str = None
+) -> NotesResponse:
+    logger.info("Generating notes via Gemini (%s)", GEMINI_MODEL, extra={"topic": topic})
+
+    raw_text = await _call_gemini_api(
+        _notes_payload(topic, variables, ocr_text),
         120, 
-        api_key if (api_key and api_key.startswith("AIza")) else None,
-        True # json_mode=True
+        user_key(api_key),
+        cache_ttl=NOTES_CACHE_TTL,
+        max_continuations=NOTES_MAX_CONTINUATIONS,
+        validate=_parses_as_notes,
     )
 
     if not raw_text:
-        print("⚠ Notes generation failed. Returning fallback.")
-        return NotesResponse(
-            explanation="Notes generation failed. Please try again.",
-            variable_breakdown={},
-            formulas=[],
-            example="Server error.",
-            mistakes=[],
-            practice_questions=[],
-            summary=["Could not generate notes."],
-            resources=[]
-        )
+        logger.warning("Notes generation failed. Returning fallback.", extra={"topic": topic})
+        return _failed_notes()
 
-    # Debug: Log raw response
-    print(f"💎 Raw Gemini response (first 500 chars): {raw_text[:500]}")
-    
+    log_payload(logger, "Raw Gemini notes response", raw_text, topic=topic)
+
+    # Ensure types match while validating (truncated output is closed off first)
+    notes = parse_model(raw_text, NotesResponse, prepare=_normalize_sections)
+    if notes:
+        return notes
+
+    logger.error("Notes response could not be parsed", extra={"topic": topic, "response_chars": len(raw_text)})
+    log_payload(logger, "Unparseable notes response", raw_text, topic=topic)
+    return _unparseable_notes()
+
+
+async def stream_notes(
+    topic: str,
+    variables: list,
+    ocr_text: Optional[str] = None,
+    api_key: str = None
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Generate notes with ``streamGenerateContent`` and yield events as they arrive.
+
+    Yields ``("section", {"name": ..., "value": ...})`` for every top-level
+    notes field as soon as its JSON value closes, then exactly one
+    ``("done", NotesResponse)``. Any failure ends the stream with the same
+    fallback notes ``generate_notes`` would return, so clients always receive
+    a complete document; a malformed stream is also reported with an
+    ``("error", {"detail": ...})`` event before the ``done``.
+    """
+    if not llm_available(api_key):
+        logger.warning("No Gemini API key configured.")
+        yield "done", _failed_notes()
+        return
+
+    payload = _notes_payload(topic, variables, ocr_text)
+    scanner = TopLevelObjectStream()
+    sections: Dict[str, Any] = {}
+    raw_parts = []
+
+    logger.info("Streaming notes via Gemini (%s)", GEMINI_MODEL, extra={"topic": topic})
     try:
-        parsed = clean_json_output(raw_text)
-        
-        # Debug: Log parsed result
-        print(f"💎 Parsed result type: {type(parsed)}, keys: {parsed.keys() if parsed else 'None'}")
-        
-        if parsed:
-            # Ensure types match before returning
-            if isinstance(parsed.get('variable_breakdown'), list):
-                 parsed['variable_breakdown'] = {f"var_{i}": v for i, v in enumerate(parsed['variable_breakdown'])}
-            if isinstance(parsed.get('summary'), str):
-                 parsed['summary'] = [parsed['summary']]
-                 
-            return NotesResponse(**parsed)
-        else:
-            print(f"❌ clean_json_output returned None for: {raw_text[:200]}")
-    except Exception as e:
-        print(f"❌ Notes parse error: {e}")
-        print(f"❌ Raw text that failed: {raw_text[:300]}")
+        async for delta in stream_generate_content(
+            payload,
+            api_key=user_key(api_key),
+            model=GEMINI_MODEL,
+            timeout=120,
+            call_site="notes_stream",
+            cache_ttl=NOTES_CACHE_TTL,
+            max_continuations=NOTES_MAX_CONTINUATIONS,
+            validate=_parses_as_notes,
+        ):
+            raw_parts.append(delta)
+            for name, value in scanner.feed(delta):
+                if name not in NotesResponse.model_fields:
+                    continue
+                value = _normalize_section(name, value)
+                sections[name] = value
+                yield "section", {"name": name, "value": value}
+    except LLMError as e:
+        logger.error("Gemini streaming error: %s", e, extra={"topic": topic})
+        yield "done", _failed_notes() if not sections else _complete_notes(sections, "".join(raw_parts))
+        return
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        # Malformed SSE chunk or JSON shape the scanner can't follow
+        logger.error("Malformed Gemini notes stream: %s", e, extra={"topic": topic})
+        yield "error", {"detail": "The notes stream was malformed."}
+        yield "done", _failed_notes() if not sections else _complete_notes(sections, "".join(raw_parts))
+        return
 
-    return NotesResponse(
-            explanation="Error parsing notes.",
-            variable_breakdown={},
-            formulas=[],
-            example="",
-            mistakes=[],
-            practice_questions=[],
-            summary=["Invalid AI response."],
-            resources=[]
-    )
+    yield "done", _complete_notes(sections, "".join(raw_parts))
+
+
+def _complete_notes(sections: Dict[str, Any], raw_text: str) -> NotesResponse:
+    """Assemble the final document from streamed sections, falling back to a full parse."""
+    try:
+        return NotesResponse(**sections)
+    except Exception:
+        pass
+    return parse_model(raw_text, NotesResponse, prepare=_normalize_sections) or _unparseable_notes()
 
 
 async def follow_up_notes(topic: str, previous_notes: dict, user_prompt: str, api_key: str = None) -> NotesResponse:
@@ -275,29 +317,25 @@ async def follow_up_notes(topic: str, previous_notes: dict, user_prompt: str, ap
     
     full_prompt = f"Q: {user_prompt}\nContext: {context}"
 
-    raw_text = await run_in_threadpool(
-        _call_gemini_api_sync, 
-        full_prompt, 
-        system_prompt, 
-        500, 
+    raw_text = await _call_gemini_api(
+        _build_payload(full_prompt, system_prompt, 500, json_mode=True),
         60, 
-        api_key if (api_key and api_key.startswith("AIza")) else None,
-        True # json_mode=True
+        user_key(api_key),
     )
 
     if not raw_text:
          return NotesResponse(explanation="AI busy.", variable_breakdown={}, formulas=[], example="", mistakes=[], practice_questions=[], summary=[], resources=[])
 
-    try:
-        parsed = clean_json_output(raw_text)
-        
-        if parsed:
-            if isinstance(parsed.get('variable_breakdown'), list):
-                 parsed['variable_breakdown'] = {}
-            if isinstance(parsed.get('summary'), str):
-                 parsed['summary'] = [parsed['summary']]
-            return NotesResponse(**parsed)
-    except Exception:
-        pass
+    notes = parse_model(raw_text, NotesResponse, prepare=_normalize_follow_up)
+    if notes:
+        return notes
         
     return NotesResponse(explanation="AI Error", variable_breakdown={}, formulas=[], example="", mistakes=[], practice_questions=[], summary=[], resources=[])
+
+
+def _normalize_follow_up(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    if isinstance(parsed.get('variable_breakdown'), list):
+         parsed['variable_breakdown'] = {}
+    if isinstance(parsed.get('summary'), str):
+         parsed['summary'] = [parsed['summary']]
+    return parsed
@@ -1,10 +1,31 @@
-import json
+import asyncio
 import re
-import requests
-import time
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+
 from pydantic import BaseModel
-from config import GEMINI_API_KEY, GEMINI_FALLBACK_API_KEY, GEMINI_MODEL
+from pymongo.errors import PyMongoError
+
+from config import GEMINI_MODEL, QUIZ_BANK_ENABLED, QUIZ_BATCH_CONCURRENCY
+from database.quiz_bank_model import count_questions, insert_questions, sample_questions
+from services import metrics
+from services.llm_gateway import LLMError, extract_text, generate_content, llm_available, user_key
+from services.prompt_registry import PromptTemplate, prompt_registry
+from services.quiz_bank import quiz_bank_refiller
+from services.retry_policy import RetryPolicy
+from services.single_flight import SingleFlight, normalize_text
+from utils.json_stream import extract_json
+from utils.log import get_logger, log_payload
+
+logger = get_logger("quiz")
+
+QUIZ_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=2.0, total_deadline=120)
+QUIZ_CACHE_TTL = 24 * 3600  # same topic + question count -> reuse for a day
+# Output budget per request: room for the JSON envelope plus each question
+QUIZ_BASE_TOKENS = 1024
+QUIZ_TOKENS_PER_QUESTION = 350
+QUIZ_MAX_TOKENS = 8192
+
+quiz_flights = SingleFlight("quiz")
 
 
 class QuizQuestionModel(BaseModel):
@@ -239,49 +260,9 @@ SAMPLE_QUIZZES = {
 }
 
 
-def clean_json_output(text: str):
-    """Extract JSON from LLM output, handling markdown and text wrapping."""
-    if not text:
-        return None
-        
-    text = text.strip()
-    
-    # 1. Try direct parse
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
-        
-    # 2. Try Regex for code blocks
-    match = re.search(r"```json\s*([\s\S]*?)\s*```", text)
-    if match:
-        try:
-             return json.loads(match.group(1))
-        except json.JSONDecodeError:
-            pass
-
-    # 3. Try finding first { and last }
-    match = re.search(r'(\{[\s\S]*\})', text)
-    if match:
-        try:
-            return json.loads(match.group(1))
-        except json.JSONDecodeError:
-            pass
-            
-    # 4. Try finding first [ and last ]
-    match = re.search(r'(\[[\s\S]*\])', text)
-    if match:
-        try:
-            return json.loads(match.group(1))
-        except json.JSONDecodeError:
-            pass
-    
-    print(f"⚠ Failed to parse JSON from: {text[:300]}...")
-    return None
-
-
-def get_fallback_quiz(topic: str, num_questions: int = 5) -> dict:
+def get_fallback_quiz(topic: str, num_questions: int = 5, reason: str = "llm_error") -> dict:
     """Return a sample quiz for common topics when API fails."""
+    metrics.record_fallback("quiz", reason)
     # Try exact match first
     if topic in SAMPLE_QUIZZES:
         return _prepare_fallback(SAMPLE_QUIZZES[topic], num_questions)
@@ -307,16 +288,16 @@ def get_fallback_quiz(topic: str, num_questions: int = 5) -> dict:
     for key, val in mappings.items():
         if key in topic_lower:
              if val in SAMPLE_QUIZZES:
-                 print(f"📋 Mapped fallback: {topic} -> {val}")
+                 logger.info("Mapped fallback: %s -> %s", topic, val)
                  return _prepare_fallback(SAMPLE_QUIZZES[val], num_questions)
 
     for key, quiz in SAMPLE_QUIZZES.items():
         if key.lower() in topic_lower or topic_lower in key.lower():
-            print(f"📋 Matched fallback: {key}")
+            logger.info("Matched fallback: %s", key)
             return _prepare_fallback(quiz, num_questions)
             
     # Default to General
-    print(f"📋 Using General fallback for {topic}")
+    logger.info("Using General fallback for %s", topic)
     return _prepare_fallback(SAMPLE_QUIZZES["General"], num_questions)
 
 def _prepare_fallback(quiz_data, num):
@@ -326,34 +307,51 @@ def _prepare_fallback(quiz_data, num):
     return result
 
 
-ADVANCED_QUIZ_PROMPT = """You are an expert AI tutor and examiner.
-Generate high-quality MCQs for the topic: {topic}
+ADVANCED_QUIZ_PROMPT = prompt_registry.register(PromptTemplate(
+    name="quiz",
+    version=2,
+    prefix="""You are an expert AI tutor and examiner.
+Generate high-quality MCQs for the topic given in the message.
 
 Requirements:
-- Create EXACTLY {num_questions} questions
+- Create EXACTLY the number of questions requested
 - Mix conceptual and numerical questions
 - Include 4 options per question (A, B, C, D)
 - One correct answer with correct_index (0-3)
 - Brief explanation for each
 
 OUTPUT ONLY VALID JSON (no markdown):
-{{
-  "topic": "{topic}",
+{
+  "topic": "<the topic>",
   "questions": [
-    {{
+    {
       "question": "Question text here",
       "options": ["Option A", "Option B", "Option C", "Option D"],
       "correct_index": 0,
       "explanation": "Brief explanation",
       "takeaway": "One-line key insight"
-    }}
+    }
   ]
-}}"""
+}""",
+    suffix="Topic: {topic}\nNumber of questions: {num_questions}{difficulty}",
+))
+
+
+DIFFICULTIES = ("mixed", "easy", "medium", "hard")
 
 
-async def generate_quiz_with_ai(topic: str, num_questions: int = 5, api_key: str = None) -> dict:
+def canonical_topic(topic: str) -> str:
+    """Bank key for a topic: "Newton's  Laws!" and "newtons laws" share a shelf."""
+    cleaned = re.sub(r"[^a-z0-9 ]+", "", normalize_text(topic).replace("'", ""))
+    return " ".join(cleaned.split())
+
+
+async def generate_quiz_with_ai(topic: str, num_questions: int = 5, api_key: str = None, difficulty: str = "mixed") -> dict:
     """
     AI generates MCQs using Google Gemini with retry logic and fallback support.
+
+    Questions are sampled from the Mongo quiz bank when it holds enough for the
+    topic; otherwise they are generated live (and banked for next time).
     """
     
     if not topic or len(topic.strip()) < 2:
@@ -361,131 +359,207 @@ async def generate_quiz_with_ai(topic: str, num_questions: int = 5, api_key: str
     
     if num_questions < 1 or num_questions > 20:
         num_questions = 5
-    
-    # Use provided key or fall back to config
-    gemini_key = api_key if (api_key and api_key.startswith("AIza")) else GEMINI_API_KEY
-    fallback_key = GEMINI_FALLBACK_API_KEY if (GEMINI_FALLBACK_API_KEY and GEMINI_FALLBACK_API_KEY.startswith("AIza")) else None
-
-    if not gemini_key:
-        if fallback_key:
-            print("⚠ No primary Gemini API key. Using fallback key from environment.")
-            gemini_key = fallback_key
+    if difficulty not in DIFFICULTIES:
+        difficulty = "mixed"
+
+    banked = await _serve_from_bank(topic, num_questions, difficulty)
+    if banked:
+        return banked
+
+    # Concurrent requests for the same topic/size share one upstream generation
+    flight_key = (normalize_text(topic), num_questions, difficulty, user_key(api_key))
+    return await quiz_flights.do(flight_key, lambda: _generate_quiz(topic, num_questions, api_key, difficulty))
+
+
+async def generate_quiz_batch(
+    items: List[Tuple[str, int]],
+    api_key: str = None,
+    difficulty: str = "mixed",
+    concurrency: int = QUIZ_BATCH_CONCURRENCY,
+) -> Dict[str, dict]:
+    """
+    Generate quizzes for several (topic, count) pairs at once, keyed by topic.
+
+    Each topic goes through ``generate_quiz_with_ai`` (bank, cache, validation
+    and fallback included); at most ``concurrency`` run at the same time, so a
+    revision pack costs roughly one round trip per ``concurrency`` topics.
+    Repeated topics are generated once with the largest requested count.
+    """
+    wanted: Dict[str, Tuple[str, int]] = {}
+    for topic, count in items:
+        key = canonical_topic(topic)
+        if key in wanted:
+            first, previous = wanted[key]
+            wanted[key] = (first, max(previous, count))
         else:
-            print("⚠ No Gemini API key configured.")
-            return get_fallback_quiz(topic, num_questions)
-    
-    full_prompt = ADVANCED_QUIZ_PROMPT.format(topic=topic.strip(), num_questions=num_questions)
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={gemini_key}"
-    
-    payload = {
-        "contents": [{
-            "parts": [{"text": full_prompt}]
-        }],
-        "generationConfig": {
-            "temperature": 0.5,
-            "maxOutputTokens": 4000,
+            wanted[key] = (topic, count)
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(topic: str, count: int) -> dict:
+        async with semaphore:
+            try:
+                return await generate_quiz_with_ai(topic, count, api_key=api_key, difficulty=difficulty)
+            except Exception as e:
+                logger.error("Batch quiz failed for %s: %s", topic, e)
+                return get_fallback_quiz(topic, count, reason="batch_error")
+
+    pairs = list(wanted.values())
+    results = await asyncio.gather(*(one(topic, count) for topic, count in pairs))
+    return {topic: quiz for (topic, _), quiz in zip(pairs, results)}
+
+
+async def _serve_from_bank(topic: str, num_questions: int, difficulty: str) -> Optional[dict]:
+    if not QUIZ_BANK_ENABLED:
+        return None
+    topic_key = canonical_topic(topic)
+    quiz_bank_refiller.record_demand(topic_key, topic.strip(), difficulty)
+    try:
+        stock = await count_questions(topic_key, difficulty)
+        if not quiz_bank_refiller.can_serve(stock, num_questions):
+            # Generate live; the refiller tops the topic up in the background
+            quiz_bank_refiller.nudge()
+            return None
+        questions = await sample_questions(topic_key, difficulty, num_questions)
+    except PyMongoError as e:
+        logger.warning("Quiz bank unavailable: %s", e)
+        return None
+
+    if len(questions) < num_questions:
+        quiz_bank_refiller.nudge()
+        return None
+    logger.info("Quiz: %s (%d questions) served from bank", topic, num_questions, extra={"topic": topic, "source": "bank"})
+    return {"topic": topic.strip(), "difficulty": difficulty, "questions": questions}
+
+
+async def _generate_quiz(topic: str, num_questions: int, api_key: Optional[str], difficulty: str = "mixed") -> dict:
+    # Use provided key or fall back to the configured key pool
+    if not llm_available(api_key):
+        logger.warning("No Gemini API key configured.")
+        return get_fallback_quiz(topic, num_questions, reason="no_key")
+
+    logger.info("Quiz: %s (%d questions) via Gemini", topic, num_questions, extra={"topic": topic, "source": "gemini"})
+    try:
+        quiz = await _request_questions(topic, num_questions, difficulty, api_key=api_key)
+    except LLMError as e:
+        logger.error("Quiz generation failed: %s. Using fallback quiz", e, extra={"topic": topic})
+        return get_fallback_quiz(topic, num_questions)
+
+    if quiz:
+        logger.debug("Generated %d questions via Gemini", len(quiz["questions"]))
+        if QUIZ_BANK_ENABLED:
+            try:
+                await insert_questions(canonical_topic(topic), topic.strip(), difficulty, quiz["questions"])
+            except PyMongoError as e:
+                logger.warning("Quiz bank save failed: %s", e)
+        return quiz
+
+    # Unusable output, serve the fallback
+    return get_fallback_quiz(topic, num_questions, reason="unparseable")
+
+
+async def generate_question_batch(topic: str, num_questions: int, difficulty: str = "mixed") -> List[dict]:
+    """
+    Fresh questions for the quiz bank (pool keys only, no response cache, higher
+    temperature so repeated batches don't just repeat themselves).
+    """
+    if not llm_available():
+        return []
+    try:
+        quiz = await _request_questions(
+            topic, num_questions, difficulty, temperature=0.9, cache_ttl=None, call_site="quiz_bank"
+        )
+    except LLMError as e:
+        logger.error("Quiz bank batch failed for %s: %s", topic, e)
+        return []
+    return quiz["questions"] if quiz else []
+
+
+def quiz_token_budget(num_questions: int) -> int:
+    return min(QUIZ_MAX_TOKENS, QUIZ_BASE_TOKENS + QUIZ_TOKENS_PER_QUESTION * num_questions)
+
+
+async def _request_questions(
+    topic: str,
+    num_questions: int,
+    difficulty: str = "mixed",
+    api_key: Optional[str] = None,
+    temperature: float = 0.5,
+    cache_ttl: Optional[float] = QUIZ_CACHE_TTL,
+    call_site: str = "quiz",
+) -> Optional[dict]:
+    """One Gemini call for ``num_questions`` MCQs; None if the output is unusable."""
+    payload = ADVANCED_QUIZ_PROMPT.payload(
+        {
+            "temperature": temperature,
+            "maxOutputTokens": quiz_token_budget(num_questions),
             "response_mime_type": "application/json"
-        }
-    }
+        },
+        topic=topic.strip(),
+        num_questions=num_questions,
+        difficulty="" if difficulty == "mixed" else f"\nAll questions must be {difficulty} difficulty.",
+    )
 
-    # Retry logic with exponential backoff & key fallback
-    current_key = gemini_key
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={current_key}"
+    data = await generate_content(
+        payload,
+        api_key=api_key,
+        model=GEMINI_MODEL,
+        timeout=60,
+        policy=QUIZ_RETRY_POLICY,
+        call_site=call_site,
+        cache_ttl=cache_ttl,
+        max_continuations=1,
+        # Only cache output that yields a usable quiz
+        validate=lambda text: validate_quiz_payload(extract_json(text), topic, difficulty) is not None,
+    )
 
-    max_retries = 2
-    for attempt in range(max_retries + 1):
-        try:
-            print(f"🎯 Quiz attempt {attempt+1}/{max_retries+1}: {topic} ({num_questions} questions) via Gemini")
-            
-            response = requests.post(url, json=payload, headers={"Content-Type": "application/json"}, timeout=60)
-            
-            # Handle Bad Key (400) or Permission (403) or Auth (401)
-            if response.status_code in [400, 401, 403]:
-                if fallback_key and current_key != fallback_key:
-                     print(f"⚠ Gemini key error ({response.status_code}). Switching to fallback key from environment...")
-                     current_key = fallback_key
-                     url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={current_key}"
-                     continue # Immediate retry with new key
-                else:
-                     print(f"❌ Available Gemini key failed ({response.status_code}) and no alternate fallback key is configured.")
-                     break # Stop retrying
-
-            # Handle rate limiting with retry AND Key Switch
-            if response.status_code == 429:
-                print("⏳ Rate limited (429).")
-                if fallback_key and current_key != fallback_key:
-                    print("🔄 Switching to fallback key from environment for rate limit handling...")
-                    current_key = fallback_key
-                    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={current_key}"
-                    continue # Immediate retry with new key
-
-                if attempt < max_retries:
-                    wait_time = (2 ** attempt) * 2  # 2s, 4s
-                    print(f"⏳ Waiting {wait_time}s before retry...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print("❌ Rate limit persists. Using fallback quiz...")
-                    return get_fallback_quiz(topic, num_questions)
-            
-            response.raise_for_status()
-            data = response.json()
-            
-            if 'candidates' not in data or len(data['candidates']) == 0:
-                continue
-                
-            raw_text = data['candidates'][0]['content']['parts'][0]['text']
-            print(f"💎 Gemini Quiz Response received ({len(raw_text)} chars)")
-            parsed = clean_json_output(raw_text)
-            
-            if not parsed:
-                continue
-            
-            # Validate and clean questions
-            if "questions" not in parsed:
-                if isinstance(parsed, list):
-                    parsed = {"topic": topic, "questions": parsed}
-                else:
-                    continue
-            
-            if not isinstance(parsed.get("questions"), list) or len(parsed["questions"]) == 0:
-                continue
-                
-            # Validate each question
-            validated = []
-            for q in parsed["questions"]:
-                if not isinstance(q, dict):
-                    continue
-                question_text = q.get("question", "")
-                options = q.get("options", [])
-                if not question_text or len(options) < 2:
-                    continue
-                while len(options) < 4:
-                    options.append(f"Option {len(options)+1}")
-                correct = q.get("correct_index", 0)
-                if not isinstance(correct, int) or correct < 0 or correct > 3:
-                    correct = 0
-                validated.append({
-                    "question": str(question_text),
-                    "options": [str(o) for o in options[:4]],
-                    "correct_index": correct,
-                    "explanation": str(q.get("explanation", "")),
-                    "takeaway": str(q.get("takeaway", ""))
-                })
-            
-            if len(validated) > 0:
-                print(f"✅ Generated {len(validated)} questions via Gemini")
-                return {"topic": topic, "difficulty": "mixed", "questions": validated}
-
-        except requests.exceptions.Timeout:
-            print(f"⏱ Timeout on attempt {attempt+1}")
-            if attempt == max_retries:
-                return get_fallback_quiz(topic, num_questions)
-        except Exception as e:
-            print(f"❌ Error attempt {attempt+1}: {e}")
-            if attempt == max_retries:
-                return get_fallback_quiz(topic, num_questions)
-    
-    # All retries failed, try fallback
-    return get_fallback_quiz(topic, num_questions)
+    raw_text = extract_text(data)
+    if not raw_text:
+        return None
+
+    log_payload(logger, "Raw Gemini quiz response", raw_text, topic=topic, call_site=call_site)
+    quiz = validate_quiz_payload(extract_json(raw_text), topic, difficulty)
+    if quiz is None:
+        metrics.record_parse_failure(call_site)
+    return quiz
+
+
+def validate_quiz_payload(parsed, topic: str, difficulty: str = "mixed") -> Optional[dict]:
+    """Normalise parsed model output into the quiz response shape, or None if unusable."""
+    if not parsed:
+        return None
+
+    if isinstance(parsed, list):
+        parsed = {"topic": topic, "questions": parsed}
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("questions"), list):
+        return None
+
+    validated = []
+    for q in parsed["questions"]:
+        if not isinstance(q, dict):
+            continue
+        question_text = q.get("question", "")
+        options = q.get("options", [])
+        if not question_text or not isinstance(options, list) or len(options) < 2:
+            continue
+        while len(options) < 4:
+            options.append(f"Option {len(options)+1}")
+        correct = q.get("correct_index", 0)
+        if not isinstance(correct, int) or correct < 0 or correct > 3:
+            correct = 0
+        validated.append(QuizQuestionModel(
+            question=str(question_text),
+            options=[str(o) for o in options[:4]],
+            correct_index=correct,
+            explanation=str(q.get("explanation", "")),
+            takeaway=str(q.get("takeaway", ""))
+        ))
+
+    if not validated:
+        return None
+    result = QuizGenerationResult(topic=topic, questions=validated)
+    return {
+        "topic": result.topic,
+        "difficulty": difficulty,
+        "questions": [q.model_dump(exclude={"misconceptions"}) for q in result.questions],
+    }
@@ -1,45 +1,33 @@
-import json
-import re
-import requests
 import time
+
+import requests
 from typing import Dict, Any, Optional
-from config import GEMINI_API_KEY, GEMINI_MODEL, AIML_API_KEY
+from config import GEMINI_MODEL, AIML_API_KEY, AIML_BASE_URL
 from pydantic import BaseModel, Field
 
+from services import metrics
+from services.circuit_breaker import AIML_IMAGE, get_breaker
+from services.llm_gateway import extract_text, generate_content, llm_available
+from services.retry_policy import RetryPolicy
+from utils.json_stream import extract_json
+from utils.log import get_logger
+
+logger = get_logger("visualiser")
+
+PARAMS_RETRY_POLICY = RetryPolicy(max_attempts=3, total_deadline=75)
+
 
 class ParameterUpdate(BaseModel):
     updated_parameters: Dict[str, Any] = Field(description="Dictionary of updated parameter values. Empty if no changes needed.")
     ai_response: str = Field(description="Response to the user.")
 
 
-def clean_json_output(text: str):
-    text = text.strip()
-    text = re.sub(r"```json", "", text)
-    text = re.sub(r"```", "", text)
-    text = text.strip()
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
-    
-    # Try to find JSON object
-    match = re.search(r'\{[\s\S]*\}', text)
-    if match:
-        try:
-            return json.loads(match.group())
-        except json.JSONDecodeError:
-            pass
-    return None
-
-
 async def adjust_parameters_with_ai(template_id: str, current_params: Dict[str, Any], user_prompt: str, api_key: str = None) -> Dict[str, Any]:
     """
     Uses Google Gemini to interpret user prompt and update visualiser parameters.
     """
-    # Use provided key or fall back to config
-    gemini_key = api_key if (api_key and api_key.startswith("AIza")) else GEMINI_API_KEY
-    
-    if not gemini_key:
+    # Use provided key or fall back to the configured key pool
+    if not llm_available(api_key):
         return {"updated_parameters": {}, "ai_response": "AI not configured."}
     
     system_prompt = f"""
@@ -60,8 +48,6 @@ async def adjust_parameters_with_ai(template_id: str, current_params: Dict[str,
     }}
     """
     
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={gemini_key}"
-    
     payload = {
         "contents": [{
             "parts": [{"text": system_prompt}]
@@ -73,43 +59,26 @@ async def adjust_parameters_with_ai(template_id: str, current_params: Dict[str,
         }
     }
     
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            print(f"💎 Adjusting parameters via Gemini for: {template_id}")
-            response = requests.post(url, json=payload, headers={"Content-Type": "application/json"}, timeout=60)
-            
-            # Handle rate limiting with retry
-            if response.status_code == 429:
-                wait_time = (2 ** attempt) + 1
-                print(f"⏳ Rate limited (429). Waiting {wait_time}s (attempt {attempt+1}/{max_retries})")
-                time.sleep(wait_time)
-                continue
-            
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if 'candidates' in data and len(data['candidates']) > 0:
-                raw_text = data['candidates'][0]['content']['parts'][0]['text']
-                parsed = clean_json_output(raw_text)
-                
-                if parsed:
-                    return {
-                        "updated_parameters": parsed.get("updated_parameters", {}),
-                        "ai_response": parsed.get("ai_response", "")
-                    }
-            
-        except requests.exceptions.HTTPError as e:
-            if hasattr(e, 'response') and e.response is not None and e.response.status_code == 429:
-                if attempt < max_retries - 1:
-                    wait_time = (2 ** attempt) + 1
-                    print(f"⏳ Rate limited (429). Waiting {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
-            print(f"❌ Visualiser Params Error: {e}")
-        except Exception as e:
-            print(f"❌ Visualiser Params Error: {e}")
+    logger.info("Adjusting parameters via Gemini for: %s", template_id, extra={"template_id": template_id})
+    try:
+        data = await generate_content(
+            payload,
+            api_key=api_key,
+            model=GEMINI_MODEL,
+            timeout=60,
+            policy=PARAMS_RETRY_POLICY,
+            call_site="visualiser_params",
+        )
+        raw_text = extract_text(data)
+        parsed = extract_json(raw_text, opening="{")
+        if parsed:
+            return {
+                "updated_parameters": parsed.get("updated_parameters", {}),
+                "ai_response": parsed.get("ai_response", "")
+            }
+        metrics.record_parse_failure("visualiser_params")
+    except Exception as e:
+        logger.error("Visualiser params error: %s", e, extra={"template_id": template_id})
 
     return {"updated_parameters": {}, "ai_response": "AI Error."}
 
@@ -120,10 +89,15 @@ def generate_visualiser_image(prompt: str) -> Optional[str]:
     Returns the Image URL.
     """
     if not AIML_API_KEY:
-        print("❌ AIML_API_KEY missing.")
+        logger.error("AIML_API_KEY missing.")
+        return None
+
+    breaker = get_breaker(AIML_IMAGE)
+    if not breaker.allow():
+        logger.info("AIML image circuit open, skipping image generation")
         return None
 
-    url = "https://api.aimlapi.com/v1/images/generations/"
+    url = f"{AIML_BASE_URL}/images/generations/"
     
     payload = {
       "model": "flux/schnell",
@@ -137,9 +111,12 @@ def generate_visualiser_image(prompt: str) -> Optional[str]:
       "content-type": "application/json"
     }
 
+    started = time.perf_counter()
     try:
-        print(f"DEBUG: Generating image via AIML API for prompt: {prompt[:30]}...")
+        logger.debug("Generating image via AIML API", extra={"prompt_chars": len(prompt)})
         response = requests.post(url, json=payload, headers=headers, timeout=30)
+        metrics.observe_llm("visualiser_image", payload["model"], "aiml", response.status_code, time.perf_counter() - started)
+        breaker.record(response.status_code)
         response.raise_for_status()
         res_json = response.json()
         
@@ -148,6 +125,12 @@ def generate_visualiser_image(prompt: str) -> Optional[str]:
              
         return None
 
+    except requests.RequestException as e:
+        if e.response is None:
+            breaker.record_failure()  # timeout / connection error
+            metrics.observe_llm("visualiser_image", payload["model"], "aiml", None, time.perf_counter() - started)
+        logger.error("Image generation error: %s", e)
+        return None
     except Exception as e:
-        print(f"❌ Image Gen Error: {e}")
+        logger.exception("Image generation error: %s", e)
         return None
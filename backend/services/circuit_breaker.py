@@ -0,0 +1,170 @@
+"""
+Circuit breakers for the upstream AI providers.
+
+One breaker per upstream (Gemini text, Gemini vision, AIML image). After
+``failure_threshold`` consecutive failed calls the breaker opens and calls are
+rejected immediately (the gateway raises ``CircuitOpenError``), so features
+drop straight to their local fallbacks (keyword topic detection, sample
+quizzes, fallback notes) instead of each request sitting through retries and
+timeouts. Once
+``open_seconds`` have passed the breaker goes half-open and lets a limited
+number of probe calls through: a successful probe closes it, a failed one
+opens it again.
+
+Only upstream-health failures count (timeouts, transport errors, 5xx and
+rate limits that survived key failover); a 4xx for a bad request does not.
+"""
+
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from config import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_HALF_OPEN_PROBES,
+    CIRCUIT_OPEN_SECONDS,
+)
+from utils.log import get_logger
+
+logger = get_logger("llm")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+GEMINI_TEXT = "gemini_text"
+GEMINI_VISION = "gemini_vision"
+AIML_IMAGE = "aiml_image"
+
+
+def counts_as_failure(status_code: Optional[int]) -> bool:
+    """Upstream-health failure: no response at all, a 5xx, or a 429 that outlasted key failover."""
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = CLOSED
+        self.counters: Counter = Counter()
+        self._failures = 0
+        self._opened_at = 0.0
+        # Start times of probes still in flight while half-open. A probe whose
+        # caller never reported back (e.g. a client disconnected mid-stream)
+        # stops holding its slot after ``open_seconds``.
+        self._probes: Dict[int, float] = {}
+        self._probe_seq = 0
+        self._lock = threading.Lock()  # the image breaker is used from worker threads
+
+    def allow(self) -> bool:
+        """True if a call may go upstream now. Every allowed call must report success or failure."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    self.counters["rejected"] += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probes = {}
+                logger.info(
+                    "Circuit %s half-open: probing upstream",
+                    self.name,
+                    extra={"circuit": self.name},
+                )
+
+            for probe, started in list(self._probes.items()):
+                if now - started >= self.open_seconds:
+                    del self._probes[probe]
+            if len(self._probes) >= self.half_open_probes:
+                self.counters["rejected"] += 1
+                return False
+            self._probe_seq += 1
+            self._probes[self._probe_seq] = now
+            self.counters["probes"] += 1
+            return True
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected (checking does not use up a probe)."""
+        return (
+            self.state == OPEN
+            and time.monotonic() - self._opened_at < self.open_seconds
+        )
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self._probes = {}
+                logger.info(
+                    "Circuit %s closed: upstream recovered",
+                    self.name,
+                    extra={"circuit": self.name},
+                )
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self.counters["failures"] += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._open()
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes = {}
+        self.counters["opened"] += 1
+        logger.warning(
+            "Circuit %s OPEN after %d failures; serving fallbacks for %.0fs",
+            self.name,
+            self._failures,
+            self.open_seconds,
+            extra={"circuit": self.name, "failures": self._failures},
+        )
+
+    def record(self, status_code: Optional[int]) -> None:
+        """Report a finished call by its final HTTP status (None = no response)."""
+        if counts_as_failure(status_code):
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            **self.counters,
+        }
+
+
+breakers: Dict[str, CircuitBreaker] = {
+    name: CircuitBreaker(
+        name,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        open_seconds=CIRCUIT_OPEN_SECONDS,
+        half_open_probes=CIRCUIT_HALF_OPEN_PROBES,
+    )
+    for name in (GEMINI_TEXT, GEMINI_VISION, AIML_IMAGE)
+}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    return breakers[name]
+
+
+def is_open(name: str) -> bool:
+    return breakers[name].is_open()
@@ -0,0 +1,79 @@
+"""
+Request-scoped deadlines.
+
+A handler opens ``request_deadline(seconds)`` and everything it awaits (the
+LLM gateway, retry waits, key failover, topic detection) sees the same
+absolute deadline through a context variable, so nested calls share one
+budget instead of each applying its own timeout on top of the others. Tasks
+created inside the scope inherit it; a shared task that should finish a little
+after its caller gives up opens ``extend_deadline(seconds)``.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Absolute time.monotonic() deadline; None = no deadline
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def request_deadline(seconds: Optional[float]) -> Iterator[None]:
+    """Bound the enclosed work to ``seconds`` from now (an outer, earlier deadline still wins)."""
+    if not seconds or seconds <= 0:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def extend_deadline(seconds: float) -> Iterator[None]:
+    """Move the current deadline ``seconds`` later for the enclosed work (no-op without one)."""
+    current = _deadline.get()
+    if current is None:
+        yield
+        return
+    token = _deadline.set(current + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline (may be negative), or None if unbounded."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired(margin: float = 0.0) -> bool:
+    """True if less than ``margin`` seconds of the current deadline are left."""
+    left = remaining()
+    return left is not None and left <= margin
+
+
+def cap_timeout(timeout: float) -> float:
+    """``timeout`` shortened to what is left of the deadline (never below 0.1s)."""
+    left = remaining()
+    return timeout if left is None else max(0.1, min(timeout, left))
+
+
+async def within_deadline(aw: Awaitable[T], default: T) -> T:
+    """Await ``aw``, or give up and return ``default`` once the deadline passes."""
+    left = remaining()
+    if left is None:
+        return await aw
+    try:
+        return await asyncio.wait_for(aw, max(0.0, left))
+    except asyncio.TimeoutError:
+        return default
@@ -0,0 +1,83 @@
+"""
+Topic detections cached by scan content hash.
+
+Uploads are stored by the SHA-256 of their bytes (``services/storage.py``), so
+a re-uploaded worksheet photo has the same hash as before. The (topic,
+variables) detected for it the first time are kept here and returned straight
+away on later uploads, skipping the Gemini text/vision calls.
+
+Results live in a size-bounded in-memory LRU and, when MongoDB is configured,
+in the ``scan_detections`` collection, so they are shared between workers and
+survive restarts. Only answers the model actually gave are cached; keyword
+fallbacks (no key, deadline, upstream errors) are not, so a degraded result
+is never pinned to an image.
+"""
+
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import PyMongoError
+
+from config import DETECTION_CACHE_MAX_ENTRIES
+from database.scan_detection_model import get_detection, save_detection
+from services import metrics
+from utils.log import get_logger
+
+logger = get_logger("detect")
+
+Detection = Tuple[str, List[str]]
+
+
+class DetectionCache:
+    def __init__(self, max_entries: int = DETECTION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, Detection]" = OrderedDict()
+        self.counters: Counter = Counter()
+
+    def _remember(self, image_sha256: str, detection: Detection) -> None:
+        self._memory[image_sha256] = detection
+        self._memory.move_to_end(image_sha256)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def get(self, image_sha256: str) -> Optional[Detection]:
+        detection = self._memory.get(image_sha256)
+        if detection is not None:
+            self._memory.move_to_end(image_sha256)
+            self.counters["memory_hit"] += 1
+            metrics.LLM_CACHE_LOOKUPS.labels("scan_detection", "memory_hit").inc()
+            return detection[0], list(detection[1])
+
+        try:
+            doc = await get_detection(image_sha256)
+        except PyMongoError as e:
+            logger.warning("Detection cache lookup failed: %s", e)
+            doc = None
+        if doc is not None:
+            detection = (doc["topic"], [str(v) for v in doc.get("variables") or []])
+            self._remember(image_sha256, detection)
+            self.counters["db_hit"] += 1
+            metrics.LLM_CACHE_LOOKUPS.labels("scan_detection", "db_hit").inc()
+            return detection[0], list(detection[1])
+
+        self.counters["miss"] += 1
+        metrics.LLM_CACHE_LOOKUPS.labels("scan_detection", "miss").inc()
+        return None
+
+    async def set(self, image_sha256: str, topic: str, variables: List[str]) -> None:
+        self._remember(image_sha256, (topic, list(variables)))
+        try:
+            await save_detection(image_sha256, topic, list(variables))
+        except PyMongoError as e:
+            logger.warning("Detection cache write failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            **self.counters,
+        }
+
+
+detection_cache = DetectionCache()
@@ -0,0 +1,260 @@
+"""
+Durable background jobs for long-running AI generations.
+
+Jobs are stored in MongoDB (``database/jobs_model.py``) and processed by
+``JobWorker``s that lease one job at a time. A worker keeps renewing its lease
+while the handler runs; if the process dies the lease lapses and another
+worker picks the job up again, so nothing is lost when an API node restarts.
+
+Workers run inside the API process (``JOB_WORKER_CONCURRENCY``) and/or as
+separate processes via ``python worker.py``.
+"""
+
+import asyncio
+import random
+import socket
+import time
+import uuid
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import JOB_LEASE_SECONDS, JOB_POLL_INTERVAL, JOB_RESULT_TTL
+from database.jobs_model import (
+    claim_job,
+    complete_job,
+    fail_abandoned_jobs,
+    fail_job,
+    renew_lease,
+)
+from database.notes_model import save_notes_entry
+from services.ai_notes import generate_notes, is_fallback_notes
+from services.ai_quiz import generate_quiz_with_ai
+from services.ai_visualiser import generate_visualiser_image
+from utils.log import get_logger
+
+logger = get_logger("jobs")
+
+JobHandler = Callable[[Dict[str, Any], str], Awaitable[Any]]
+
+
+class JobError(Exception):
+    """Raised by a handler when the job should be retried (or fail if out of attempts)."""
+
+
+async def _run_notes_job(params: Dict[str, Any], user_id: str) -> dict:
+    notes = await generate_notes(
+        params["topic"],
+        params.get("variables") or [],
+        params.get("image_path"),
+        ocr_text=params.get("ocr_text"),
+    )
+    # generate_notes returns placeholder notes instead of raising; retry those
+    if is_fallback_notes(notes):
+        raise JobError(f"Notes generation failed: {notes.explanation}")
+    try:
+        await save_notes_entry(
+            user_id=user_id,
+            topic=params["topic"],
+            notes_payload=notes.dict(),
+            image_path=params.get("image_path"),
+        )
+    except Exception as db_err:
+        logger.warning("Notes save failed: %s", db_err, extra={"user_id": user_id})
+    return {"notes": notes.dict()}
+
+
+async def _run_quiz_job(params: Dict[str, Any], user_id: str) -> dict:
+    quiz = await generate_quiz_with_ai(
+        params["topic"],
+        params.get("count", 5),
+        difficulty=params.get("difficulty", "mixed"),
+    )
+    # generate_quiz_with_ai serves a sample quiz instead of raising; retry that
+    if quiz.get("error"):
+        raise JobError(quiz["error"])
+    if quiz.get("_fallback"):
+        raise JobError("Quiz generation failed (fallback quiz)")
+    return quiz
+
+
+async def _run_image_job(params: Dict[str, Any], user_id: str) -> dict:
+    image_url = await asyncio.to_thread(generate_visualiser_image, params["prompt"])
+    if not image_url:
+        raise JobError("Failed to generate image")
+    return {"image_url": image_url}
+
+
+JOB_HANDLERS: Dict[str, JobHandler] = {
+    "notes": _run_notes_job,
+    "quiz": _run_quiz_job,
+    "image": _run_image_job,
+}
+
+
+class JobWorker:
+    def __init__(
+        self,
+        concurrency: int = 2,
+        kinds: Optional[List[str]] = None,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 1.0,
+        worker_id: Optional[str] = None,
+    ):
+        unknown = set(kinds or ()) - set(JOB_HANDLERS)
+        if unknown:
+            raise ValueError(f"Unknown job kinds: {', '.join(sorted(unknown))}")
+        if kinds is not None and not kinds:
+            raise ValueError(
+                "A job worker needs at least one job kind (None = all kinds)"
+            )
+        self.concurrency = concurrency
+        self.kinds = list(JOB_HANDLERS) if kinds is None else list(kinds)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{uuid.uuid4().hex[:8]}"
+        self.counters: Counter = Counter()
+        self._tasks: List["asyncio.Task[None]"] = []
+        self._next_sweep = 0.0
+
+    def start(self) -> None:
+        """Start ``concurrency`` polling loops on the running event loop."""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._loop()) for _ in range(self.concurrency)
+        ]
+        logger.info(
+            "Job worker %s started (%d slots: %s)",
+            self.worker_id,
+            self.concurrency,
+            ", ".join(self.kinds),
+        )
+
+    async def stop(self) -> None:
+        """Cancel the loops. Jobs still running are picked up again once their lease lapses."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run_forever(self) -> None:
+        self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                job = await claim_job(self.worker_id, self.kinds, self.lease_seconds)
+            except Exception as e:
+                logger.warning("Job claim failed: %s", e)
+                job = None
+            if job is None:
+                await self._sweep_abandoned()
+                # Jitter so idle workers don't poll Mongo in lockstep
+                await asyncio.sleep(self.poll_interval * random.uniform(0.5, 1.5))
+                continue
+            try:
+                await self._execute(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. Mongo down while recording the outcome: the lease lapses and
+                # the job is picked up again; this slot keeps polling
+                self.counters["errors"] += 1
+                logger.exception("Job %s: worker error: %s", job.get("_id"), e)
+
+    async def _sweep_abandoned(self) -> None:
+        """Fail jobs whose lease lapsed on their final attempt (at most once per lease period)."""
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.lease_seconds
+        try:
+            swept = await fail_abandoned_jobs(JOB_RESULT_TTL)
+        except Exception as e:
+            logger.warning("Abandoned job sweep failed: %s", e)
+            return
+        if swept:
+            self.counters["abandoned"] += swept
+            logger.warning(
+                "Marked %d abandoned job(s) as failed", swept, extra={"jobs": swept}
+            )
+
+    async def _execute(self, job: dict) -> None:
+        job_id, kind = job["_id"], job["kind"]
+        fields = {"job_id": job_id, "kind": kind, "attempt": job["attempts"]}
+        logger.info(
+            "Job %s (%s) attempt %d/%d",
+            job_id,
+            kind,
+            job["attempts"],
+            job["max_attempts"],
+            extra=fields,
+        )
+        handler = JOB_HANDLERS[kind]
+        work = asyncio.create_task(handler(job.get("params") or {}, job["user_id"]))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, work))
+        try:
+            result = await work
+        except asyncio.CancelledError:
+            if not heartbeat.done():
+                raise  # the worker itself is shutting down
+            self.counters["lease_lost"] += 1
+            logger.warning("Job %s: lease lost, abandoning", job_id, extra=fields)
+            return
+        except Exception as e:
+            self.counters["errors"] += 1
+            retry_delay = None
+            if job["attempts"] < job["max_attempts"]:
+                retry_delay = min(300.0, 5.0 * 2 ** (job["attempts"] - 1))
+            logger.error(
+                "Job %s (%s) failed: %s%s",
+                job_id,
+                kind,
+                e,
+                f". Retrying in {retry_delay:.0f}s" if retry_delay else "",
+                extra=fields,
+            )
+            await fail_job(
+                job_id,
+                self.worker_id,
+                str(e) or type(e).__name__,
+                retry_delay,
+                JOB_RESULT_TTL,
+            )
+            return
+        finally:
+            heartbeat.cancel()
+
+        if await complete_job(job_id, self.worker_id, result, JOB_RESULT_TTL):
+            self.counters["succeeded"] += 1
+            logger.info("Job %s (%s) done", job_id, kind, extra=fields)
+        else:
+            self.counters["lease_lost"] += 1
+
+    async def _heartbeat(self, job_id: str, work: "asyncio.Task[Any]") -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await renew_lease(job_id, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.warning("Job %s: lease renewal failed: %s", job_id, e)
+                continue
+            if not renewed:
+                work.cancel()
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {"worker_id": self.worker_id, "slots": len(self._tasks), **self.counters}
+
+
+def create_worker(concurrency: int, kinds: Optional[List[str]] = None) -> JobWorker:
+    return JobWorker(
+        concurrency=concurrency,
+        kinds=kinds,
+        lease_seconds=JOB_LEASE_SECONDS,
+        poll_interval=JOB_POLL_INTERVAL,
+    )
@@ -0,0 +1,171 @@
+"""
+Pool of Gemini API keys with per-key sliding-window load tracking.
+
+Each call picks the least-loaded healthy key. Keys that answer 429 (quota) or
+401/403 (auth) are put on cooldown and skipped while any other key is healthy,
+so throughput grows with the number of configured keys instead of being capped
+by whichever key runs out of quota first.
+"""
+
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+from config import (
+    GEMINI_API_KEYS,
+    GEMINI_KEY_AUTH_COOLDOWN,
+    GEMINI_KEY_RATE_LIMIT_COOLDOWN,
+    GEMINI_KEY_RPM_LIMIT,
+)
+from utils.log import get_logger
+
+logger = get_logger("llm")
+
+WINDOW_SECONDS = 60.0
+AUTH_ERROR_STATUSES = frozenset({401, 403})
+
+
+class _KeyState:
+    __slots__ = ("key", "requests", "errors", "cooldown_until", "in_flight")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.requests: Deque[float] = deque()
+        self.errors: Deque[float] = deque()
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+
+    def prune(self, now: float) -> None:
+        cutoff = now - WINDOW_SECONDS
+        while self.requests and self.requests[0] < cutoff:
+            self.requests.popleft()
+        while self.errors and self.errors[0] < cutoff:
+            self.errors.popleft()
+
+    def error_rate(self) -> float:
+        return len(self.errors) / len(self.requests) if self.requests else 0.0
+
+
+class KeyPool:
+    def __init__(
+        self,
+        keys: Iterable[str],
+        rpm_limit: Optional[int] = None,
+        rate_limit_cooldown: float = 30.0,
+        auth_cooldown: float = 600.0,
+    ):
+        self._keys: Dict[str, _KeyState] = {
+            k: _KeyState(k) for k in dict.fromkeys(keys) if k
+        }
+        self.rpm_limit = rpm_limit
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.auth_cooldown = auth_cooldown
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _is_healthy(self, state: _KeyState, now: float) -> bool:
+        if state.cooldown_until > now:
+            return False
+        return not (self.rpm_limit and len(state.requests) >= self.rpm_limit)
+
+    def acquire(self, exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        Reserve the least-loaded healthy key not in ``exclude``.
+
+        If every remaining key is cooling down or saturated, the one that
+        becomes available soonest is returned so callers still get a best
+        effort; ``None`` means no key is left to try.
+        """
+        now = time.monotonic()
+        excluded = set(exclude)
+        candidates = [s for k, s in self._keys.items() if k not in excluded]
+        if not candidates:
+            return None
+
+        for state in candidates:
+            state.prune(now)
+
+        healthy = [s for s in candidates if self._is_healthy(s, now)]
+        if healthy:
+            chosen = min(
+                healthy, key=lambda s: (len(s.requests) + s.in_flight, s.error_rate())
+            )
+        else:
+            chosen = min(candidates, key=lambda s: (s.cooldown_until, len(s.requests)))
+
+        chosen.requests.append(now)
+        chosen.in_flight += 1
+        return chosen.key
+
+    def release(
+        self, key: str, status_code: Optional[int], retry_after: Optional[float] = None
+    ) -> None:
+        """Record the outcome of a call made with ``key`` (None = transport error)."""
+        state = self._keys.get(key)
+        if state is None:
+            return
+        now = time.monotonic()
+        state.in_flight = max(0, state.in_flight - 1)
+
+        if status_code is not None and status_code < 400:
+            return
+        state.errors.append(now)
+
+        if status_code == 429:
+            cooldown = (
+                retry_after if retry_after is not None else self.rate_limit_cooldown
+            )
+            state.cooldown_until = max(state.cooldown_until, now + cooldown)
+            logger.warning(
+                "Gemini key %s rate limited. Cooling down for %.0fs",
+                mask_key(key),
+                cooldown,
+                extra={"key": mask_key(key)},
+            )
+        elif status_code in AUTH_ERROR_STATUSES:
+            state.cooldown_until = max(state.cooldown_until, now + self.auth_cooldown)
+            logger.error(
+                "Gemini key %s rejected (%d). Cooling down for %.0fs",
+                mask_key(key),
+                status_code,
+                self.auth_cooldown,
+                extra={"key": mask_key(key), "status": status_code},
+            )
+
+    def abandon(self, key: str) -> None:
+        """Release a key whose call was cancelled before it finished (no outcome to record)."""
+        state = self._keys.get(key)
+        if state is not None:
+            state.in_flight = max(0, state.in_flight - 1)
+
+    def stats(self) -> List[dict]:
+        """Per-key load snapshot (keys masked) for diagnostics."""
+        now = time.monotonic()
+        out = []
+        for state in self._keys.values():
+            state.prune(now)
+            out.append(
+                {
+                    "key": mask_key(state.key),
+                    "requests_per_minute": len(state.requests),
+                    "error_rate": round(state.error_rate(), 3),
+                    "in_flight": state.in_flight,
+                    "cooldown_remaining": round(
+                        max(0.0, state.cooldown_until - now), 1
+                    ),
+                }
+            )
+        return out
+
+
+def mask_key(key: str) -> str:
+    return f"{key[:6]}…{key[-4:]}" if len(key) > 12 else "***"
+
+
+key_pool = KeyPool(
+    GEMINI_API_KEYS,
+    rpm_limit=GEMINI_KEY_RPM_LIMIT,
+    rate_limit_cooldown=GEMINI_KEY_RATE_LIMIT_COOLDOWN,
+    auth_cooldown=GEMINI_KEY_AUTH_COOLDOWN,
+)
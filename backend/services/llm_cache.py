@@ -0,0 +1,152 @@
+"""
+Content-addressed cache for LLM responses.
+
+Entries are keyed by a SHA-256 of (model, prompt contents, generationConfig),
+held in a size-bounded in-memory LRU and, when ``LLM_CACHE_DB_PATH`` is set,
+mirrored to a SQLite file so popular prompts survive restarts. Each call site
+chooses its own TTL.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import LLM_CACHE_DB_PATH, LLM_CACHE_MAX_ENTRIES
+from services import metrics
+from utils.log import get_logger
+
+logger = get_logger("llm")
+
+
+def make_cache_key(model: str, payload: Dict[str, Any]) -> str:
+    """Hash everything that influences the model output."""
+    material = {
+        "model": model,
+        "contents": payload.get("contents"),
+        "systemInstruction": payload.get("systemInstruction"),
+        "generationConfig": payload.get("generationConfig"),
+        "cachedContent": payload.get("cachedContent"),
+    }
+    blob = json.dumps(
+        material, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _SQLiteTier:
+    """Tiny persistent key/value store; all calls run in a worker thread."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return row[1], json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+            self._conn.commit()
+
+    def purge_expired(self) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),)
+            )
+            self._conn.commit()
+
+
+class LLMCache:
+    def __init__(self, max_entries: int = 1000, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        # key -> (expires_at as wall-clock time, response)
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._disk: Optional[_SQLiteTier] = None
+        self.counters: Counter = Counter()
+        if db_path:
+            try:
+                self._disk = _SQLiteTier(db_path)
+                self._disk.purge_expired()
+            except sqlite3.Error as e:
+                logger.warning("LLM cache disk tier disabled (%s): %s", db_path, e)
+
+    def _remember(self, key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def get(self, key: str, call_site: str = "llm") -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._memory.move_to_end(key)
+                self.counters[f"{call_site}:memory_hit"] += 1
+                metrics.LLM_CACHE_LOOKUPS.labels(call_site, "memory_hit").inc()
+                return entry[1]
+            del self._memory[key]
+
+        if self._disk is not None:
+            try:
+                found = await asyncio.to_thread(self._disk.get, key)
+            except sqlite3.Error as e:
+                logger.warning("LLM cache disk read failed: %s", e)
+                found = None
+            if found is not None:
+                self._remember(key, *found)
+                self.counters[f"{call_site}:disk_hit"] += 1
+                metrics.LLM_CACHE_LOOKUPS.labels(call_site, "disk_hit").inc()
+                return found[1]
+
+        self.counters[f"{call_site}:miss"] += 1
+        metrics.LLM_CACHE_LOOKUPS.labels(call_site, "miss").inc()
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        expires_at = time.time() + ttl
+        self._remember(key, expires_at, value)
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.set, key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning("LLM cache disk write failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "disk_enabled": self._disk is not None,
+            **self.counters,
+        }
+
+
+llm_cache = LLMCache(max_entries=LLM_CACHE_MAX_ENTRIES, db_path=LLM_CACHE_DB_PATH)
@@ -0,0 +1,661 @@
+"""
+Shared async gateway for outbound LLM calls.
+
+Every AI service sends its Gemini (and Gemini-compatible) requests through one
+pooled keep-alive ``httpx.AsyncClient`` so that round trips reuse TLS
+connections (HTTP/2 when ``h2`` is installed) and never block the event loop.
+"""
+
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import httpx
+
+from config import (
+    GEMINI_BASE_URL,
+    GEMINI_MODEL,
+    LLM_CONNECT_TIMEOUT,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+)
+from services import deadline, metrics
+from services.circuit_breaker import GEMINI_TEXT, CircuitBreaker, get_breaker
+from services.key_pool import key_pool
+from services.llm_cache import llm_cache, make_cache_key
+from services.prompt_registry import CacheHandle, prompt_registry
+from services.retry_policy import (
+    DEFAULT_RETRY_POLICY,
+    RetryPolicy,
+    call_with_retry,
+    parse_retry_after,
+)
+from utils.log import get_logger, log_payload
+
+logger = get_logger("llm")
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_ENABLED = True
+except ImportError:  # HTTP/1.1 keep-alive still gives us connection reuse
+    HTTP2_ENABLED = False
+
+_client: Optional[httpx.AsyncClient] = None
+
+# Gateway-level counters keyed by "<call_site>:<event>" (e.g. "notes:continuation")
+GATEWAY_COUNTS: Counter = Counter()
+
+
+class LLMError(Exception):
+    """Raised when an LLM call fails after retries and key failover."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMTimeoutError(LLMError):
+    """Raised when an LLM call times out (including the retry deadline)."""
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling upstream while that upstream's circuit breaker is open."""
+
+
+def _check_circuit(breaker: CircuitBreaker, call_site: str) -> None:
+    if not breaker.allow():
+        GATEWAY_COUNTS[f"{call_site}:circuit_open"] += 1
+        raise CircuitOpenError(
+            f"{call_site}: {breaker.name} circuit open", status_code=503
+        )
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(60.0, connect=LLM_CONNECT_TIMEOUT),
+            headers={"Content-Type": "application/json"},
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Close the pooled client (called from the app lifespan on shutdown)."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+def gemini_url(model: Optional[str] = None, method: str = "generateContent") -> str:
+    """Build a Gemini REST URL. The API key travels in a header, not the URL."""
+    return f"{GEMINI_BASE_URL}/models/{model or GEMINI_MODEL}:{method}"
+
+
+async def post_json(
+    url: str,
+    payload: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None,
+    timeout: float = 60.0,
+) -> httpx.Response:
+    """POST a JSON body through the pooled client and return the raw response."""
+    client = get_client()
+    return await client.post(url, json=payload, headers=headers, timeout=timeout)
+
+
+async def gemini_generate(
+    payload: Dict[str, Any],
+    api_key: str,
+    model: Optional[str] = None,
+    timeout: float = 60.0,
+) -> httpx.Response:
+    """Call Gemini ``generateContent`` for ``model`` with the given key."""
+    return await post_json(
+        gemini_url(model),
+        payload,
+        headers={"x-goog-api-key": api_key},
+        timeout=timeout,
+    )
+
+
+def extract_text(data: Dict[str, Any]) -> Optional[str]:
+    """Return the first candidate's text from a Gemini response, if any."""
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return None
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    if not parts:
+        return None
+    return parts[0].get("text")
+
+
+def user_key(api_key: Optional[str]) -> Optional[str]:
+    """Return a caller-supplied (X-AI-API-Key) key if it looks like a Gemini key."""
+    return api_key if (api_key and api_key.startswith("AIza")) else None
+
+
+def llm_available(api_key: Optional[str] = None) -> bool:
+    """True if either the caller supplied a usable key or the pool has one."""
+    return bool(user_key(api_key)) or len(key_pool) > 0
+
+
+def _is_key_error(response: httpx.Response) -> bool:
+    if response.status_code in (401, 403, 429):
+        return True
+    # Gemini reports a malformed/unknown key as 400 API_KEY_INVALID
+    return response.status_code == 400 and "API_KEY_INVALID" in response.text
+
+
+def _is_stale_cache(response: httpx.Response, handle: Optional[CacheHandle]) -> bool:
+    """The prompt cache a request referenced has expired or been deleted upstream."""
+    if handle is None or handle.local:
+        return False
+    return (
+        response.status_code in (400, 403, 404)
+        and "cachedcontent" in response.text.lower()
+    )
+
+
+def finish_reason(data: Dict[str, Any]) -> Optional[str]:
+    candidates = data.get("candidates") or []
+    return candidates[0].get("finishReason") if candidates else None
+
+
+def _cacheable(
+    text: Optional[str],
+    reason: Optional[str],
+    validate: Optional[Callable[[str], bool]],
+) -> bool:
+    """
+    Whether a response may go into the response cache: it finished normally
+    (not cut off by MAX_TOKENS, SAFETY, ...) and the caller's ``validate``
+    accepts it, so malformed output is never replayed for the cache TTL.
+    """
+    if not text or reason not in (None, "STOP"):
+        return False
+    return validate is None or bool(validate(text))
+
+
+CONTINUE_PROMPT = (
+    "Your previous response was cut off by the output limit. Continue exactly where it stopped. "
+    "Do not repeat anything already written and do not add any preamble, explanation or code fences."
+)
+
+
+def continuation_payload(payload: Dict[str, Any], partial: str) -> Dict[str, Any]:
+    """Multi-turn request asking the model to resume ``partial`` where it stopped."""
+    contents = [
+        {"role": c.get("role", "user"), **c} for c in payload.get("contents") or []
+    ]
+    contents.append({"role": "model", "parts": [{"text": partial}]})
+    contents.append({"role": "user", "parts": [{"text": CONTINUE_PROMPT}]})
+    config = dict(payload.get("generationConfig") or {})
+    # JSON mode would make the model start a fresh document instead of resuming
+    config.pop("response_mime_type", None)
+    config.pop("responseMimeType", None)
+    return {**payload, "contents": contents, "generationConfig": config}
+
+
+def stitch_continuation(partial: str, continuation: str, max_overlap: int = 300) -> str:
+    """Append ``continuation``, dropping fences and any text it repeats from the end of ``partial``."""
+    continuation = continuation.lstrip()
+    for fence in ("```json", "```"):
+        if continuation.startswith(fence):
+            continuation = continuation[len(fence) :].lstrip("\n")
+            break
+    for size in range(min(max_overlap, len(partial), len(continuation)), 0, -1):
+        if partial.endswith(continuation[:size]):
+            continuation = continuation[size:]
+            break
+    return partial + continuation
+
+
+async def _request(
+    payload: Dict[str, Any],
+    preferred: Optional[str],
+    model: Optional[str],
+    timeout: float,
+    policy: RetryPolicy,
+    call_site: str,
+    breaker: CircuitBreaker,
+) -> Dict[str, Any]:
+    """One logical Gemini call: key failover inside each attempt, ``policy`` across attempts."""
+    if deadline.expired():
+        raise LLMTimeoutError(f"{call_site}: request deadline exceeded")
+    _check_circuit(breaker, call_site)
+    sent: Dict[str, Optional[CacheHandle]] = {}
+
+    async def send(attempt: int, remaining: Optional[float]) -> httpx.Response:
+        tried: List[str] = []
+        last_response: Optional[httpx.Response] = None
+        while True:
+            if preferred and preferred not in tried:
+                key, pooled = preferred, False
+            else:
+                key, pooled = key_pool.acquire(exclude=tried), True
+            if key is None or (last_response is not None and deadline.expired()):
+                return last_response
+            tried.append(key)
+            key_name = metrics.key_label(key, pooled)
+
+            attempt_timeout = deadline.cap_timeout(
+                timeout if remaining is None else max(0.1, min(timeout, remaining))
+            )
+            body, handle = await prompt_registry.prepare(
+                payload, key, model or GEMINI_MODEL, get_client(), cacheable=pooled
+            )
+            started = time.perf_counter()
+            try:
+                response = await gemini_generate(
+                    body, key, model=model, timeout=attempt_timeout
+                )
+                if _is_stale_cache(response, handle):
+                    prompt_registry.invalidate(handle)
+                    body, handle = await prompt_registry.prepare(
+                        payload,
+                        key,
+                        model or GEMINI_MODEL,
+                        get_client(),
+                        cacheable=False,
+                    )
+                    response = await gemini_generate(
+                        body, key, model=model, timeout=attempt_timeout
+                    )
+            except (httpx.TimeoutException, httpx.TransportError):
+                metrics.observe_llm(
+                    call_site,
+                    model or GEMINI_MODEL,
+                    key_name,
+                    None,
+                    time.perf_counter() - started,
+                )
+                if pooled:
+                    key_pool.release(key, None)
+                raise
+            except asyncio.CancelledError:
+                # e.g. the losing side of a hedged detection
+                if pooled:
+                    key_pool.abandon(key)
+                raise
+            metrics.observe_llm(
+                call_site,
+                model or GEMINI_MODEL,
+                key_name,
+                response.status_code,
+                time.perf_counter() - started,
+            )
+            if pooled:
+                key_pool.release(
+                    key,
+                    response.status_code,
+                    parse_retry_after(response.headers.get("Retry-After")),
+                )
+
+            if _is_key_error(response):
+                logger.warning(
+                    "%s: Gemini key error (%d). Trying next key",
+                    call_site,
+                    response.status_code,
+                    extra={"key": key_name},
+                )
+                last_response = response
+                continue
+            sent["handle"] = handle
+            return response
+
+    try:
+        response = await call_with_retry(send, policy, call_site=call_site)
+    except httpx.TimeoutException as exc:
+        if not deadline.expired():
+            breaker.record_failure()  # running out of our own time budget is not an upstream fault
+        raise LLMTimeoutError(f"{call_site}: request timed out") from exc
+    except httpx.TransportError as exc:
+        breaker.record_failure()
+        raise LLMError(f"{call_site}: transport error: {exc}") from exc
+
+    breaker.record(response.status_code)
+    if response.is_error:
+        logger.error(
+            "%s: Gemini API error %d",
+            call_site,
+            response.status_code,
+            extra={"status": response.status_code},
+        )
+        log_payload(logger, "Gemini error body", response.text, call_site=call_site)
+        raise LLMError(
+            f"{call_site}: Gemini returned {response.status_code}",
+            status_code=response.status_code,
+        )
+    data = response.json()
+    prompt_registry.record_usage(payload, sent.get("handle"), data)
+    metrics.record_usage(call_site, model or GEMINI_MODEL, data.get("usageMetadata"))
+    return data
+
+
+async def generate_content(
+    payload: Dict[str, Any],
+    api_key: Optional[str] = None,
+    model: Optional[str] = None,
+    timeout: float = 60.0,
+    policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    call_site: str = "gemini",
+    cache_ttl: Optional[float] = None,
+    max_continuations: int = 0,
+    upstream: str = GEMINI_TEXT,
+    validate: Optional[Callable[[str], bool]] = None,
+) -> Dict[str, Any]:
+    """
+    Call Gemini with retries and key failover and return the decoded JSON body.
+
+    With ``cache_ttl`` set, identical (model, prompt, generationConfig) requests
+    are answered from the response cache for that many seconds. Only responses
+    that finished with ``STOP`` and pass ``validate(text)`` (the caller's parse
+    check) are cached; a cached entry that no longer validates is ignored.
+
+    A caller-supplied ``api_key`` is tried first; after that keys come from the
+    shared pool (least-loaded healthy key first). A key-level failure
+    (401/403/429, or 400 API_KEY_INVALID) moves straight on to the next key;
+    once every key has been tried the response goes back to ``policy`` for a
+    backoff before the next round.
+
+    If the model stops with ``finishReason=MAX_TOKENS``, up to
+    ``max_continuations`` follow-up requests resume from the partial output and
+    the pieces are stitched into a single candidate, instead of the caller
+    paying for a full regeneration.
+
+    Calls are guarded by the circuit breaker for ``upstream``: while it is
+    open, ``CircuitOpenError`` is raised at once (cache hits are still served).
+    """
+    preferred = user_key(api_key)
+    if not preferred and len(key_pool) == 0:
+        raise LLMError("No Gemini API key configured.")
+
+    cache_key = make_cache_key(model or GEMINI_MODEL, payload) if cache_ttl else None
+    if cache_key:
+        cached = await llm_cache.get(cache_key, call_site=call_site)
+        if cached is not None and (
+            validate is None or validate(extract_text(cached) or "")
+        ):
+            return cached
+
+    breaker = get_breaker(upstream)
+    data = await _request(
+        payload, preferred, model, timeout, policy, call_site, breaker
+    )
+
+    text = extract_text(data)
+    continuations = 0
+    while (
+        text
+        and finish_reason(data) == "MAX_TOKENS"
+        and continuations < max_continuations
+    ):
+        continuations += 1
+        GATEWAY_COUNTS[f"{call_site}:continuation"] += 1
+        logger.info(
+            "%s: output hit MAX_TOKENS (%d chars). Continuing (%d/%d)",
+            call_site,
+            len(text),
+            continuations,
+            max_continuations,
+        )
+        try:
+            more = await _request(
+                continuation_payload(payload, text),
+                preferred,
+                model,
+                timeout,
+                policy,
+                call_site,
+                breaker,
+            )
+        except LLMError as e:
+            logger.warning(
+                "%s: continuation failed (%s). Returning partial output.", call_site, e
+            )
+            break
+        more_text = extract_text(more)
+        if not more_text:
+            break
+        text = stitch_continuation(text, more_text)
+        data = {
+            **more,
+            "candidates": [
+                {
+                    **more["candidates"][0],
+                    "content": {"role": "model", "parts": [{"text": text}]},
+                }
+            ],
+        }
+    if continuations:
+        data["continuations"] = continuations
+
+    if cache_key and _cacheable(text, finish_reason(data), validate):
+        await llm_cache.set(cache_key, data, cache_ttl)
+    return data
+
+
+async def stream_generate_content(
+    payload: Dict[str, Any],
+    api_key: Optional[str] = None,
+    model: Optional[str] = None,
+    timeout: float = 120.0,
+    call_site: str = "gemini_stream",
+    cache_ttl: Optional[float] = None,
+    max_continuations: int = 0,
+    upstream: str = GEMINI_TEXT,
+    validate: Optional[Callable[[str], bool]] = None,
+) -> AsyncIterator[str]:
+    """
+    Stream text deltas from Gemini ``streamGenerateContent`` (SSE framing).
+
+    Keys are chosen like ``generate_content``; a key-level failure before the
+    first byte moves on to the next key. Once text has started flowing there is
+    no retry. With ``cache_ttl`` set, a cached response for the same request is
+    replayed as a single delta, and a completed stream that passes ``validate``
+    is written back to the cache in ``generateContent`` shape so both paths
+    share entries (same rules as ``generate_content``). Output cut
+    off at ``MAX_TOKENS`` is resumed like ``generate_content`` does, and the
+    continuation is streamed on seamlessly. The ``upstream`` circuit breaker
+    applies as in ``generate_content``.
+    """
+    preferred = user_key(api_key)
+    if not preferred and len(key_pool) == 0:
+        raise LLMError("No Gemini API key configured.")
+
+    cache_key = make_cache_key(model or GEMINI_MODEL, payload) if cache_ttl else None
+    if cache_key:
+        cached = await llm_cache.get(cache_key, call_site=call_site)
+        cached_text = extract_text(cached) if cached else None
+        if cached_text and (validate is None or validate(cached_text)):
+            yield cached_text
+            return
+
+    breaker = get_breaker(upstream)
+    outcome: Dict[str, Any] = {}
+    text = ""
+    async for delta in _stream_once(
+        payload, preferred, model, timeout, call_site, outcome, breaker
+    ):
+        text += delta
+        yield delta
+
+    continuations = 0
+    while (
+        text
+        and outcome.get("finish_reason") == "MAX_TOKENS"
+        and continuations < max_continuations
+    ):
+        continuations += 1
+        GATEWAY_COUNTS[f"{call_site}:continuation"] += 1
+        logger.info(
+            "%s: stream hit MAX_TOKENS (%d chars). Continuing (%d/%d)",
+            call_site,
+            len(text),
+            continuations,
+            max_continuations,
+        )
+        outcome = {}
+        # Hold back the start of the continuation until any repeated overlap
+        # with the text already sent can be trimmed off.
+        head = ""
+        stitched = False
+        async for delta in _stream_once(
+            continuation_payload(payload, text),
+            preferred,
+            model,
+            timeout,
+            call_site,
+            outcome,
+            breaker,
+        ):
+            if stitched:
+                text += delta
+                yield delta
+                continue
+            head += delta
+            if len(head) >= 400:
+                extended = stitch_continuation(text, head)
+                stitched = True
+                yield extended[len(text) :]
+                text = extended
+        if not stitched and head:
+            extended = stitch_continuation(text, head)
+            yield extended[len(text) :]
+            text = extended
+
+    if cache_key and _cacheable(text, outcome.get("finish_reason"), validate):
+        full = {
+            "candidates": [
+                {
+                    "content": {"parts": [{"text": text}]},
+                    "finishReason": outcome.get("finish_reason"),
+                }
+            ]
+        }
+        await llm_cache.set(cache_key, full, cache_ttl)
+
+
+async def _stream_once(
+    payload: Dict[str, Any],
+    preferred: Optional[str],
+    model: Optional[str],
+    timeout: float,
+    call_site: str,
+    outcome: Dict[str, Any],
+    breaker: CircuitBreaker,
+) -> AsyncIterator[str]:
+    """One streamed Gemini call with key failover; stores the finishReason in ``outcome``."""
+    if deadline.expired():
+        raise LLMTimeoutError(f"{call_site}: request deadline exceeded")
+    _check_circuit(breaker, call_site)
+    client = get_client()
+    tried: List[str] = []
+    use_cache = True
+    while True:
+        if preferred and preferred not in tried:
+            key, pooled = preferred, False
+        else:
+            key, pooled = key_pool.acquire(exclude=tried), True
+        if key is None:
+            breaker.record_failure()
+            raise LLMError(
+                f"{call_site}: no Gemini key could serve the request", status_code=429
+            )
+        tried.append(key)
+        key_name = metrics.key_label(key, pooled)
+
+        body, handle = await prompt_registry.prepare(
+            payload, key, model or GEMINI_MODEL, client, cacheable=pooled and use_cache
+        )
+        status: Optional[int] = None  # reported back to the pool
+        started = time.perf_counter()
+        try:
+            async with client.stream(
+                "POST",
+                gemini_url(model, "streamGenerateContent"),
+                params={"alt": "sse"},
+                json=body,
+                headers={"x-goog-api-key": key},
+                timeout=deadline.cap_timeout(timeout),
+            ) as response:
+                status = response.status_code
+                if response.is_error:
+                    await response.aread()
+                    if _is_stale_cache(response, handle):
+                        # Not the key's fault: retry with the prefix inline
+                        prompt_registry.invalidate(handle)
+                        tried.remove(key)
+                        use_cache = False
+                        status = 200
+                        continue
+                    if _is_key_error(response):
+                        logger.warning(
+                            "%s: Gemini key error (%d). Trying next key",
+                            call_site,
+                            response.status_code,
+                            extra={"key": key_name},
+                        )
+                        if pooled:
+                            key_pool.release(
+                                key,
+                                response.status_code,
+                                parse_retry_after(response.headers.get("Retry-After")),
+                            )
+                            pooled = False  # already released
+                        continue
+                    breaker.record(response.status_code)
+                    raise LLMError(
+                        f"{call_site}: Gemini returned {response.status_code}",
+                        status_code=response.status_code,
+                    )
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    chunk = json.loads(line[5:].strip() or "{}")
+                    outcome["finish_reason"] = finish_reason(chunk) or outcome.get(
+                        "finish_reason"
+                    )
+                    if chunk.get("usageMetadata"):
+                        outcome["usage"] = chunk["usageMetadata"]
+                    text = extract_text(chunk)
+                    if text:
+                        yield text
+                prompt_registry.record_usage(
+                    payload, handle, {"usageMetadata": outcome.get("usage")}
+                )
+                metrics.record_usage(
+                    call_site, model or GEMINI_MODEL, outcome.get("usage")
+                )
+                breaker.record_success()
+        except httpx.TimeoutException as exc:
+            status = None
+            if not deadline.expired():
+                breaker.record_failure()
+            raise LLMTimeoutError(f"{call_site}: stream timed out") from exc
+        except httpx.TransportError as exc:
+            status = None
+            breaker.record_failure()
+            raise LLMError(f"{call_site}: transport error: {exc}") from exc
+        finally:
+            metrics.observe_llm(
+                call_site,
+                model or GEMINI_MODEL,
+                key_name,
+                status,
+                time.perf_counter() - started,
+            )
+            if pooled:
+                key_pool.release(key, status)
+        return
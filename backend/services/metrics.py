@@ -0,0 +1,230 @@
+"""
+Prometheus metrics, exposed at ``GET /metrics``.
+
+Covers where time and tokens go: request latency per route, every upstream
+Gemini/AIML attempt by call site, model and key, token counts from Gemini's
+``usageMetadata``, retries, rate limits, cache lookups, local fallbacks, JSON
+parse failures, and every MongoDB command (via a pymongo command listener on
+the Motor client).
+
+The older in-process counters (``GATEWAY_COUNTS``, ``RETRY_COUNTS``, the
+``stats()`` methods) are kept for ad-hoc diagnostics; these series are the
+ones to scrape and alert on. Label values are kept low-cardinality: routes are
+path templates, pool keys are masked, and caller-supplied keys share the
+label ``user``.
+"""
+
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from pymongo import monitoring
+
+from services.key_pool import mask_key
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+BYTE_BUCKETS = (16e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+HTTP_LATENCY = Histogram(
+    "stemly_http_request_duration_seconds",
+    "API request latency by route template, until the last body chunk is sent",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_LATENCY = Histogram(
+    "stemly_llm_request_duration_seconds",
+    "Latency of each upstream LLM HTTP attempt",
+    ["call_site", "model", "key", "status"],
+    buckets=LLM_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "stemly_llm_tokens_total",
+    "Gemini tokens from usageMetadata (kind: prompt, cached, output, thoughts)",
+    ["call_site", "model", "kind"],
+)
+LLM_RETRIES = Counter(
+    "stemly_llm_retries_total",
+    "Retries scheduled by the retry policy (reason: HTTP status, timeout, transport)",
+    ["call_site", "reason"],
+)
+LLM_RATE_LIMITED = Counter(
+    "stemly_llm_rate_limited_total",
+    "Upstream 429 responses, per key",
+    ["call_site", "key"],
+)
+LLM_CACHE_LOOKUPS = Counter(
+    "stemly_llm_cache_lookups_total",
+    "LLM response, scan detection and vision image cache lookups (result: memory_hit, disk_hit, db_hit, miss)",
+    ["call_site", "result"],
+)
+VISION_IMAGE_BYTES = Histogram(
+    "stemly_vision_image_bytes",
+    "Scan image size before preprocessing (stage: original) and as sent to Gemini Vision (stage: sent)",
+    ["stage"],
+    buckets=BYTE_BUCKETS,
+)
+FALLBACKS = Counter(
+    "stemly_fallbacks_total",
+    "Responses served from a local fallback instead of the model",
+    ["feature", "reason"],
+)
+PARSE_FAILURES = Counter(
+    "stemly_llm_parse_failures_total",
+    "Model output that could not be parsed into the expected JSON",
+    ["call_site"],
+)
+MONGO_LATENCY = Histogram(
+    "stemly_mongo_command_duration_seconds",
+    "MongoDB command latency by collection and command",
+    ["collection", "command"],
+    buckets=MONGO_BUCKETS,
+)
+MONGO_FAILURES = Counter(
+    "stemly_mongo_command_failures_total",
+    "Failed MongoDB commands by collection and command",
+    ["collection", "command"],
+)
+
+# usageMetadata field -> "kind" label
+_TOKEN_FIELDS = {
+    "promptTokenCount": "prompt",
+    "cachedContentTokenCount": "cached",
+    "candidatesTokenCount": "output",
+    "thoughtsTokenCount": "thoughts",
+}
+
+
+_PATH_PARAM = re.compile(r"{(\w+)(?::\w+)?}")
+
+
+def route_template(scope: Dict[str, Any]) -> str:
+    """Full path template of the matched route (``/jobs/{job_id}``), or ``unmatched``.
+
+    Newer FastAPI versions keep an included router's prefix out of
+    ``route.path``, so the prefix is recovered from the concrete path.
+    """
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if template is None:
+        return "unmatched"
+    params = scope.get("path_params") or {}
+    rendered = _PATH_PARAM.sub(
+        lambda m: str(params.get(m.group(1), m.group(0))), template
+    )
+    path = scope.get("path", "")
+    if rendered and path.endswith(rendered):
+        return path[: len(path) - len(rendered)] + template
+    return template
+
+
+class RequestLatency:
+    """
+    ASGI middleware observing ``HTTP_LATENCY`` once the response body has been
+    sent, so streaming (SSE) routes record the whole stream rather than the
+    time to their headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Label by route template (/jobs/{job_id}), not the raw path
+            HTTP_LATENCY.labels(
+                scope["method"], route_template(scope), str(status)
+            ).observe(time.perf_counter() - start)
+
+
+def key_label(key: Optional[str], pooled: bool) -> str:
+    """Masked pool key, or ``user`` for a caller-supplied key (never exported)."""
+    if not pooled or not key:
+        return "user"
+    return mask_key(key)
+
+
+def observe_llm(
+    call_site: str, model: str, key: str, status: Optional[int], seconds: float
+) -> None:
+    """One upstream attempt; ``status`` None means it never got a response."""
+    LLM_LATENCY.labels(
+        call_site, model, key, str(status) if status is not None else "error"
+    ).observe(seconds)
+    if status == 429:
+        LLM_RATE_LIMITED.labels(call_site, key).inc()
+
+
+def record_usage(call_site: str, model: str, usage: Optional[Dict[str, Any]]) -> None:
+    for field, kind in _TOKEN_FIELDS.items():
+        count = (usage or {}).get(field)
+        if count:
+            LLM_TOKENS.labels(call_site, model, kind).inc(count)
+
+
+def record_fallback(feature: str, reason: str) -> None:
+    FALLBACKS.labels(feature, reason).inc()
+
+
+def record_parse_failure(call_site: str) -> None:
+    PARSE_FAILURES.labels(call_site).inc()
+
+
+def render() -> Tuple[bytes, str]:
+    """Exposition body and content type for ``GET /metrics``."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command Motor sends; pass as ``event_listeners=[...]``."""
+
+    def __init__(self):
+        self._collections: Dict[Tuple[Any, int], str] = {}
+        self._lock = threading.Lock()  # pymongo calls listeners from its own threads
+
+    @staticmethod
+    def _collection(event: monitoring.CommandStartedEvent) -> str:
+        target = event.command.get(event.command_name)
+        if isinstance(target, str):
+            return target
+        # getMore/killCursors name the collection separately
+        return str(event.command.get("collection", "-"))
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = (
+                self._collection(event)
+            )
+
+    def _finished(self, event) -> str:
+        with self._lock:
+            return self._collections.pop((event.connection_id, event.request_id), "-")
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        collection = self._finished(event)
+        MONGO_LATENCY.labels(collection, event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        collection = self._finished(event)
+        MONGO_LATENCY.labels(collection, event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+        MONGO_FAILURES.labels(collection, event.command_name).inc()
@@ -0,0 +1,415 @@
+"""
+Versioned prompt templates with a cacheable static prefix.
+
+Every template is split into a static ``prefix`` (role, rules, output schema,
+examples) and a ``suffix`` that holds everything request-specific. Payloads
+built from a template carry the prefix as ``systemInstruction``, so all
+requests for one template version start with byte-identical tokens.
+
+The gateway hands each payload to ``prompt_registry.prepare`` right before it
+is sent. With ``PROMPT_CACHE_BACKEND=gemini`` the prefix is swapped for a
+Gemini context cache (``cachedContents``) created once per template version,
+model and pool key; ``local`` is an in-process stand-in for tests and offline
+development that exercises the same bookkeeping but sends the prefix inline;
+``off`` always sends it inline. Input tokens served from a cache (explicit or
+Gemini's implicit prefix caching) are read from ``usageMetadata`` and
+reported by ``stats()``.
+
+Gemini only creates context caches of at least ``PROMPT_CACHE_MIN_TOKENS``
+(1024 for Flash). The current templates are far smaller (notes ~210, quiz
+~160, visualiser chat ~400 estimated tokens), so explicit caching would never
+engage for them and ``PROMPT_CACHE_BACKEND`` defaults to ``off``: prefixes go
+out inline and only implicit prefix caching applies. With ``gemini``,
+``stats()`` reports ``explicit_cache`` per template and the first skip is
+logged; a template picks up explicit caching once its prefix passes the
+minimum.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set, Tuple
+
+import httpx
+
+from config import (
+    GEMINI_BASE_URL,
+    PROMPT_CACHE_BACKEND,
+    PROMPT_CACHE_MIN_TOKENS,
+    PROMPT_CACHE_TTL,
+)
+from utils.log import get_logger
+
+logger = get_logger("llm")
+
+# Payload field naming the template a request was built from. It never leaves
+# the process: ``prepare`` strips it before the request is sent.
+PROMPT_FIELD = "_prompt_template"
+
+# Seconds before a cache's expiry at which it is treated as gone, so in-flight
+# requests never reference an entry that lapses on the way.
+EXPIRY_MARGIN = 60
+# How long to stop trying to create caches after a failure
+UNSUPPORTED_BACKOFF = 24 * 3600  # Gemini rejected the prefix itself (e.g. too short)
+ERROR_BACKOFF = 60  # transient: 429, 5xx, network
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) used before Gemini has counted."""
+    return max(1, len(text) // 4)
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    name: str
+    version: int
+    prefix: str
+    suffix: str
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    def render(self, **variables: Any) -> str:
+        return self.suffix.format(**variables)
+
+    def payload(
+        self, generation_config: Dict[str, Any], **variables: Any
+    ) -> Dict[str, Any]:
+        """Gemini request body: static prefix as system instruction, rendered suffix as the user turn."""
+        return {
+            "systemInstruction": {"parts": [{"text": self.prefix}]},
+            "contents": [
+                {"role": "user", "parts": [{"text": self.render(**variables)}]}
+            ],
+            "generationConfig": generation_config,
+            PROMPT_FIELD: self.id,
+        }
+
+
+@dataclass(frozen=True)
+class CacheHandle:
+    name: str  # "cachedContents/..." (Gemini) or "local/..." (stand-in)
+    template_id: str
+    tokens: int
+    expires_at: float  # time.monotonic()
+    local: bool = False
+
+
+class CacheCreateError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class GeminiCacheBackend:
+    """Creates real ``cachedContents`` entries; requests then reference them by name."""
+
+    name = "gemini"
+    local = False
+
+    async def create(
+        self,
+        template: PromptTemplate,
+        model: str,
+        api_key: str,
+        ttl: int,
+        client: httpx.AsyncClient,
+    ) -> Tuple[str, int]:
+        body = {
+            "model": f"models/{model}",
+            "systemInstruction": {"parts": [{"text": template.prefix}]},
+            "ttl": f"{ttl}s",
+            "displayName": template.id,
+        }
+        try:
+            response = await client.post(
+                f"{GEMINI_BASE_URL}/cachedContents",
+                json=body,
+                headers={"x-goog-api-key": api_key},
+                timeout=30,
+            )
+        except httpx.HTTPError as exc:
+            raise CacheCreateError(f"transport error: {exc}") from exc
+        if response.is_error:
+            raise CacheCreateError(
+                response.text[:200], status_code=response.status_code
+            )
+        data = response.json()
+        tokens = (data.get("usageMetadata") or {}).get(
+            "totalTokenCount"
+        ) or estimate_tokens(template.prefix)
+        return data["name"], tokens
+
+
+class LocalCacheBackend:
+    """
+    In-process stand-in for Gemini context caching.
+
+    Hands out ``local/...`` handles with the same TTL handling as real caches,
+    but requests still carry the prefix inline (no upstream knows the handle).
+    Savings are reported as the prefix's estimated token count.
+    """
+
+    name = "local"
+    local = True
+
+    async def create(
+        self,
+        template: PromptTemplate,
+        model: str,
+        api_key: str,
+        ttl: int,
+        client: httpx.AsyncClient,
+    ) -> Tuple[str, int]:
+        digest = hashlib.sha256(
+            f"{template.id}|{model}|{template.prefix}".encode("utf-8")
+        ).hexdigest()[:16]
+        return f"local/{digest}", estimate_tokens(template.prefix)
+
+
+_BACKENDS = {"gemini": GeminiCacheBackend, "local": LocalCacheBackend}
+
+
+class PromptRegistry:
+    def __init__(
+        self, backend: str = "gemini", ttl: int = 3600, min_tokens: int = 1024
+    ):
+        backend_cls = _BACKENDS.get(backend)
+        self.backend = backend_cls() if backend_cls else None
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._handles: Dict[Tuple[str, str, str], CacheHandle] = {}
+        self._blocked_until: Dict[Tuple[str, ...], float] = {}
+        self._creating: Set[Tuple[str, str, str]] = set()
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self.counters: Counter = Counter()
+
+    # ------------------------------------------------------------------
+    # Templates
+    # ------------------------------------------------------------------
+
+    def register(self, template: PromptTemplate) -> PromptTemplate:
+        """Add a template. Re-registering the same name needs a new version."""
+        current = self._templates.get(template.name)
+        if (
+            current is not None
+            and current != template
+            and current.version == template.version
+        ):
+            raise ValueError(
+                f"Prompt {template.name} v{template.version} changed without a version bump."
+            )
+        self._templates[template.name] = template
+        return template
+
+    def get(self, name: str) -> PromptTemplate:
+        return self._templates[name]
+
+    def eligible(self, template: PromptTemplate) -> bool:
+        """Whether the backend will cache this template's prefix (explicit caches have a minimum size)."""
+        if self.backend is None:
+            return False
+        return self.backend.local or estimate_tokens(template.prefix) >= self.min_tokens
+
+    # ------------------------------------------------------------------
+    # Request preparation (called by services/llm_gateway.py)
+    # ------------------------------------------------------------------
+
+    async def prepare(
+        self,
+        payload: Dict[str, Any],
+        api_key: str,
+        model: str,
+        client: httpx.AsyncClient,
+        cacheable: bool = True,
+    ) -> Tuple[Dict[str, Any], Optional[CacheHandle]]:
+        """
+        Return the body to send with ``api_key`` and the cache handle it uses.
+
+        Payloads not built from a template pass through untouched. A missing
+        cache is created in the background (only for pool keys: caches are
+        billed to the key's project, so a caller's own key is never used), and
+        the request goes out inline meanwhile instead of waiting for it.
+        """
+        template_id = payload.get(PROMPT_FIELD)
+        if template_id is None:
+            return payload, None
+        body = {k: v for k, v in payload.items() if k != PROMPT_FIELD}
+        name = template_id.split("@", 1)[0]
+        template = self._templates.get(name)
+        if (
+            self.backend is None
+            or template is None
+            or template.id != template_id
+            or not cacheable
+        ):
+            return body, None
+
+        slot = (template_id, model, api_key)
+        handle = self._handles.get(slot)
+        if handle is not None and handle.expires_at <= time.monotonic():
+            del self._handles[slot]
+            handle = None
+        if handle is None:
+            self._schedule_create(template, model, api_key, client)
+            return body, None
+
+        self.counters[f"{template_id}:cache_requests"] += 1
+        if handle.local:
+            return body, handle
+        body.pop("systemInstruction", None)
+        body["cachedContent"] = handle.name
+        return body, handle
+
+    def invalidate(self, handle: CacheHandle) -> None:
+        """Forget a cache Gemini no longer recognises (evicted or deleted early)."""
+        for slot, current in list(self._handles.items()):
+            if current == handle:
+                del self._handles[slot]
+        self.counters[f"{handle.template_id}:stale"] += 1
+
+    def record_usage(
+        self,
+        payload: Dict[str, Any],
+        handle: Optional[CacheHandle],
+        data: Dict[str, Any],
+    ) -> None:
+        """Account prompt and cached input tokens from a response's ``usageMetadata``."""
+        template_id = payload.get(PROMPT_FIELD)
+        if template_id is None:
+            return
+        usage = data.get("usageMetadata") or {}
+        cached = usage.get("cachedContentTokenCount") or 0
+        if handle is not None and handle.local:
+            cached = max(cached, handle.tokens)
+        self.counters[f"{template_id}:calls"] += 1
+        self.counters[f"{template_id}:prompt_tokens"] += (
+            usage.get("promptTokenCount") or 0
+        )
+        self.counters[f"{template_id}:tokens_saved"] += cached
+
+    # ------------------------------------------------------------------
+    # Cache creation
+    # ------------------------------------------------------------------
+
+    def _schedule_create(
+        self,
+        template: PromptTemplate,
+        model: str,
+        api_key: str,
+        client: httpx.AsyncClient,
+    ) -> None:
+        slot = (template.id, model, api_key)
+        now = time.monotonic()
+        if slot in self._creating:
+            return
+        if (
+            self._blocked_until.get((template.id, model), 0) > now
+            or self._blocked_until.get(slot, 0) > now
+        ):
+            return
+        if not self.eligible(template):
+            # Below Gemini's minimum cache size; implicit prefix caching still applies
+            self._blocked_until[(template.id, model)] = float("inf")
+            logger.info(
+                "Prompt cache not used for %s: prefix ~%d tokens is below PROMPT_CACHE_MIN_TOKENS (%d)",
+                template.id,
+                estimate_tokens(template.prefix),
+                self.min_tokens,
+                extra={"template": template.id, "model": model},
+            )
+            return
+        self._creating.add(slot)
+        task = asyncio.create_task(self._create(template, model, api_key, client))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _create(
+        self,
+        template: PromptTemplate,
+        model: str,
+        api_key: str,
+        client: httpx.AsyncClient,
+    ) -> None:
+        slot = (template.id, model, api_key)
+        try:
+            name, tokens = await self.backend.create(
+                template, model, api_key, self.ttl, client
+            )
+        except CacheCreateError as e:
+            self.counters[f"{template.id}:create_failed"] += 1
+            if e.status_code == 400:
+                logger.warning(
+                    "Prompt cache unsupported for %s on %s: %s", template.id, model, e
+                )
+                self._blocked_until[(template.id, model)] = (
+                    time.monotonic() + UNSUPPORTED_BACKOFF
+                )
+            else:
+                logger.warning(
+                    "Prompt cache creation failed for %s: %s", template.id, e
+                )
+                self._blocked_until[slot] = time.monotonic() + ERROR_BACKOFF
+            return
+        finally:
+            self._creating.discard(slot)
+
+        self._handles[slot] = CacheHandle(
+            name=name,
+            template_id=template.id,
+            tokens=tokens,
+            expires_at=time.monotonic() + self.ttl - EXPIRY_MARGIN,
+            local=self.backend.local,
+        )
+        self.counters[f"{template.id}:caches_created"] += 1
+        logger.info(
+            "Prompt cache ready for %s on %s (%d tokens, %s)",
+            template.id,
+            model,
+            tokens,
+            self.backend.name,
+            extra={"template": template.id, "model": model, "tokens": tokens},
+        )
+
+    async def close(self) -> None:
+        """Cancel cache creations still in flight (app shutdown)."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        templates = {}
+        for template in self._templates.values():
+            prefix = f"{template.id}:"
+            templates[template.id] = {
+                "prefix_tokens_estimate": estimate_tokens(template.prefix),
+                "explicit_cache": self.eligible(template),
+                **{
+                    k[len(prefix) :]: v
+                    for k, v in self.counters.items()
+                    if k.startswith(prefix)
+                },
+            }
+        return {
+            "backend": self.backend.name if self.backend else "off",
+            "active_caches": len(self._handles),
+            "input_tokens_saved": sum(
+                v for k, v in self.counters.items() if k.endswith(":tokens_saved")
+            ),
+            "templates": templates,
+        }
+
+
+prompt_registry = PromptRegistry(
+    backend=PROMPT_CACHE_BACKEND,
+    ttl=PROMPT_CACHE_TTL,
+    min_tokens=PROMPT_CACHE_MIN_TOKENS,
+)
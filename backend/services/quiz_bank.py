@@ -0,0 +1,198 @@
+"""
+Background refill for the Mongo quiz bank.
+
+``/quiz/generate`` samples questions from the bank when a topic is well
+stocked (``can_serve``): at least ``QUIZ_BANK_MIN_STOCK`` questions and twice
+the requested count, so repeated requests don't keep getting the same few
+questions. This worker walks the most-requested (topic, difficulty) pairs and
+tops any that have fallen below ``QUIZ_BANK_MIN_STOCK`` back up to
+``QUIZ_BANK_TARGET_STOCK``, one batched Gemini call at a time, so generation
+cost is spread out instead of landing on the request path at peak.
+
+Demand is counted in memory (``record_demand``) and written to Mongo in one
+bulk write at the start of each refill pass, not once per quiz request.
+"""
+
+import asyncio
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import PyMongoError
+
+from config import (
+    QUIZ_BANK_BATCH_SIZE,
+    QUIZ_BANK_MAX_TOPICS_PER_CYCLE,
+    QUIZ_BANK_MIN_STOCK,
+    QUIZ_BANK_REFILL_INTERVAL,
+    QUIZ_BANK_TARGET_STOCK,
+)
+from database.quiz_bank_model import (
+    count_questions,
+    get_demanded_topics,
+    insert_questions,
+    record_topic_demand,
+)
+from services.circuit_breaker import GEMINI_TEXT, is_open
+from utils.log import get_logger
+
+logger = get_logger("quiz")
+
+# (topic, num_questions, difficulty) -> validated questions
+BatchGenerator = Callable[[str, int, str], Awaitable[List[dict]]]
+
+# Distinct (topic, difficulty) pairs counted between flushes; requests for
+# further topics are not counted until the next refill pass
+MAX_PENDING_DEMAND = 1000
+
+
+class QuizBankRefiller:
+    def __init__(
+        self,
+        min_stock: int = 30,
+        target_stock: int = 60,
+        batch_size: int = 15,
+        interval: float = 300.0,
+        max_topics: int = 20,
+    ):
+        self.min_stock = min_stock
+        self.target_stock = max(target_stock, min_stock)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_topics = max_topics
+        self.counters: Counter = Counter()
+        self._demand: Dict[Tuple[str, str], Tuple[str, int]] = {}
+        self._generate: Optional[BatchGenerator] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self, generate: BatchGenerator) -> None:
+        """Start the refill loop on the running event loop (app startup)."""
+        if self._task is not None and not self._task.done():
+            return
+        self._generate = generate
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            "Quiz bank refill worker started (min stock %d, every %.0fs)",
+            self.min_stock,
+            self.interval,
+        )
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush_demand()
+        except PyMongoError as e:
+            logger.warning("Could not save quiz topic demand: %s", e)
+
+    def can_serve(self, stock: int, num_questions: int) -> bool:
+        """Whether a topic with ``stock`` banked questions can serve a quiz of ``num_questions``."""
+        return stock >= max(self.min_stock, 2 * num_questions)
+
+    def record_demand(self, topic_key: str, topic: str, difficulty: str) -> None:
+        """Count a quiz request for the next demand flush."""
+        key = (topic_key, difficulty)
+        entry = self._demand.get(key)
+        if entry is not None:
+            self._demand[key] = (entry[0], entry[1] + 1)
+        elif len(self._demand) < MAX_PENDING_DEMAND:
+            self._demand[key] = (topic, 1)
+        else:
+            self.counters["demand_dropped"] += 1
+
+    async def flush_demand(self) -> None:
+        """Write the counted demand to Mongo; kept for the next flush if that fails."""
+        pending, self._demand = self._demand, {}
+        try:
+            await record_topic_demand(pending)
+        except PyMongoError:
+            for key, (topic, requests) in pending.items():
+                entry = self._demand.get(key)
+                self._demand[key] = (topic, requests + (entry[1] if entry else 0))
+            raise
+
+    def nudge(self) -> None:
+        """Ask for a refill pass now (a request just missed the bank)."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refill_once()
+            except PyMongoError as e:
+                logger.warning("Quiz bank refill skipped (database error): %s", e)
+            except Exception as e:
+                logger.exception("Quiz bank refill failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def refill_once(self) -> int:
+        """One pass over the demanded topics. Returns how many questions were added."""
+        await self.flush_demand()
+        added = 0
+        for entry in await get_demanded_topics(limit=self.max_topics):
+            if is_open(GEMINI_TEXT):
+                # Gemini is down; leave the remaining topics for a later cycle
+                self.counters["skipped_circuit_open"] += 1
+                break
+            topic_key, difficulty = entry["topic_key"], entry["difficulty"]
+            stock = await count_questions(topic_key, difficulty)
+            if stock >= self.min_stock:
+                continue
+
+            logger.info(
+                "Refilling quiz bank: %s [%s] (%d/%d)",
+                entry["topic"],
+                difficulty,
+                stock,
+                self.target_stock,
+                extra={
+                    "topic": entry["topic"],
+                    "difficulty": difficulty,
+                    "stock": stock,
+                },
+            )
+            while stock < self.target_stock:
+                batch = await self._generate(
+                    entry["topic"],
+                    min(self.batch_size, self.target_stock - stock),
+                    difficulty,
+                )
+                self.counters["batches"] += 1
+                inserted = await insert_questions(
+                    topic_key, entry["topic"], difficulty, batch
+                )
+                if inserted == 0:
+                    # Generation failed or only produced duplicates; try again next cycle
+                    self.counters["empty_batches"] += 1
+                    break
+                stock += inserted
+                added += inserted
+        self.counters["questions_added"] += added
+        return added
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": int(self._task is not None and not self._task.done()),
+            "pending_demand": len(self._demand),
+            **self.counters,
+        }
+
+
+quiz_bank_refiller = QuizBankRefiller(
+    min_stock=QUIZ_BANK_MIN_STOCK,
+    target_stock=QUIZ_BANK_TARGET_STOCK,
+    batch_size=QUIZ_BANK_BATCH_SIZE,
+    interval=QUIZ_BANK_REFILL_INTERVAL,
+    max_topics=QUIZ_BANK_MAX_TOPICS_PER_CYCLE,
+)
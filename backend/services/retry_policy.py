@@ -0,0 +1,144 @@
+"""
+Event-loop-safe retry scheduling for outbound HTTP calls.
+
+Waits use ``asyncio.sleep`` with full jitter, ``Retry-After`` headers are
+honoured, and every call is bounded by a total deadline so a rate-limit storm
+upstream cannot pin a worker for minutes.
+"""
+
+import asyncio
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, FrozenSet, Optional
+
+import httpx
+
+from services import metrics
+from services.deadline import remaining as request_remaining
+from utils.log import get_logger
+
+logger = get_logger("llm")
+
+RETRYABLE_STATUSES: FrozenSet[int] = frozenset({429, 500, 502, 503, 504})
+
+# Retry counters keyed by "<call_site>:<reason>" (e.g. "quiz:429", "notes:timeout")
+RETRY_COUNTS: Counter = Counter()
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 20.0
+    total_deadline: Optional[float] = 90.0  # seconds for all attempts + waits
+    retry_statuses: FrozenSet[int] = RETRYABLE_STATUSES
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff: uniform(0, min(cap, base * 2^attempt))."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2**attempt)))
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def get_retry_stats() -> Dict[str, int]:
+    """Snapshot of retry counters for diagnostics."""
+    return dict(RETRY_COUNTS)
+
+
+async def call_with_retry(
+    send: Callable[[int, Optional[float]], Awaitable[httpx.Response]],
+    policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    call_site: str = "llm",
+) -> httpx.Response:
+    """
+    Run ``send(attempt, remaining_seconds)`` until it returns a non-retryable
+    response or the policy gives up.
+
+    The last retryable response is returned as-is when attempts (or the
+    deadline) run out; the last transport error is re-raised instead. The
+    deadline is the policy's ``total_deadline`` or the current request
+    deadline (``services/deadline.py``), whichever comes first.
+    """
+    loop = asyncio.get_running_loop()
+    budgets = [b for b in (policy.total_deadline, request_remaining()) if b is not None]
+    deadline = loop.time() + min(budgets) if budgets else None
+
+    for attempt in range(policy.max_attempts):
+        remaining = deadline - loop.time() if deadline is not None else None
+        if remaining is not None and remaining <= 0:
+            raise httpx.TimeoutException(f"{call_site}: retry deadline exceeded")
+
+        try:
+            response = await send(attempt, remaining)
+        except (httpx.TimeoutException, httpx.TransportError) as exc:
+            reason = (
+                "timeout" if isinstance(exc, httpx.TimeoutException) else "transport"
+            )
+            if attempt == policy.max_attempts - 1:
+                raise
+            delay = policy.backoff(attempt)
+            if deadline is not None and loop.time() + delay >= deadline:
+                raise
+            RETRY_COUNTS[f"{call_site}:{reason}"] += 1
+            metrics.LLM_RETRIES.labels(call_site, reason).inc()
+            logger.info(
+                "%s: %s on attempt %d/%d. Retrying in %.1fs",
+                call_site,
+                reason,
+                attempt + 1,
+                policy.max_attempts,
+                delay,
+            )
+            await asyncio.sleep(delay)
+            continue
+
+        if response.status_code not in policy.retry_statuses:
+            return response
+        if attempt == policy.max_attempts - 1:
+            return response
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        delay = retry_after if retry_after is not None else policy.backoff(attempt)
+        if deadline is not None and loop.time() + delay >= deadline:
+            logger.warning(
+                "%s: wait of %.1fs would exceed the deadline. Giving up.",
+                call_site,
+                delay,
+            )
+            return response
+
+        RETRY_COUNTS[f"{call_site}:{response.status_code}"] += 1
+        metrics.LLM_RETRIES.labels(call_site, str(response.status_code)).inc()
+        logger.info(
+            "%s: HTTP %d. Waiting %.1fs (attempt %d/%d)",
+            call_site,
+            response.status_code,
+            delay,
+            attempt + 1,
+            policy.max_attempts,
+        )
+        await asyncio.sleep(delay)
+
+    raise ValueError("RetryPolicy.max_attempts must be at least 1")
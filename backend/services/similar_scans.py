@@ -0,0 +1,176 @@
+"""
+Near-duplicate scan index.
+
+Two photos of the same worksheet never match byte-for-byte, so the exact
+hash used for storage and the detection cache misses them. Every scan also
+gets a 64-bit perceptual hash (dHash, ``utils/phash.py``) at upload, kept in
+an in-memory multi-index hash table of all scan history:
+
+- ``detect_topic`` reuses the cached detection of the nearest earlier scan
+  within ``SCAN_SIMILAR_REUSE_DISTANCE`` bits instead of calling Gemini.
+- ``GET /scan/similar`` lists a user's own past scans within
+  ``SCAN_SIMILAR_SEARCH_DISTANCE`` bits of a given scan.
+
+The index is rebuilt from the ``phash`` field of the scan history when the
+app starts (in the background; lookups work while it fills) and grows with
+every upload. Near-blank images (almost no gradient bits set) are never
+matched: all of them look alike.
+"""
+
+import asyncio
+from collections import Counter
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+from PIL import UnidentifiedImageError
+from pymongo.errors import PyMongoError
+
+from config import (
+    SCAN_SIMILAR_ENABLED,
+    SCAN_SIMILAR_REUSE_DISTANCE,
+    SCAN_SIMILAR_SEARCH_DISTANCE,
+)
+from database.history_model import iter_scan_hashes
+from services.detection_cache import detection_cache
+from utils.log import get_logger
+from utils.phash import HASH_BITS, MultiIndexHash, dhash, from_hex
+
+logger = get_logger("detect")
+
+# Gradient bits a hash needs (from either end) before it is trusted for matching
+MIN_INFORMATIVE_BITS = 4
+# Neighbours whose cached detection is looked up before giving up on reuse
+REUSE_CANDIDATES = 5
+
+
+class ScanRef(NamedTuple):
+    user_id: str
+    image_sha256: str
+    image_path: str
+
+
+def informative(code: int) -> bool:
+    bits = code.bit_count()
+    return MIN_INFORMATIVE_BITS <= bits <= HASH_BITS - MIN_INFORMATIVE_BITS
+
+
+class SimilarScanIndex:
+    def __init__(
+        self,
+        enabled: bool = SCAN_SIMILAR_ENABLED,
+        reuse_distance: int = SCAN_SIMILAR_REUSE_DISTANCE,
+        search_distance: int = SCAN_SIMILAR_SEARCH_DISTANCE,
+    ):
+        self.enabled = enabled
+        self.reuse_distance = reuse_distance
+        self.search_distance = search_distance
+        self._index: MultiIndexHash[ScanRef] = MultiIndexHash()
+        self._seen: Set[ScanRef] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.counters: Counter = Counter()
+
+    async def compute(self, image: Union[str, BinaryIO]) -> Optional[int]:
+        """Perceptual hash of a scan (file path or memory map), or None (disabled, unreadable image)."""
+        if not self.enabled:
+            return None
+        try:
+            return await asyncio.to_thread(dhash, image)
+        except (OSError, UnidentifiedImageError, ValueError) as e:
+            self.counters["hash_failed"] += 1
+            logger.warning("Could not hash scan: %s", e)
+            return None
+
+    def add(
+        self, user_id: str, image_sha256: str, image_path: str, code: Optional[int]
+    ) -> None:
+        if code is None or not informative(code):
+            return
+        ref = ScanRef(user_id, image_sha256, image_path)
+        if ref in self._seen:
+            return
+        self._seen.add(ref)
+        self._index.add(code, ref)
+
+    async def reuse_detection(
+        self, code: Optional[int], image_sha256: Optional[str]
+    ) -> Optional[Tuple[str, List[str]]]:
+        """Cached detection of the nearest other image within the reuse distance, if any."""
+        if code is None or not self.enabled or not informative(code):
+            return None
+        checked: Set[str] = set()
+        for distance, ref in self._index.search(code, self.reuse_distance):
+            if ref.image_sha256 == image_sha256 or ref.image_sha256 in checked:
+                continue
+            checked.add(ref.image_sha256)
+            detection = await detection_cache.get(ref.image_sha256)
+            if detection is not None:
+                self.counters["reused"] += 1
+                logger.info(
+                    "Reusing detection of a near-duplicate scan (%d bits apart)",
+                    distance,
+                    extra={"neighbour": ref.image_sha256, "distance": distance},
+                )
+                return detection
+            if len(checked) >= REUSE_CANDIDATES:
+                break
+        self.counters["no_neighbour"] += 1
+        return None
+
+    def similar_for_user(
+        self,
+        user_id: str,
+        code: int,
+        exclude_sha256: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[Tuple[int, ScanRef]]:
+        """A user's own scans within the search distance, nearest first (one per image)."""
+        if not informative(code):
+            return []
+        matches: List[Tuple[int, ScanRef]] = []
+        images: Set[str] = set()
+        for distance, ref in self._index.search(code, self.search_distance):
+            if (
+                ref.user_id != user_id
+                or ref.image_sha256 == exclude_sha256
+                or ref.image_sha256 in images
+            ):
+                continue
+            images.add(ref.image_sha256)
+            matches.append((distance, ref))
+            if len(matches) >= limit:
+                break
+        return matches
+
+    def start(self) -> None:
+        """Load the scan history into the index in the background."""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._load())
+
+    async def _load(self) -> None:
+        try:
+            async for doc in iter_scan_hashes():
+                self.add(
+                    doc["user_id"],
+                    doc["image_sha256"],
+                    doc["image_path"],
+                    from_hex(doc["phash"]),
+                )
+        except PyMongoError as e:
+            logger.warning("Could not load scan hashes: %s", e)
+            return
+        logger.info(
+            "Similar-scan index loaded (%d scans)",
+            len(self._index),
+            extra={"scans": len(self._index)},
+        )
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"scans": len(self._index), **self.counters}
+
+
+similar_scans = SimilarScanIndex()
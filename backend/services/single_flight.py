@@ -0,0 +1,57 @@
+"""
+Single-flight coalescing for concurrent identical async calls.
+
+While a call for a given key is in flight, later callers with the same key
+await that call instead of starting their own, so a burst of identical
+generations (a whole class scanning the same worksheet) costs one upstream
+request.
+"""
+
+import asyncio
+import copy
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self.counters: Counter = Counter()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run ``fn()`` once per ``key`` at a time and share its result.
+
+        The upstream call runs in its own task, so a caller disconnecting
+        (cancelling its await) does not cancel the work others are waiting on.
+        Followers receive a deep copy so they can't mutate each other's result.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+            result = await asyncio.shield(task)
+            return copy.deepcopy(result)
+
+        self.counters["leader"] += 1
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._finished(key, t))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: "asyncio.Task[Any]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._inflight), **self.counters}
+
+
+def normalize_text(value: Any) -> str:
+    """Case- and whitespace-insensitive form of a prompt input, for flight keys."""
+    return " ".join(str(value or "").split()).lower()
@@ -1,45 +1,192 @@
+"""
+Scan upload ingestion.
+
+One path for every uploaded image: the request's ``Content-Length`` is checked
+before the body is parsed (``UploadSizeLimit``), then the upload is copied in
+fixed-size chunks to a temporary file in the upload directory on a worker
+thread, hashed with SHA-256 on the way, fsynced, and only then renamed into
+place atomically. A failed or rejected upload never leaves a partial file
+behind (not even after a crash), and memory per concurrent upload is one chunk
+regardless of the image size.
+
+Files are named by their hash (``<sha256>.png``), so re-uploading the same
+image reuses the stored file instead of adding a copy (if its size matches;
+otherwise it is replaced); the hash also keys the detection cache
+(``services/detection_cache.py``).
+
+Topic detection reads the stored image through a read-only memory map
+(``StoredScan.view``): the pages just written are still in the page cache, so
+nothing is copied or re-read from disk. ``sync_scan`` (fsync of the upload
+directory, making the rename durable) is the remaining part of persisting the
+upload and runs concurrently with detection.
+"""
+import asyncio
+import hashlib
+import json
+import mmap
 import os
 import uuid
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable
+
+from fastapi import UploadFile
+
+from config import SCAN_MAX_BYTES
+
+UPLOAD_DIR = "static/uploads"
+CHUNK_BYTES = 64 * 1024
+# Multipart framing plus the OCR text field sent alongside the image
+FORM_OVERHEAD_BYTES = 256 * 1024
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+
+class UploadError(ValueError):
+    """Upload rejected by validation; ``status_code`` is the HTTP status to return."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass(frozen=True)
+class StoredScan:
+    path: str  # relative to the backend directory, e.g. static/uploads/<name>.png
+    sha256: str
+    size: int
+    content_type: str
+    deduplicated: bool = False  # the same bytes were already stored
+
+    def view(self) -> mmap.mmap:
+        """
+        Read-only memory map of the stored file. It is file-like (``read``,
+        ``seek``) and a buffer, so Pillow and hashlib use it without a copy; it
+        is unmapped when the last reference goes away.
+        """
+        with open(self.path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _too_large() -> UploadError:
+    return UploadError(f"File too large. Maximum allowed size is {SCAN_MAX_BYTES // (1024 * 1024)} MB.", 413)
+
+
+def _sniff(header: bytes) -> str:
+    if header.startswith(PNG_MAGIC):
+        return "image/png"
+    if header.startswith(JPEG_MAGIC):
+        return "image/jpeg"
+    raise UploadError("Invalid file format. Only PNG and JPEG are allowed.", 415)
+
+
+def _ingest(src: BinaryIO, upload_dir: str, max_bytes: int) -> StoredScan:
+    """Blocking copy loop; runs on a worker thread."""
+    os.makedirs(upload_dir, exist_ok=True)
+    tmp_path = os.path.join(upload_dir, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    content_type = None
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = src.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                if content_type is None:
+                    content_type = _sniff(chunk)
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large()
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UploadError("Uploaded file is empty.")
+        ext = ".png" if content_type == "image/png" else ".jpg"
+        path = os.path.join(upload_dir, f"{digest.hexdigest()}{ext}")
+        deduplicated = _is_stored(path, size)
+        if deduplicated:
+            os.remove(tmp_path)
+        else:
+            # Durable before it takes the hash name, so a crash can't leave a
+            # torn file that later uploads of the same bytes would reuse
+            _fsync_file(tmp_path)
+            os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return StoredScan(
+        path=path, sha256=digest.hexdigest(), size=size, content_type=content_type, deduplicated=deduplicated
+    )
+
+
+def _is_stored(path: str, size: int) -> bool:
+    """A complete copy of these bytes is already stored under ``path``."""
+    try:
+        return os.path.getsize(path) == size
+    except OSError:
+        return False
+
 
-ALLOWED_CONTENT_TYPES = {"image/png", "image/jpeg", "image/jpg"}
-MAX_SCAN_BYTES = 5 * 1024 * 1024  # 5 MB
-SCANS_DIR = "static/scans/"
+def _fsync_file(path: str) -> None:
+    fd = os.open(path, os.O_RDWR if os.name == "nt" else os.O_RDONLY)  # Windows needs write access
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
-async def save_scan(file):
-    os.makedirs(SCANS_DIR, exist_ok=True)
+def _fsync_dir(path: str) -> None:
+    """Blocking fsync of the directory entry for ``path`` (POSIX only)."""
+    if os.name != "posix":
+        return
+    dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
 
-    # Read first 1KB to check magic bytes
-    header = await file.read(1024)
-    await file.seek(0)  # Reset cursor
 
-    is_png = header.startswith(b"\x89PNG\r\n\x1a\n")
-    is_jpeg = header.startswith(b"\xff\xd8\xff")
+async def save_scan(file: UploadFile) -> StoredScan:
+    """
+    Validate and store an uploaded scan (PNG/JPEG, at most ``SCAN_MAX_BYTES``).
+    Raises ``UploadError`` if the upload is rejected.
+    """
+    if file.size is not None and file.size > SCAN_MAX_BYTES:
+        raise _too_large()
+    await file.seek(0)
+    return await asyncio.to_thread(_ingest, file.file, UPLOAD_DIR, SCAN_MAX_BYTES)
 
-    if not (is_png or is_jpeg):
-        raise ValueError("Invalid file format. Only PNG and JPEG are allowed.")
-    
-    # We still use the extension for the filename, but based on detection
-    ext = ".png" if is_png else ".jpg"
 
-    filename = f"{uuid.uuid4()}{ext}"
-    file_path = os.path.join(SCANS_DIR, filename)
+async def sync_scan(stored: StoredScan) -> None:
+    """Make a stored scan's name durable before anything references it."""
+    await asyncio.to_thread(_fsync_dir, stored.path)
 
-    contents = bytearray()
-    total_bytes = 0
-    while True:
-        chunk = await file.read(1024 * 1024)
-        if not chunk:
-            break
-        total_bytes += len(chunk)
-        if total_bytes > MAX_SCAN_BYTES:
-            raise ValueError("File too large. Maximum allowed size is 5 MB.")
-        contents.extend(chunk)
 
-    if total_bytes == 0:
-        raise ValueError("Uploaded file is empty.")
+class UploadSizeLimit:
+    """
+    ASGI middleware rejecting oversized uploads from ``Content-Length`` with a
+    413, before the multipart body is read and spooled.
+    """
 
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    def __init__(self, app, paths: Iterable[str], max_bytes: int = SCAN_MAX_BYTES + FORM_OVERHEAD_BYTES):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.max_bytes = max_bytes
 
-    return f"static/scans/{filename}"
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in self.paths:
+            length = dict(scope["headers"]).get(b"content-length")
+            if length is not None and length.isdigit() and int(length) > self.max_bytes:
+                body = json.dumps({"detail": str(_too_large())}).encode()
+                await send({
+                    "type": "http.response.start",
+                    "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
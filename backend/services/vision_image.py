@@ -0,0 +1,156 @@
+"""
+Scan images as sent to Gemini Vision, cached per scan hash.
+
+``utils/image_prep.py`` turns the upload (a memory map of the stored file, or
+the file itself) into a small upright JPEG/WebP (``VISION_IMAGE_MAX_EDGE``,
+``VISION_IMAGE_FORMAT``, ``VISION_IMAGE_QUALITY``) and base64-encodes it for
+the request body, all on a worker thread. The encoded result is kept in a
+byte-bounded in-memory LRU keyed by the image's SHA-256, so vision retries,
+hedged detections and re-uploads of the same image reuse it instead of
+decoding the photo again.
+
+An image Pillow cannot decode is sent as stored, so a preprocessing problem
+never costs a detection.
+"""
+
+import asyncio
+import base64
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, Optional, Union
+
+from PIL import Image
+
+from config import (
+    VISION_IMAGE_CACHE_MAX_BYTES,
+    VISION_IMAGE_CROP,
+    VISION_IMAGE_FORMAT,
+    VISION_IMAGE_MAX_EDGE,
+    VISION_IMAGE_QUALITY,
+)
+from services import metrics
+from utils.image_prep import PreparedImage, prepare_image
+from utils.log import get_logger
+
+logger = get_logger("detect")
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+
+@dataclass(frozen=True)
+class VisionImage:
+    """A prepared image, base64-encoded for ``inline_data``."""
+
+    data_b64: str
+    mime_type: str
+    size: int  # encoded image bytes, before base64
+    original_size: int
+
+
+def _original(image: Union[str, BinaryIO]) -> PreparedImage:
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            image = f.read()
+    else:
+        image.seek(0)
+        image = image.read()
+    mime_type = "image/png" if image.startswith(PNG_MAGIC) else "image/jpeg"
+    return PreparedImage(
+        data=image, mime_type=mime_type, width=0, height=0, original_size=len(image)
+    )
+
+
+class VisionImageCache:
+    def __init__(self, max_bytes: int = VISION_IMAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._memory: "OrderedDict[str, VisionImage]" = OrderedDict()
+        self._bytes = 0
+        self.counters: Counter = Counter()
+
+    def _remember(self, image_sha256: str, image: VisionImage) -> None:
+        if len(image.data_b64) > self.max_bytes:
+            return
+        previous = self._memory.pop(image_sha256, None)
+        if previous is not None:
+            self._bytes -= len(previous.data_b64)
+        self._memory[image_sha256] = image
+        self._bytes += len(image.data_b64)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._bytes -= len(evicted.data_b64)
+            self.counters["evictions"] += 1
+
+    def _prepare(self, image: Union[str, BinaryIO]) -> VisionImage:
+        """Blocking decode/resize/encode/base64; runs on a worker thread."""
+        try:
+            prepared = prepare_image(
+                image,
+                max_edge=VISION_IMAGE_MAX_EDGE,
+                fmt=VISION_IMAGE_FORMAT,
+                quality=VISION_IMAGE_QUALITY,
+                crop=VISION_IMAGE_CROP,
+            )
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            self.counters["prepare_failed"] += 1
+            logger.warning(
+                "Could not prepare scan for vision, sending it as stored: %s", e
+            )
+            prepared = _original(image)
+        logger.debug(
+            "Prepared scan for vision: %d -> %d bytes (%dx%d)",
+            prepared.original_size,
+            len(prepared.data),
+            prepared.width,
+            prepared.height,
+            extra={
+                "original_bytes": prepared.original_size,
+                "sent_bytes": len(prepared.data),
+            },
+        )
+        return VisionImage(
+            data_b64=base64.b64encode(prepared.data).decode("ascii"),
+            mime_type=prepared.mime_type,
+            size=len(prepared.data),
+            original_size=prepared.original_size,
+        )
+
+    async def get(
+        self,
+        image_path: str,
+        image_sha256: Optional[str] = None,
+        image_view: Optional[BinaryIO] = None,
+    ) -> VisionImage:
+        """
+        The vision-ready image for a scan, from ``image_view`` (the caller's
+        memory map of the stored file) when given, else the file itself;
+        cached when ``image_sha256`` is given.
+        """
+        if image_sha256:
+            image = self._memory.get(image_sha256)
+            if image is not None:
+                self._memory.move_to_end(image_sha256)
+                self.counters["hit"] += 1
+                metrics.LLM_CACHE_LOOKUPS.labels("vision_image", "memory_hit").inc()
+                return image
+            self.counters["miss"] += 1
+            metrics.LLM_CACHE_LOOKUPS.labels("vision_image", "miss").inc()
+
+        image = await asyncio.to_thread(
+            self._prepare, image_view if image_view is not None else image_path
+        )
+        metrics.VISION_IMAGE_BYTES.labels("original").observe(image.original_size)
+        metrics.VISION_IMAGE_BYTES.labels("sent").observe(image.size)
+        if image_sha256:
+            self._remember(image_sha256, image)
+        return image
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._memory),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            **self.counters,
+        }
+
+
+vision_images = VisionImageCache()
@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from services import circuit_breaker, llm_gateway
+from services.circuit_breaker import (
+    CLOSED,
+    GEMINI_TEXT,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+)
+from services.key_pool import KeyPool
+from services.llm_gateway import CircuitOpenError, generate_content
+from services.retry_policy import RetryPolicy
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Manual monotonic clock for the breaker module."""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(
+        circuit_breaker, "time", SimpleNamespace(monotonic=lambda: now.value)
+    )
+    return now
+
+
+def opened(threshold=3, open_seconds=30, probes=1):
+    breaker = CircuitBreaker("test", threshold, open_seconds, probes)
+    for _ in range(threshold):
+        assert breaker.allow()
+        breaker.record(503)
+    return breaker
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    breaker.record(None)
+    breaker.record(429)
+    breaker.record(200)  # a success resets the run
+    breaker.record(500)
+    breaker.record(502)
+    assert breaker.state == CLOSED
+    breaker.record(None)
+    assert breaker.state == OPEN
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_client_errors_do_not_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    for status in (400, 404, 400):
+        breaker.record(status)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["consecutive_failures"] == 0
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = opened(open_seconds=30)
+    clock.value += 29
+    assert not breaker.allow()
+    clock.value += 1
+    assert not breaker.is_open()
+    assert breaker.allow()  # the probe
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record(200)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = opened(open_seconds=30, probes=2)
+    clock.value += 30
+    assert breaker.allow() and breaker.allow()
+    assert not breaker.allow()
+    breaker.record(503)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["opened"] == 2
+
+
+def test_abandoned_probe_frees_its_slot(clock):
+    breaker = opened(open_seconds=30)
+    clock.value += 30
+    assert breaker.allow()  # probe whose caller never reports back
+    clock.value += 10
+    assert not breaker.allow()
+    clock.value += 20
+    assert breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast_without_calling_gemini(clock, monkeypatch):
+    calls = []
+
+    async def gemini_generate(payload, api_key, model=None, timeout=60.0):
+        calls.append(payload)
+        return httpx.Response(503, json={"error": {"code": 503}})
+
+    breaker = CircuitBreaker(GEMINI_TEXT, failure_threshold=2, open_seconds=30)
+    monkeypatch.setitem(circuit_breaker.breakers, GEMINI_TEXT, breaker)
+    monkeypatch.setattr(llm_gateway, "gemini_generate", gemini_generate)
+    monkeypatch.setattr(llm_gateway, "key_pool", KeyPool(["AIza-pool-key"]))
+    payload = {"contents": [{"role": "user", "parts": [{"text": "hi"}]}]}
+    once = RetryPolicy(max_attempts=1)
+
+    for _ in range(2):
+        with pytest.raises(llm_gateway.LLMError) as excinfo:
+            await generate_content(payload, policy=once)
+        assert excinfo.value.status_code == 503
+    assert breaker.state == OPEN and len(calls) == 2
+
+    with pytest.raises(CircuitOpenError):
+        await generate_content(payload, policy=once)
+    assert len(calls) == 2
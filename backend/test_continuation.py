@@ -0,0 +1,165 @@
+import json
+
+import httpx
+import pytest
+
+from services import llm_gateway
+from services.key_pool import KeyPool
+from services.llm_cache import LLMCache
+from services.llm_gateway import (
+    CONTINUE_PROMPT,
+    LLMError,
+    continuation_payload,
+    extract_text,
+    generate_content,
+    stitch_continuation,
+    stream_generate_content,
+)
+
+PAYLOAD = {
+    "contents": [{"role": "user", "parts": [{"text": "Notes on optics"}]}],
+    "generationConfig": {
+        "maxOutputTokens": 64,
+        "response_mime_type": "application/json",
+    },
+}
+
+
+def response(text, finish="STOP"):
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}]}, "finishReason": finish}]
+    }
+
+
+def test_stitch_drops_repeated_overlap_and_fences():
+    assert stitch_continuation('{"a": "lig', 'ght bends"}') == '{"a": "light bends"}'
+    assert (
+        stitch_continuation('{"a": "light', '"a": "light bends"}')
+        == '{"a": "light bends"}'
+    )
+    assert stitch_continuation('{"a": ', '```json\n"b"}') == '{"a": "b"}'
+    assert stitch_continuation("abc", "def") == "abcdef"
+
+
+def test_continuation_payload_resumes_the_partial_output():
+    payload = continuation_payload(PAYLOAD, '{"a": "lig')
+    roles = [c["role"] for c in payload["contents"]]
+    assert roles == ["user", "model", "user"]
+    assert payload["contents"][1]["parts"][0]["text"] == '{"a": "lig'
+    assert payload["contents"][2]["parts"][0]["text"] == CONTINUE_PROMPT
+    # JSON mode would restart the document
+    assert "response_mime_type" not in payload["generationConfig"]
+    assert PAYLOAD["generationConfig"]["response_mime_type"] == "application/json"
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Fake Gemini answering generate and stream calls from ``replies`` in order."""
+    replies, calls = [], []
+
+    async def gemini_generate(payload, api_key, model=None, timeout=60.0):
+        calls.append(payload)
+        reply = replies.pop(0)
+        if isinstance(reply, int):
+            return httpx.Response(reply, json={"error": {"code": reply}})
+        return httpx.Response(200, json=reply)
+
+    def stream(request):
+        calls.append(json.loads(request.content))
+        text, finish = replies.pop(0)
+        pieces = [text[i : i + 5] for i in range(0, len(text), 5)]
+        chunks = [
+            response(p, finish if i == len(pieces) - 1 else None)
+            for i, p in enumerate(pieces)
+        ]
+        body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks)
+        return httpx.Response(200, content=body.encode())
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(stream))
+    monkeypatch.setattr(llm_gateway, "gemini_generate", gemini_generate)
+    monkeypatch.setattr(llm_gateway, "get_client", lambda: client)
+    monkeypatch.setattr(llm_gateway, "llm_cache", LLMCache())
+    monkeypatch.setattr(llm_gateway, "key_pool", KeyPool(["AIza-pool-key"]))
+    return replies, calls
+
+
+@pytest.mark.asyncio
+async def test_max_tokens_output_is_continued(gemini):
+    replies, calls = gemini
+    replies.extend(
+        [
+            response('{"summary": "Light travels in str', "MAX_TOKENS"),
+            response('travels in straight lines"}'),
+        ]
+    )
+    data = await generate_content(PAYLOAD, max_continuations=2, cache_ttl=60)
+    assert extract_text(data) == '{"summary": "Light travels in straight lines"}'
+    assert data["continuations"] == 1
+    assert len(calls) == 2
+    assert calls[1]["contents"][-1]["parts"][0]["text"] == CONTINUE_PROMPT
+
+    # The stitched document is cached like any complete answer
+    cached = await generate_content(PAYLOAD, cache_ttl=60)
+    assert extract_text(cached) == extract_text(data)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_continuations_are_capped(gemini):
+    replies, calls = gemini
+    for part in ("alpha ", "beta ", "gamma "):
+        replies.append(response(part, "MAX_TOKENS"))
+    data = await generate_content(PAYLOAD, max_continuations=2, cache_ttl=60)
+    assert extract_text(data) == "alpha beta gamma "
+    assert data["continuations"] == 2
+    assert len(calls) == 3
+    # Still truncated, so not cached
+    assert llm_gateway.llm_cache.stats()["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_continuation_returns_the_partial_output(gemini):
+    replies, _ = gemini
+    replies.extend([response('{"summary": "Li', "MAX_TOKENS"), 400])
+    data = await generate_content(PAYLOAD, max_continuations=1)
+    assert extract_text(data) == '{"summary": "Li'
+
+
+@pytest.mark.asyncio
+async def test_without_continuations_truncated_output_is_returned(gemini):
+    replies, calls = gemini
+    replies.append(response('{"summary": "Li', "MAX_TOKENS"))
+    data = await generate_content(PAYLOAD)
+    assert extract_text(data) == '{"summary": "Li'
+    assert "continuations" not in data
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_continues_seamlessly(gemini):
+    replies, calls = gemini
+    replies.extend(
+        [
+            ('{"summary": "Light travels in str', "MAX_TOKENS"),
+            ('travels in straight lines"}', "STOP"),
+        ]
+    )
+    deltas = [
+        d
+        async for d in stream_generate_content(
+            PAYLOAD, max_continuations=1, cache_ttl=60
+        )
+    ]
+    assert "".join(deltas) == '{"summary": "Light travels in straight lines"}'
+    assert len(calls) == 2
+
+    # Replayed from the cache in one piece
+    cached = [d async for d in stream_generate_content(PAYLOAD, cache_ttl=60)]
+    assert cached == ['{"summary": "Light travels in straight lines"}']
+
+
+@pytest.mark.asyncio
+async def test_missing_key_is_an_llm_error(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "key_pool", KeyPool([]))
+    with pytest.raises(LLMError):
+        await generate_content(PAYLOAD, api_key="not-a-gemini-key")
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from services import ai_detector, deadline, llm_gateway
+
+OCR_TEXT = "Find the velocity of the car after 5 seconds of constant acceleration"
+
+
+@pytest.fixture
+def gemini_calls(monkeypatch):
+    """Fake Gemini that hangs for the whole timeout it is given, then times out."""
+    calls = []
+
+    async def hang(payload, api_key, model=None, timeout=60.0):
+        calls.append((time.monotonic(), timeout))
+        await asyncio.sleep(timeout)
+        raise httpx.ReadTimeout("upstream too slow")
+
+    monkeypatch.setattr(llm_gateway, "gemini_generate", hang)
+    return calls
+
+
+def test_nested_deadline_keeps_the_earlier_one():
+    assert deadline.remaining() is None
+    with deadline.request_deadline(10):
+        with deadline.request_deadline(60):
+            assert deadline.remaining() <= 10
+        with deadline.request_deadline(1):
+            assert deadline.remaining() <= 1
+    assert deadline.remaining() is None
+
+
+def test_cap_timeout_shrinks_to_the_budget():
+    assert deadline.cap_timeout(30) == 30
+    with deadline.request_deadline(2):
+        assert deadline.cap_timeout(30) <= 2
+        assert deadline.cap_timeout(1) == 1
+    with deadline.request_deadline(0.01):
+        time.sleep(0.02)
+        assert deadline.expired()
+        assert deadline.cap_timeout(30) == 0.1
+
+
+def test_extend_deadline():
+    with deadline.extend_deadline(5):
+        assert deadline.remaining() is None
+    with deadline.request_deadline(1):
+        with deadline.extend_deadline(5):
+            assert 5 < deadline.remaining() <= 6
+        assert deadline.remaining() <= 1
+
+
+@pytest.mark.asyncio
+async def test_within_deadline_returns_default_once_expired():
+    async def slow():
+        await asyncio.sleep(1)
+        return "late"
+
+    assert await deadline.within_deadline(asyncio.sleep(0, "now"), "default") == "now"
+    with deadline.request_deadline(0.05):
+        assert await deadline.within_deadline(slow(), "default") == "default"
+
+
+@pytest.mark.asyncio
+async def test_short_budget_skips_gemini(gemini_calls, monkeypatch):
+    monkeypatch.setattr(ai_detector, "SCAN_DETECT_GRACE_SECONDS", 0)
+    with deadline.request_deadline(ai_detector.TEXT_MIN_BUDGET / 2):
+        topic, _ = await ai_detector.detect_topic(OCR_TEXT, api_key="AIza-test")
+    assert topic == "Kinematics"
+    assert gemini_calls == []
+
+
+@pytest.mark.asyncio
+async def test_expired_budget_stops_the_shared_detection(gemini_calls, monkeypatch):
+    monkeypatch.setattr(ai_detector, "TEXT_MIN_BUDGET", 0)
+    monkeypatch.setattr(ai_detector, "SCAN_DETECT_GRACE_SECONDS", 0.2)
+    started = time.monotonic()
+    with deadline.request_deadline(0.3):
+        topic, _ = await ai_detector.detect_topic(OCR_TEXT, api_key="AIza-test")
+    assert topic == "Kinematics"  # keyword fallback at the request's deadline
+    assert time.monotonic() - started < 0.45
+
+    # The flight gets the grace period, then stops instead of running its
+    # 30s timeout and retries in the background
+    await asyncio.sleep(0.5)
+    assert ai_detector.detect_flights.stats()["in_flight"] == 0
+    assert gemini_calls
+    for called_at, timeout in gemini_calls:
+        assert called_at - started < 0.5
+        assert timeout <= 0.5
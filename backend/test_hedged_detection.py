@@ -0,0 +1,126 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from services import ai_detector, circuit_breaker
+from services.ai_detector import _hedge_reason, _hedged_detection
+from services.circuit_breaker import GEMINI_VISION, CircuitBreaker
+
+STRONG_TEXT = (
+    "A car starts from rest with constant acceleration. Find its velocity and "
+    "displacement after 5 seconds using the equations of motion."
+)
+
+
+def test_hedge_reason():
+    assert _hedge_reason("v = u + at") == "short_ocr"
+    assert _hedge_reason("=+-*/ 12 34 56 78 90 " * 6) == "noisy_ocr"
+    assert _hedge_reason("The quick brown fox jumps over the lazy dog. " * 3) == (
+        "weak_keywords"
+    )
+    assert _hedge_reason(STRONG_TEXT) is None
+
+
+class Side:
+    """Fake Gemini detection for one side of the race."""
+
+    def __init__(self, topic, delay=0.0, error=None):
+        self.topic, self.delay, self.error = topic, delay, error
+        self.started = self.cancelled = False
+
+    async def __call__(self, *args, **kwargs):
+        self.started = True
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return self.topic, ["v"]
+
+
+@pytest.fixture
+def race(monkeypatch):
+    counts = Counter()
+    monkeypatch.setattr(ai_detector, "HEDGE_COUNTS", counts)
+
+    def setup(text, vision, delay=0.0):
+        monkeypatch.setattr(ai_detector, "_query_gemini_text", text)
+        monkeypatch.setattr(ai_detector, "_query_gemini_vision", vision)
+        monkeypatch.setattr(ai_detector, "DETECT_HEDGE_DELAY", delay)
+        return _hedged_detection("AIza-test", "v = u + at", "scan.png")
+
+    return setup, counts
+
+
+@pytest.mark.asyncio
+async def test_fast_confident_text_cancels_vision(race):
+    setup, counts = race
+    text, vision = Side("Kinematics", 0.01), Side("Optics", 1)
+    assert await setup(text, vision) == ("Kinematics", ["v"])
+    await asyncio.sleep(0)  # let the cancelled call unwind
+    assert vision.cancelled
+    assert counts["text_won"] == 1 and counts["vision_cancelled"] == 1
+
+
+@pytest.mark.asyncio
+async def test_vision_wins_when_text_is_not_confident(race):
+    setup, counts = race
+    text, vision = Side("General Science", 0.01), Side("Optics", 0.05)
+    assert await setup(text, vision) == ("Optics", ["v"])
+    assert counts["vision_won"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failing_side_does_not_stop_the_other(race):
+    setup, _ = race
+    text = Side("Kinematics", error=RuntimeError("502"))
+    assert await setup(text, Side("Optics", 0.02)) == ("Optics", ["v"])
+
+
+@pytest.mark.asyncio
+async def test_no_confident_answer_keeps_the_best_one(race):
+    setup, counts = race
+    text, vision = Side("General Science", 0.01), Side("Unknown", 0.02)
+    assert await setup(text, vision) == ("General Science", ["v"])
+    assert counts["no_confident_answer"] == 1
+
+
+@pytest.mark.asyncio
+async def test_hedge_delay_spares_the_vision_call(race):
+    setup, _ = race
+    text, vision = Side("Kinematics", 0.01), Side("Optics")
+    assert await setup(text, vision, delay=0.5) == ("Kinematics", ["v"])
+    assert not vision.started
+
+    # Text too slow: vision starts once the delay has passed, and wins
+    text, vision = Side("Kinematics", 1), Side("Optics")
+    assert await setup(text, vision, delay=0.02) == ("Optics", ["v"])
+    await asyncio.sleep(0)
+    assert vision.started and text.cancelled
+
+
+@pytest.mark.asyncio
+async def test_only_borderline_scans_are_hedged(race, monkeypatch):
+    setup, counts = race
+    monkeypatch.setattr(ai_detector, "llm_available", lambda api_key: True)
+    monkeypatch.setattr(ai_detector, "DETECT_HEDGE_ENABLED", True)
+    monkeypatch.setattr(ai_detector, "_query_gemini_text", Side("Kinematics", 0.01))
+    monkeypatch.setattr(ai_detector, "_query_gemini_vision", Side("Optics"))
+
+    result = await ai_detector._detect_topic(STRONG_TEXT, "scan.png", "AIza-test")
+    assert result == ("Kinematics", ["v"], True)
+    assert counts["hedged"] == 0
+
+    result = await ai_detector._detect_topic("v = u + at", "scan.png", "AIza-test")
+    assert result == ("Optics", ["v"], True)  # vision answered first
+    assert counts["hedged"] == 1 and counts["reason:short_ocr"] == 1
+
+    # Vision circuit open: no race, text alone
+    broken = CircuitBreaker(GEMINI_VISION, failure_threshold=1, open_seconds=60)
+    broken.record_failure()
+    monkeypatch.setitem(circuit_breaker.breakers, GEMINI_VISION, broken)
+    await ai_detector._detect_topic("v = u + at", "scan.png", "AIza-test")
+    assert counts["hedged"] == 1
@@ -0,0 +1,104 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from utils.image_prep import content_box, prepare_image
+
+EXIF_ORIENTATION = 0x0112
+EXIF_MAKE = 0x010F
+
+
+def page_on_desk(width=2000, height=1500):
+    """A white page with dark text lines in the middle of a grey desk."""
+    img = Image.new("RGB", (width, height), (90, 90, 90))
+    draw = ImageDraw.Draw(img)
+    page = (width // 4, height // 4, width * 3 // 4, height * 3 // 4)
+    draw.rectangle(page, fill=(250, 250, 250))
+    for i in range(6):
+        top = page[1] + 40 + i * 60
+        draw.rectangle([page[0] + 40, top, page[2] - 40, top + 20], fill=(20, 20, 20))
+    return img, page
+
+
+def jpeg(img, **save_args):
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=95, **save_args)
+    return out.getvalue()
+
+
+def test_content_box_finds_the_page():
+    img, (left, top, right, bottom) = page_on_desk()
+    box = content_box(img)
+    assert box is not None
+    # The box hugs the page, within the probe's resolution plus the margin
+    slack = 40
+    assert abs(box[0] - left) < slack and abs(box[1] - top) < slack
+    assert abs(box[2] - right) < slack and abs(box[3] - bottom) < slack
+
+
+def test_content_box_keeps_images_without_a_border():
+    assert content_box(Image.new("RGB", (800, 600), "white")) is None
+    # Content running to the edges: cropping would save nothing
+    stripes = Image.new("RGB", (800, 600), "white")
+    draw = ImageDraw.Draw(stripes)
+    for x in range(0, 800, 40):
+        draw.rectangle([x, 0, x + 19, 599], fill="black")
+    assert content_box(stripes) is None
+
+
+def test_prepare_crops_and_downscales():
+    img, _ = page_on_desk()
+    prepared = prepare_image(jpeg(img), max_edge=512)
+    assert prepared.mime_type == "image/jpeg"
+    assert max(prepared.width, prepared.height) <= 512
+    with Image.open(io.BytesIO(prepared.data)) as out:
+        assert out.size == (prepared.width, prepared.height)
+        # Only the thin margin around the page is left of the desk
+        inside = (prepared.width // 20, prepared.height // 20)
+        assert out.getpixel(inside)[0] > 200
+
+
+def test_prepare_never_upscales():
+    small = Image.new("RGB", (300, 200), "white")
+    prepared = prepare_image(jpeg(small), max_edge=1536, crop=False)
+    assert (prepared.width, prepared.height) == (300, 200)
+
+
+def test_prepare_applies_orientation_and_strips_metadata():
+    img, _ = page_on_desk(1200, 900)
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6  # stored sideways: rotate 90 degrees to view
+    exif[EXIF_MAKE] = "PhoneMaker"
+    data = jpeg(img, exif=exif.tobytes(), icc_profile=b"\0" * 128)
+
+    with Image.open(io.BytesIO(data)) as original:
+        assert original.getexif()[EXIF_MAKE] == "PhoneMaker"
+
+    prepared = prepare_image(data, max_edge=600, crop=False)
+    assert prepared.original_size == len(data)
+    assert prepared.height > prepared.width  # upright portrait
+    with Image.open(io.BytesIO(prepared.data)) as out:
+        assert not out.getexif()
+        assert "icc_profile" not in out.info
+        assert "exif" not in out.info
+
+
+def test_prepare_accepts_paths_and_file_objects(tmp_path):
+    img, _ = page_on_desk(800, 600)
+    data = jpeg(img)
+    path = tmp_path / "scan.jpg"
+    path.write_bytes(data)
+    from_path = prepare_image(str(path), max_edge=256)
+    from_file = prepare_image(io.BytesIO(data), max_edge=256)
+    assert from_path == from_file
+    assert from_file.original_size == len(data)
+
+
+def test_prepare_webp_and_bad_input():
+    img, _ = page_on_desk(800, 600)
+    assert prepare_image(jpeg(img), fmt="webp").mime_type == "image/webp"
+    with pytest.raises(ValueError):
+        prepare_image(jpeg(img), fmt="gif")
+    with pytest.raises(OSError):
+        prepare_image(b"not an image")
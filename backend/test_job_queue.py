@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from services import job_queue
+from services.job_queue import JOB_HANDLERS, JobWorker
+
+
+def job(job_id, kind="quiz", attempts=1):
+    return {
+        "_id": job_id,
+        "kind": kind,
+        "attempts": attempts,
+        "max_attempts": 3,
+        "user_id": "u1",
+        "params": {},
+    }
+
+
+def test_kinds_default_to_every_handler():
+    assert JobWorker().kinds == list(JOB_HANDLERS)
+    assert JobWorker(kinds=["quiz"]).kinds == ["quiz"]
+
+
+@pytest.mark.parametrize("kinds", [[], ["quizz"], ["quiz", "video"]])
+def test_unknown_or_empty_kinds_are_rejected(kinds):
+    with pytest.raises(ValueError):
+        JobWorker(kinds=kinds)
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """Queue of jobs to claim, and the outcomes the worker records."""
+    pending = [job("j1"), job("j2")]
+    outcomes = []
+
+    async def claim_job(worker_id, kinds, lease_seconds):
+        return pending.pop(0) if pending else None
+
+    async def complete_job(job_id, worker_id, result, retention_seconds):
+        if job_id == "j1":
+            raise RuntimeError("mongo went away")
+        outcomes.append(("done", job_id, result))
+        return True
+
+    async def fail_job(job_id, worker_id, error, retry_delay, retention_seconds):
+        outcomes.append(("failed", job_id, error, retry_delay))
+        return True
+
+    async def fail_abandoned_jobs(retention_seconds):
+        return 0
+
+    for fn in (claim_job, complete_job, fail_job, fail_abandoned_jobs):
+        monkeypatch.setattr(job_queue, fn.__name__, fn)
+    return pending, outcomes
+
+
+async def run_until_idle(worker, outcomes, count):
+    worker.start()
+    for _ in range(100):
+        if len(outcomes) >= count:
+            break
+        await asyncio.sleep(0.01)
+    await worker.stop()
+
+
+@pytest.mark.asyncio
+async def test_loop_survives_errors_recording_an_outcome(queue, monkeypatch):
+    pending, outcomes = queue
+
+    async def handler(params, user_id):
+        return {"ok": True}
+
+    monkeypatch.setitem(JOB_HANDLERS, "quiz", handler)
+    worker = JobWorker(concurrency=1, poll_interval=0.01)
+    await run_until_idle(worker, outcomes, 1)
+    assert outcomes == [("done", "j2", {"ok": True})]
+    assert worker.counters["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_job_is_retried_with_backoff(queue, monkeypatch):
+    pending, outcomes = queue
+    pending[:] = [job("j3", attempts=2)]
+
+    async def handler(params, user_id):
+        raise job_queue.JobError("fallback quiz")
+
+    monkeypatch.setitem(JOB_HANDLERS, "quiz", handler)
+    await run_until_idle(JobWorker(concurrency=1, poll_interval=0.01), outcomes, 1)
+    assert outcomes == [("failed", "j3", "fallback quiz", 10.0)]
@@ -0,0 +1,178 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import jobs_model
+from database.jobs_model import (
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    claim_job,
+    fail_abandoned_jobs,
+)
+
+
+class UpdateResult:
+    def __init__(self, modified_count):
+        self.modified_count = modified_count
+
+
+class FakeJobs:
+    """In-memory stand-in for the jobs collection, covering the queries jobs_model issues."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    @staticmethod
+    def _value(doc, operand):
+        return (
+            doc.get(operand[1:])
+            if isinstance(operand, str) and operand.startswith("$")
+            else operand
+        )
+
+    def _matches(self, doc, query):
+        for field, condition in query.items():
+            if field == "$or":
+                if not any(self._matches(doc, branch) for branch in condition):
+                    return False
+            elif field == "$expr":
+                ((op, (left, right)),) = condition.items()
+                if not self._compare(
+                    op, self._value(doc, left), self._value(doc, right)
+                ):
+                    return False
+            elif isinstance(condition, dict):
+                if not all(
+                    self._compare(op, doc.get(field), arg)
+                    for op, arg in condition.items()
+                ):
+                    return False
+            elif doc.get(field) != condition:
+                return False
+        return True
+
+    @staticmethod
+    def _compare(op, value, arg):
+        if op == "$in":
+            return value in arg
+        if value is None:
+            return False
+        return {"$lt": value < arg, "$lte": value <= arg, "$gte": value >= arg}[op]
+
+    @staticmethod
+    def _apply(doc, update):
+        doc.update(update.get("$set", {}))
+        for field, amount in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + amount
+
+    async def find_one_and_update(self, query, update, sort, return_document):
+        ((field, _),) = sort
+        for doc in sorted(self.docs, key=lambda d: d[field]):
+            if self._matches(doc, query):
+                self._apply(doc, update)
+                return dict(doc)
+        return None
+
+    async def update_many(self, query, update):
+        matched = [doc for doc in self.docs if self._matches(doc, query)]
+        for doc in matched:
+            self._apply(doc, update)
+        return UpdateResult(len(matched))
+
+
+NOW = datetime.utcnow()
+
+
+def job(job_id, minutes_ago=10, **fields):
+    doc = {
+        "_id": job_id,
+        "kind": "notes",
+        "status": JOB_QUEUED,
+        "attempts": 0,
+        "max_attempts": 3,
+        "available_at": NOW - timedelta(minutes=1),
+        "lease_owner": None,
+        "lease_expires_at": None,
+        "created_at": NOW - timedelta(minutes=minutes_ago),
+    }
+    doc.update(fields)
+    return doc
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    collection = FakeJobs([])
+    monkeypatch.setattr(jobs_model, "jobs_collection", collection)
+    return collection.docs
+
+
+@pytest.mark.asyncio
+async def test_claims_oldest_runnable_job(jobs):
+    jobs += [
+        job("new", minutes_ago=1),
+        job("old", minutes_ago=5),
+        job("other", minutes_ago=9, kind="image"),
+    ]
+    claimed = await claim_job("w1", ["notes"], lease_seconds=60)
+    assert claimed["_id"] == "old"
+    assert claimed["status"] == JOB_RUNNING
+    assert claimed["lease_owner"] == "w1"
+    assert claimed["attempts"] == 1
+    assert claimed["lease_expires_at"] > datetime.utcnow()
+
+
+@pytest.mark.asyncio
+async def test_skips_queued_job_still_waiting_to_retry(jobs):
+    jobs.append(job("later", available_at=NOW + timedelta(minutes=5)))
+    assert await claim_job("w1", ["notes"], lease_seconds=60) is None
+
+
+@pytest.mark.asyncio
+async def test_live_lease_is_not_taken_over(jobs):
+    jobs.append(
+        job(
+            "busy",
+            status=JOB_RUNNING,
+            attempts=1,
+            lease_owner="w1",
+            lease_expires_at=NOW + timedelta(minutes=1),
+        )
+    )
+    assert await claim_job("w2", ["notes"], lease_seconds=60) is None
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_reclaimed_while_attempts_remain(jobs):
+    jobs.append(
+        job(
+            "stuck",
+            status=JOB_RUNNING,
+            attempts=2,
+            lease_owner="w1",
+            lease_expires_at=NOW - timedelta(seconds=1),
+        )
+    )
+    claimed = await claim_job("w2", ["notes"], lease_seconds=60)
+    assert claimed["_id"] == "stuck"
+    assert claimed["lease_owner"] == "w2"
+    assert claimed["attempts"] == 3
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_on_last_attempt_is_failed_not_reclaimed(jobs):
+    jobs.append(
+        job(
+            "dead",
+            status=JOB_RUNNING,
+            attempts=3,
+            lease_owner="w1",
+            lease_expires_at=NOW - timedelta(seconds=1),
+        )
+    )
+    assert await claim_job("w2", ["notes"], lease_seconds=60) is None
+
+    assert await fail_abandoned_jobs(retention_seconds=3600) == 1
+    assert jobs[0]["status"] == JOB_FAILED
+    assert jobs[0]["lease_owner"] is None
+    assert jobs[0]["attempts"] == 3
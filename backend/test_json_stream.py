@@ -0,0 +1,74 @@
+from typing import List
+
+import pytest
+from pydantic import BaseModel
+
+from utils.json_stream import (
+    JSONExtractor,
+    StringFieldStream,
+    TopLevelObjectStream,
+    extract_json,
+    parse_model,
+)
+
+
+class Notes(BaseModel):
+    title: str
+    points: List[str]
+
+
+def test_extract_json_skips_prose_and_fences():
+    assert extract_json('Here {x} is:\n```json\n{"a": 1}\n```') == {"a": 1}
+    assert extract_json("no json here") is None
+    assert extract_json("") is None
+
+
+@pytest.mark.parametrize(
+    "truncated, repaired",
+    [
+        (
+            '```json\n{"title": "Kinematics", "points": ["a", "b',
+            {"title": "Kinematics", "points": ["a", "b"]},
+        ),
+        ('{"a": 1, "b": {"c": 2, "d"', {"a": 1, "b": {"c": 2}}),
+        ('{"a": [1, 2,', {"a": [1, 2]}),
+        ('{"a": 1, "b": tr', {"a": 1}),
+        ('{"m": "caf\\u00', {"m": "caf"}),
+    ],
+)
+def test_extract_json_repairs_truncated_output(truncated, repaired):
+    assert extract_json(truncated) == repaired
+    assert extract_json(truncated, repair=False) is None
+
+
+def test_extractor_gives_same_value_however_chunked():
+    text = 'Sure! {"q": "a \\"quoted\\" {brace}", "n": [1, {"x": 2}]} trailing'
+    for size in (1, 3, 7, len(text)):
+        extractor = JSONExtractor()
+        for i in range(0, len(text), size):
+            extractor.feed(text[i : i + size])
+        assert extractor.done
+        assert extractor.value == {"q": 'a "quoted" {brace}', "n": [1, {"x": 2}]}
+
+
+def test_parse_model_validates_repaired_json():
+    notes = parse_model('{"title": "Waves", "points": ["amplitude", "freq', Notes)
+    assert notes == Notes(title="Waves", points=["amplitude", "freq"])
+    assert parse_model('{"title": "Waves"}', Notes) is None
+
+
+def test_top_level_object_stream_yields_completed_members():
+    stream = TopLevelObjectStream()
+    assert stream.feed('```json\n{"a": 1, "b"') == [("a", 1)]
+    assert stream.feed(': [1, {"x": ",}"}], "c": "d"}') == [
+        ("b", [1, {"x": ",}"}]),
+        ("c", "d"),
+    ]
+    assert stream.done
+
+
+def test_string_field_stream_holds_back_split_escapes():
+    stream = StringFieldStream("message")
+    chunks = ['{"type": "chat", "mess', 'age": "caf\\u00', 'e9 \\"ok\\"', '", "x": 1}']
+    assert "".join(stream.feed(chunk) for chunk in chunks) == 'café "ok"'
+    assert stream.finished
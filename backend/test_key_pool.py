@@ -0,0 +1,77 @@
+import pytest
+
+from services import key_pool as key_pool_module
+from services.key_pool import KeyPool
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.monotonic for the pool; advance with ``clock[0] += s``."""
+    now = [1000.0]
+    monkeypatch.setattr(key_pool_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_picks_least_loaded_key(clock):
+    pool = KeyPool(["key-a", "key-b"])
+    first = pool.acquire()
+    second = pool.acquire()
+    assert {first, second} == {"key-a", "key-b"}
+
+
+def test_rate_limited_key_cools_down(clock):
+    pool = KeyPool(["key-a", "key-b"], rate_limit_cooldown=30)
+    assert pool.acquire() == "key-a"
+    pool.release("key-a", 429)
+    for _ in range(3):
+        key = pool.acquire()
+        assert key == "key-b"
+        pool.release(key, 200)
+
+    clock[0] += 31
+    assert pool.acquire() == "key-a"
+
+
+def test_retry_after_sets_the_cooldown(clock):
+    pool = KeyPool(["key-a", "key-b"], rate_limit_cooldown=30)
+    pool.acquire()
+    pool.release("key-a", 429, retry_after=5)
+    assert pool.stats()[0]["cooldown_remaining"] == 5
+    clock[0] += 4
+    assert pool.acquire() == "key-b"
+    pool.release("key-b", 200)
+    clock[0] += 2
+    assert pool.stats()[0]["cooldown_remaining"] == 0
+
+
+def test_auth_errors_use_the_longer_cooldown(clock):
+    pool = KeyPool(["key-a", "key-b"], rate_limit_cooldown=30, auth_cooldown=600)
+    pool.acquire()
+    pool.release("key-a", 403)
+    clock[0] += 60
+    assert pool.acquire() == "key-b"
+    assert pool.stats()[0]["cooldown_remaining"] == pytest.approx(540)
+
+
+def test_all_cooling_down_returns_soonest_available(clock):
+    pool = KeyPool(["key-a", "key-b"])
+    pool.acquire()
+    pool.release("key-a", 429, retry_after=60)
+    pool.acquire()
+    pool.release("key-b", 429, retry_after=10)
+    assert pool.acquire() == "key-b"
+
+
+def test_exclude_every_key_returns_none(clock):
+    pool = KeyPool(["key-a", "key-b"])
+    assert pool.acquire(exclude=["key-a", "key-b"]) is None
+    assert KeyPool([]).acquire() is None
+
+
+def test_rpm_limit_saturates_a_key(clock):
+    pool = KeyPool(["key-a", "key-b"], rpm_limit=1)
+    pool.release(pool.acquire(exclude=["key-b"]), 200)
+    assert pool.acquire() == "key-b"
+    clock[0] += 61  # the window slides past key-a's request
+    pool.release("key-b", 200)
+    assert pool.acquire() == "key-a"
@@ -0,0 +1,132 @@
+import json
+
+import httpx
+import pytest
+
+from services import llm_gateway
+from services.key_pool import KeyPool
+from services.llm_cache import LLMCache, make_cache_key
+
+PAYLOAD = {
+    "contents": [{"role": "user", "parts": [{"text": "Notes on optics"}]}],
+    "generationConfig": {"temperature": 0.2, "maxOutputTokens": 512},
+}
+
+
+def response(text, finish="STOP"):
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}]}, "finishReason": finish}]
+    }
+
+
+def test_key_covers_what_changes_the_output():
+    reordered = {
+        "generationConfig": {"maxOutputTokens": 512, "temperature": 0.2},
+        "contents": PAYLOAD["contents"],
+    }
+    key = make_cache_key("flash", PAYLOAD)
+    assert make_cache_key("flash", reordered) == key
+    assert make_cache_key("pro", PAYLOAD) != key
+    hotter = {**PAYLOAD, "generationConfig": {"temperature": 0.9}}
+    assert make_cache_key("flash", hotter) != key
+
+
+@pytest.mark.asyncio
+async def test_lru_evicts_the_least_recently_used():
+    cache = LLMCache(max_entries=2)
+    await cache.set("a", response("a"), ttl=60)
+    await cache.set("b", response("b"), ttl=60)
+    assert await cache.get("a")  # a is now the most recent
+    await cache.set("c", response("c"), ttl=60)
+    assert await cache.get("b") is None
+    assert await cache.get("a") and await cache.get("c")
+    assert cache.stats()["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_entries_are_misses():
+    cache = LLMCache()
+    await cache.set("a", response("a"), ttl=-1)
+    assert await cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "llm_cache.sqlite3")
+    await LLMCache(db_path=path).set("a", response("a"), ttl=60)
+    await LLMCache(db_path=path).set("old", response("old"), ttl=-1)
+
+    restarted = LLMCache(db_path=path)
+    assert await restarted.get("a", call_site="notes") == response("a")
+    assert await restarted.get("old") is None
+    assert restarted.stats()["notes:disk_hit"] == 1
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Fake generateContent answering with the queued responses; records every call."""
+    replies, calls = [], []
+
+    async def gemini_generate(payload, api_key, model=None, timeout=60.0):
+        calls.append(payload)
+        return httpx.Response(200, json=replies.pop(0))
+
+    monkeypatch.setattr(llm_gateway, "gemini_generate", gemini_generate)
+    monkeypatch.setattr(llm_gateway, "llm_cache", LLMCache())
+    monkeypatch.setattr(llm_gateway, "key_pool", KeyPool(["AIza-pool-key"]))
+    return replies, calls
+
+
+def parses(text):
+    try:
+        json.loads(text)
+    except ValueError:
+        return False
+    return True
+
+
+async def generate(validate=parses):
+    data = await llm_gateway.generate_content(
+        PAYLOAD, cache_ttl=60, call_site="notes", validate=validate
+    )
+    return llm_gateway.extract_text(data)
+
+
+@pytest.mark.asyncio
+async def test_valid_response_is_served_from_cache(gemini):
+    replies, calls = gemini
+    replies.append(response('{"ok": true}'))
+    assert await generate() == '{"ok": true}'
+    assert await generate() == '{"ok": true}'
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_invalid_response_is_not_cached(gemini):
+    replies, calls = gemini
+    replies.extend([response("Sure! Here are your notes"), response('{"ok": true}')])
+    assert await generate() == "Sure! Here are your notes"
+    assert llm_gateway.llm_cache.stats()["entries"] == 0
+    assert await generate() == '{"ok": true}'
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_truncated_response_is_not_cached(gemini):
+    replies, calls = gemini
+    replies.extend([response('{"ok": tr', "MAX_TOKENS"), response('{"ok": true}')])
+    await generate(validate=None)
+    assert llm_gateway.llm_cache.stats()["entries"] == 0
+    assert await generate(validate=None) == '{"ok": true}'
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_entry_failing_validation_is_regenerated(gemini):
+    replies, calls = gemini
+    replies.extend([response("plain text"), response('{"ok": true}')])
+    assert await generate(validate=None) == "plain text"
+    # A stricter caller does not accept the cached entry
+    assert await generate() == '{"ok": true}'
+    assert len(calls) == 2
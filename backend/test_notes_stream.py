@@ -0,0 +1,143 @@
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from auth import auth_middleware
+from routers import notes as notes_router
+from services import llm_gateway
+from services.ai_notes import is_fallback_notes, stream_notes
+from services.key_pool import KeyPool
+from services.llm_cache import LLMCache
+
+NOTES = {
+    "explanation": "Projectile motion is motion under gravity alone.",
+    "variable_breakdown": ["U: launch speed (m/s)", "g: gravity (m/s^2)"],
+    "formulas": ["R = U^2 sin(2θ) / g"],
+    "example": "U = 20 m/s at 45° gives R ≈ 40.8 m.",
+    "mistakes": ["Using degrees in radians mode"],
+    "practice_questions": ["Find R for U = 10 m/s at 30°."],
+    "summary": "Horizontal and vertical motion are independent.",
+    "resources": [],
+}
+
+
+def sse(*lines):
+    return "".join(f"data: {line}\n\n" for line in lines).encode()
+
+
+def chunk(text, finish=None):
+    candidate = {"content": {"parts": [{"text": text}]}}
+    if finish:
+        candidate["finishReason"] = finish
+    return json.dumps({"candidates": [candidate]})
+
+
+def split(text, size=40):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Fake streamGenerateContent: answers with the SSE body set on ``gemini.body``."""
+
+    class Gemini:
+        body = b""
+        keys = []
+
+    def handler(request):
+        Gemini.keys.append(request.headers["x-goog-api-key"])
+        return httpx.Response(200, content=Gemini.body)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(llm_gateway, "get_client", lambda: client)
+    monkeypatch.setattr(llm_gateway, "llm_cache", LLMCache())
+    monkeypatch.setattr(llm_gateway, "key_pool", KeyPool([]))
+    return Gemini
+
+
+async def collect(**kwargs):
+    return [event async for event in stream_notes("Projectile Motion", ["U"], **kwargs)]
+
+
+@pytest.mark.asyncio
+async def test_sections_stream_before_the_document(gemini):
+    text = json.dumps(NOTES)
+    gemini.body = sse(
+        *(chunk(part) for part in split(text)[:-1]), chunk(split(text)[-1], "STOP")
+    )
+
+    events = await collect(api_key="AIza-user-key")
+    names = [data["name"] for event, data in events if event == "section"]
+    assert names == list(NOTES)
+    assert events[-1][0] == "done"
+    notes = events[-1][1]
+    assert notes.variable_breakdown == {
+        "var_0": "U: launch speed (m/s)",
+        "var_1": "g: gravity (m/s^2)",
+    }
+    assert notes.summary == [NOTES["summary"]]
+    assert gemini.keys == ["AIza-user-key"]
+
+
+@pytest.mark.asyncio
+async def test_key_check_matches_the_gateway(gemini, monkeypatch):
+    # Not a Gemini key (e.g. the Groq fallback the router passes) and no pool
+    events = await collect(api_key="gsk_groq_key")
+    assert [event for event, _ in events] == ["done"]
+    assert is_fallback_notes(events[0][1])
+    assert gemini.keys == []
+
+    # The same key is ignored, not sent, once the pool has a key
+    monkeypatch.setattr(llm_gateway, "key_pool", KeyPool(["AIza-pool-key"]))
+    gemini.body = sse(chunk(json.dumps(NOTES), "STOP"))
+    events = await collect(api_key="gsk_groq_key")
+    assert not is_fallback_notes(events[-1][1])
+    assert gemini.keys == ["AIza-pool-key"]
+
+
+@pytest.mark.asyncio
+async def test_malformed_stream_ends_with_an_error_event(gemini):
+    explanation = json.dumps({"explanation": NOTES["explanation"]})[:-1]
+    gemini.body = sse(chunk(explanation + ', "formulas": '), "{not json")
+
+    events = await collect(api_key="AIza-user-key")
+    assert [event for event, _ in events] == ["section", "error", "done"]
+    assert events[1][1] == {"detail": "The notes stream was malformed."}
+    assert is_fallback_notes(events[-1][1])
+
+
+def parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event[len("event: ") :], json.loads(data[len("data: ") :])))
+    return events
+
+
+def test_endpoint_saves_and_sends_the_document(gemini, monkeypatch):
+    saved = []
+
+    async def save_notes_entry(**entry):
+        saved.append(entry)
+
+    monkeypatch.setattr(notes_router, "save_notes_entry", save_notes_entry)
+    monkeypatch.setattr(auth_middleware, "ALLOW_DEV_AUTH_BYPASS", True)
+    gemini.body = sse(chunk(json.dumps(NOTES), "STOP"))
+
+    app = FastAPI()
+    app.include_router(notes_router.router)
+    response = TestClient(app).post(
+        "/notes/generate/stream",
+        json={"topic": "Projectile Motion", "variables": ["U"]},
+        headers={"Authorization": "Bearer test-token", "X-AI-API-Key": "AIza-user-key"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert [event for event, _ in events] == ["section"] * len(NOTES) + ["done"]
+    assert events[-1][1]["notes"]["explanation"] == NOTES["explanation"]
+    assert saved[0]["user_id"] == "test-user-123"
+    assert saved[0]["notes_payload"] == events[-1][1]["notes"]
@@ -0,0 +1,80 @@
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from utils.phash import MultiIndexHash, dhash, from_hex, hamming, to_hex
+
+
+def flip(code: int, bits: int, rng: random.Random) -> int:
+    for position in rng.sample(range(64), bits):
+        code ^= 1 << position
+    return code
+
+
+def worksheet(width: int, height: int) -> Image.Image:
+    img = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    for i in range(8):
+        top = height * (i + 1) // 10
+        draw.rectangle(
+            [width // 10, top, width * (3 + i % 5) // 10, top + height // 40], fill=0
+        )
+    draw.ellipse(
+        [width // 2, height // 3, width * 9 // 10, height * 2 // 3], outline=0, width=4
+    )
+    return img
+
+
+@pytest.mark.parametrize("radius", [0, 3, 7, 10])
+def test_search_matches_brute_force(radius):
+    rng = random.Random(radius)
+    index = MultiIndexHash()
+    codes = [rng.getrandbits(64) for _ in range(500)]
+    query = codes[0]
+    # Plant neighbours at every distance up to just past the radius
+    codes += [flip(query, bits, rng) for bits in range(radius + 3) for _ in range(3)]
+    for i, code in enumerate(codes):
+        index.add(code, i)
+
+    expected = sorted(
+        (hamming(query, code), i)
+        for i, code in enumerate(codes)
+        if hamming(query, code) <= radius
+    )
+    assert index.search(query, radius) == expected
+
+
+def test_search_orders_nearest_first_and_limits():
+    index = MultiIndexHash()
+    query = 0x0123456789ABCDEF
+    index.add(query ^ 0b111, "three")
+    index.add(query ^ 0b1, "one")
+    index.add(query, "same")
+    index.add(query ^ 0xFFFF, "sixteen")
+    assert index.search(query, 4) == [(0, "same"), (1, "one"), (3, "three")]
+    assert index.search(query, 4, limit=2) == [(0, "same"), (1, "one")]
+    assert len(index) == 4
+
+
+def test_chunks_must_divide_bits():
+    with pytest.raises(ValueError):
+        MultiIndexHash(chunks=5)
+
+
+def test_dhash_is_stable_across_resizing_and_reencoding():
+    original = worksheet(1200, 1600)
+    buffer = io.BytesIO()
+    original.resize((600, 800)).convert("RGB").save(buffer, "JPEG", quality=70)
+
+    assert hamming(dhash(original), dhash(buffer)) <= 4
+    assert (
+        hamming(dhash(original), dhash(original.transpose(Image.Transpose.ROTATE_90)))
+        > 10
+    )
+
+
+def test_hex_round_trip():
+    assert to_hex(0xAB) == "00000000000000ab"
+    assert from_hex(to_hex(2**64 - 1)) == 2**64 - 1
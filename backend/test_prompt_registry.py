@@ -0,0 +1,174 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from services import ai_chat, ai_notes, ai_quiz
+from services.prompt_registry import (
+    EXPIRY_MARGIN,
+    PROMPT_FIELD,
+    PromptRegistry,
+    PromptTemplate,
+    prompt_registry,
+)
+
+SMALL = PromptTemplate("notes", 1, "You write study notes.", "Topic: {topic}")
+LARGE = PromptTemplate("quiz", 1, "Rules. " * 800, "Topic: {topic}")
+
+
+def gemini_client(requests, status=200):
+    """AsyncClient whose cachedContents endpoint records and answers requests."""
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        if status != 200:
+            return httpx.Response(status, text="prefix too small")
+        return httpx.Response(
+            200,
+            json={
+                "name": "cachedContents/abc",
+                "usageMetadata": {"totalTokenCount": 1400},
+            },
+        )
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def settle(registry):
+    await asyncio.gather(*registry._tasks)
+
+
+def test_payload_puts_the_prefix_in_the_system_instruction():
+    payload = SMALL.payload({"temperature": 0.2}, topic="Optics")
+    assert payload["systemInstruction"] == {"parts": [{"text": SMALL.prefix}]}
+    assert payload["contents"][0]["parts"][0]["text"] == "Topic: Optics"
+    assert payload[PROMPT_FIELD] == "notes@v1"
+
+
+def test_changed_prompt_needs_a_version_bump():
+    registry = PromptRegistry(backend="off")
+    registry.register(SMALL)
+    registry.register(SMALL)
+    with pytest.raises(ValueError):
+        registry.register(PromptTemplate("notes", 1, "Different rules.", "{topic}"))
+    registry.register(PromptTemplate("notes", 2, "Different rules.", "{topic}"))
+    assert registry.get("notes").version == 2
+
+
+def test_shipped_templates_are_below_the_cache_minimum():
+    # Why PROMPT_CACHE_BACKEND defaults to off
+    gemini = PromptRegistry(backend="gemini", min_tokens=1024)
+    shipped = [
+        ai_notes.NOTES_SYSTEM_PROMPT,
+        ai_quiz.ADVANCED_QUIZ_PROMPT,
+        ai_chat.VISUALISER_CHAT_PROMPT,
+    ]
+    for template in shipped:
+        assert prompt_registry.get(template.name) is template
+        assert not gemini.eligible(template)
+
+
+@pytest.mark.asyncio
+async def test_off_sends_payloads_inline():
+    registry = PromptRegistry(backend="off")
+    registry.register(SMALL)
+    payload = SMALL.payload({}, topic="Optics")
+    body, handle = await registry.prepare(payload, "key", "flash", client=None)
+    assert handle is None
+    assert PROMPT_FIELD not in body
+    assert body["systemInstruction"] == payload["systemInstruction"]
+    assert registry.stats()["backend"] == "off"
+
+    plain = {"contents": []}
+    assert await registry.prepare(plain, "key", "flash", client=None) == (plain, None)
+
+
+@pytest.mark.asyncio
+async def test_local_backend_counts_the_prefix_as_saved():
+    registry = PromptRegistry(backend="local")
+    registry.register(SMALL)
+    payload = SMALL.payload({}, topic="Optics")
+
+    # First request goes out inline while the cache is created in the background
+    _, handle = await registry.prepare(payload, "key", "flash", client=None)
+    assert handle is None
+    await settle(registry)
+
+    body, handle = await registry.prepare(payload, "key", "flash", client=None)
+    assert handle.local and handle.name.startswith("local/")
+    assert "systemInstruction" in body
+    registry.record_usage(payload, handle, {"usageMetadata": {"promptTokenCount": 30}})
+    stats = registry.stats()["templates"]["notes@v1"]
+    assert stats["tokens_saved"] == handle.tokens
+    assert stats["prompt_tokens"] == 30
+
+
+@pytest.mark.asyncio
+async def test_gemini_skips_prefixes_below_the_minimum():
+    requests = []
+    registry = PromptRegistry(backend="gemini", min_tokens=1024)
+    registry.register(SMALL)
+    async with gemini_client(requests) as client:
+        for _ in range(2):
+            _, handle = await registry.prepare(
+                SMALL.payload({}, topic="Optics"), "key", "flash", client
+            )
+            assert handle is None
+            await settle(registry)
+    assert requests == []
+    assert registry.stats()["templates"]["notes@v1"]["explicit_cache"] is False
+
+
+@pytest.mark.asyncio
+async def test_gemini_references_the_cache_by_name():
+    requests = []
+    registry = PromptRegistry(backend="gemini", ttl=600, min_tokens=1024)
+    registry.register(LARGE)
+    payload = LARGE.payload({}, topic="Optics")
+    async with gemini_client(requests) as client:
+        await registry.prepare(payload, "key", "flash", client)
+        await settle(registry)
+        body, handle = await registry.prepare(payload, "key", "flash", client)
+    assert requests[0]["model"] == "models/flash"
+    assert requests[0]["ttl"] == "600s"
+    assert body["cachedContent"] == "cachedContents/abc"
+    assert "systemInstruction" not in body
+    assert handle.tokens == 1400
+
+    # Evicted upstream: the next request goes inline and recreates the cache
+    registry.invalidate(handle)
+    body, handle = await registry.prepare(payload, "key", "flash", client=None)
+    assert handle is None and "systemInstruction" in body
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_expired_cache_is_not_referenced():
+    # Handles are treated as gone EXPIRY_MARGIN seconds before Gemini drops them
+    registry = PromptRegistry(backend="local", ttl=EXPIRY_MARGIN)
+    registry.register(SMALL)
+    payload = SMALL.payload({}, topic="Optics")
+    await registry.prepare(payload, "key", "flash", client=None)
+    await settle(registry)
+    assert registry.stats()["templates"]["notes@v1"]["caches_created"] == 1
+
+    _, handle = await registry.prepare(payload, "key", "flash", client=None)
+    assert handle is None
+    await settle(registry)
+
+
+@pytest.mark.asyncio
+async def test_rejected_cache_is_not_retried():
+    requests = []
+    registry = PromptRegistry(backend="gemini", min_tokens=1024)
+    registry.register(LARGE)
+    async with gemini_client(requests, status=400) as client:
+        for _ in range(3):
+            _, handle = await registry.prepare(
+                LARGE.payload({}, topic="Optics"), "key", "flash", client
+            )
+            assert handle is None
+            await settle(registry)
+    assert len(requests) == 1
+    assert registry.stats()["templates"]["quiz@v1"]["create_failed"] == 1
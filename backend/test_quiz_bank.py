@@ -0,0 +1,140 @@
+import pytest
+from pymongo.errors import PyMongoError
+
+from services import ai_quiz, quiz_bank
+from services.quiz_bank import QuizBankRefiller
+
+
+def question(i):
+    return {
+        "question": f"Question {i}?",
+        "options": ["a", "b", "c", "d"],
+        "correct_index": 0,
+        "explanation": "Because.",
+    }
+
+
+@pytest.fixture
+def refiller(monkeypatch):
+    refiller = QuizBankRefiller(min_stock=30, target_stock=60, batch_size=15)
+    monkeypatch.setattr(ai_quiz, "QUIZ_BANK_ENABLED", True)
+    monkeypatch.setattr(ai_quiz, "quiz_bank_refiller", refiller)
+    return refiller
+
+
+@pytest.fixture
+def demand_writes(monkeypatch):
+    writes = []
+
+    async def record(demand):
+        writes.append(dict(demand))
+
+    monkeypatch.setattr(quiz_bank, "record_topic_demand", record)
+    return writes
+
+
+def bank_with(monkeypatch, stock):
+    async def count_questions(topic_key, difficulty):
+        return stock
+
+    async def sample_questions(topic_key, difficulty, count):
+        return [question(i) for i in range(min(count, stock))]
+
+    monkeypatch.setattr(ai_quiz, "count_questions", count_questions)
+    monkeypatch.setattr(ai_quiz, "sample_questions", sample_questions)
+
+
+def test_serves_only_well_stocked_topics(refiller):
+    assert not refiller.can_serve(5, 5)
+    assert not refiller.can_serve(29, 5)
+    assert refiller.can_serve(30, 5)
+    assert not refiller.can_serve(30, 20)
+    assert refiller.can_serve(40, 20)
+
+
+@pytest.mark.asyncio
+async def test_just_banked_questions_are_not_served_again(
+    refiller, demand_writes, monkeypatch
+):
+    # One live generation banked exactly the 5 questions it produced
+    bank_with(monkeypatch, stock=5)
+    nudges = []
+    monkeypatch.setattr(refiller, "nudge", lambda: nudges.append(1))
+    assert await ai_quiz._serve_from_bank("Optics", 5, "mixed") is None
+    assert nudges == [1]
+
+
+@pytest.mark.asyncio
+async def test_serves_from_a_stocked_bank_without_writing(
+    refiller, demand_writes, monkeypatch
+):
+    bank_with(monkeypatch, stock=45)
+    for _ in range(3):
+        quiz = await ai_quiz._serve_from_bank(" Optics ", 5, "mixed")
+        assert quiz["topic"] == "Optics"
+        assert len(quiz["questions"]) == 5
+    assert demand_writes == []
+    assert refiller.stats()["pending_demand"] == 1
+
+
+@pytest.mark.asyncio
+async def test_demand_is_flushed_in_one_batch(refiller, demand_writes):
+    for _ in range(3):
+        refiller.record_demand("optics", "Optics", "mixed")
+    refiller.record_demand("optics", "Optics", "hard")
+    await refiller.flush_demand()
+    assert demand_writes == [
+        {("optics", "mixed"): ("Optics", 3), ("optics", "hard"): ("Optics", 1)}
+    ]
+    await refiller.flush_demand()
+    assert demand_writes[-1] == {}
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_the_demand(refiller, monkeypatch):
+    async def down(demand):
+        raise PyMongoError("down")
+
+    monkeypatch.setattr(quiz_bank, "record_topic_demand", down)
+    refiller.record_demand("optics", "Optics", "mixed")
+    with pytest.raises(PyMongoError):
+        await refiller.flush_demand()
+    refiller.record_demand("optics", "Optics", "mixed")
+    assert refiller._demand == {("optics", "mixed"): ("Optics", 2)}
+
+
+@pytest.mark.asyncio
+async def test_refill_tops_low_topics_up_to_target(
+    refiller, demand_writes, monkeypatch
+):
+    stock = {"optics": 10, "waves": 50}
+    generated = []
+
+    async def get_demanded_topics(limit):
+        return [
+            {"topic_key": key, "topic": key.title(), "difficulty": "mixed"}
+            for key in stock
+        ]
+
+    async def count_questions(topic_key, difficulty):
+        return stock[topic_key]
+
+    async def generate(topic, count, difficulty):
+        generated.append((topic, count))
+        return [question(i) for i in range(count)]
+
+    async def insert_questions(topic_key, topic, difficulty, questions):
+        stock[topic_key] += len(questions)
+        return len(questions)
+
+    monkeypatch.setattr(quiz_bank, "get_demanded_topics", get_demanded_topics)
+    monkeypatch.setattr(quiz_bank, "count_questions", count_questions)
+    monkeypatch.setattr(quiz_bank, "insert_questions", insert_questions)
+    monkeypatch.setattr(quiz_bank, "is_open", lambda upstream: False)
+    refiller._generate = generate
+    refiller.record_demand("optics", "Optics", "mixed")
+
+    assert await refiller.refill_once() == 50
+    assert demand_writes == [{("optics", "mixed"): ("Optics", 1)}]
+    assert generated == [("Optics", 15), ("Optics", 15), ("Optics", 15), ("Optics", 5)]
+    assert stock == {"optics": 60, "waves": 50}
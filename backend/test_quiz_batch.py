@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from auth import auth_middleware
+from config import QUIZ_BATCH_MAX_TOPICS
+from routers import quiz_router
+from services import ai_quiz
+from services.ai_quiz import generate_quiz_batch
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    """Fake generate_quiz_with_ai; records calls and the peak concurrency."""
+    calls = []
+    running = {"now": 0, "peak": 0}
+
+    async def generate_quiz_with_ai(
+        topic, num_questions=5, api_key=None, difficulty="mixed"
+    ):
+        calls.append((topic, num_questions, difficulty))
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        if topic == "Broken":
+            raise RuntimeError("unexpected")
+        return {"topic": topic, "questions": [{"question": "?"}] * num_questions}
+
+    monkeypatch.setattr(ai_quiz, "generate_quiz_with_ai", generate_quiz_with_ai)
+    return calls, running
+
+
+@pytest.mark.asyncio
+async def test_repeated_topics_are_generated_once(generated):
+    calls, _ = generated
+    quizzes = await generate_quiz_batch(
+        [
+            ("Newton's Laws", 5),
+            ("Optics", 3),
+            ("newtons  laws!", 10),
+            ("Newton's Laws", 4),
+        ],
+        difficulty="hard",
+    )
+    # First spelling, largest count
+    assert sorted(calls) == [("Newton's Laws", 10, "hard"), ("Optics", 3, "hard")]
+    assert list(quizzes) == ["Newton's Laws", "Optics"]
+    assert len(quizzes["Newton's Laws"]["questions"]) == 10
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_bounded(generated):
+    calls, running = generated
+    topics = [(f"Topic {i}", 5) for i in range(7)]
+    quizzes = await generate_quiz_batch(topics, concurrency=3)
+    assert len(calls) == len(quizzes) == 7
+    assert running["peak"] == 3
+
+
+@pytest.mark.asyncio
+async def test_one_failing_topic_gets_a_fallback(generated):
+    quizzes = await generate_quiz_batch([("Broken", 2), ("Optics", 2)])
+    assert quizzes["Optics"]["questions"] == [{"question": "?"}] * 2
+    assert quizzes["Broken"]["_fallback"] is True
+    assert len(quizzes["Broken"]["questions"]) == 2
+
+
+def test_endpoint_validates_the_batch(generated, monkeypatch):
+    monkeypatch.setattr(auth_middleware, "ALLOW_DEV_AUTH_BYPASS", True)
+    app = FastAPI()
+    app.include_router(quiz_router.router)
+    client = TestClient(app)
+    headers = {"Authorization": "Bearer test-token"}
+
+    ok = client.post(
+        "/quiz/batch",
+        json={"items": [{"topic": "Optics", "count": 2}, {"topic": "optics"}]},
+        headers=headers,
+    )
+    assert ok.status_code == 200
+    assert list(ok.json()["quizzes"]) == ["Optics"]
+    assert len(ok.json()["quizzes"]["Optics"]["questions"]) == 5
+
+    too_many = [{"topic": f"Topic {i}"} for i in range(QUIZ_BATCH_MAX_TOPICS + 1)]
+    assert (
+        client.post("/quiz/batch", json={"items": []}, headers=headers).status_code
+        == 400
+    )
+    assert (
+        client.post(
+            "/quiz/batch", json={"items": too_many}, headers=headers
+        ).status_code
+        == 400
+    )
@@ -0,0 +1,116 @@
+import asyncio
+from email.utils import formatdate
+import time
+
+import httpx
+import pytest
+
+from services import retry_policy
+from services.retry_policy import RetryPolicy, call_with_retry, parse_retry_after
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record retry waits instead of sleeping through them."""
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(retry_policy.asyncio, "sleep", fake_sleep)
+    return delays
+
+
+def responses(*statuses, retry_after=None):
+    """A ``send`` callable returning the given statuses in turn, and its call log."""
+    calls = []
+
+    async def send(attempt, remaining):
+        calls.append(remaining)
+        status = statuses[len(calls) - 1]
+        headers = (
+            {"Retry-After": retry_after}
+            if retry_after is not None and status == 429
+            else {}
+        )
+        return httpx.Response(status, headers=headers)
+
+    return send, calls
+
+
+def test_backoff_is_capped_exponential_full_jitter(monkeypatch):
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: (low, high))
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    assert [policy.backoff(attempt) for attempt in range(4)] == [
+        (0, 1.0),
+        (0, 2.0),
+        (0, 4.0),
+        (0, 5.0),
+    ]
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert 25 < parse_retry_after(formatdate(time.time() + 30, usegmt=True)) <= 30
+    assert parse_retry_after(formatdate(time.time() - 30, usegmt=True)) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_retry_after_overrides_backoff(sleeps):
+    send, calls = responses(429, 200, retry_after="2")
+    response = await call_with_retry(
+        send, RetryPolicy(max_attempts=3, total_deadline=None), call_site="test"
+    )
+    assert response.status_code == 200
+    assert len(calls) == 2
+    assert sleeps == [2.0]
+
+
+@pytest.mark.asyncio
+async def test_returns_last_response_when_attempts_run_out(sleeps):
+    send, calls = responses(503, 503, 503)
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01, total_deadline=None)
+    response = await call_with_retry(send, policy, call_site="test")
+    assert response.status_code == 503
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+
+
+@pytest.mark.asyncio
+async def test_gives_up_when_retry_after_passes_deadline(sleeps):
+    send, calls = responses(429, 200, retry_after="30")
+    response = await call_with_retry(
+        send, RetryPolicy(total_deadline=5), call_site="test"
+    )
+    assert response.status_code == 429
+    assert len(calls) == 1
+    assert sleeps == []
+
+
+@pytest.mark.asyncio
+async def test_non_retryable_status_is_returned_at_once(sleeps):
+    send, calls = responses(400)
+    response = await call_with_retry(send, RetryPolicy(), call_site="test")
+    assert response.status_code == 400
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_transport_error_reraised_after_last_attempt(sleeps):
+    attempts = []
+
+    async def send(attempt, remaining):
+        attempts.append(attempt)
+        raise httpx.ConnectError("refused")
+
+    with pytest.raises(httpx.ConnectError):
+        await call_with_retry(
+            send, RetryPolicy(max_attempts=2, total_deadline=None), call_site="test"
+        )
+    assert attempts == [0, 1]
+    assert len(sleeps) == 1
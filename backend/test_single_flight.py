@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from services import ai_notes
+from services.single_flight import SingleFlight, normalize_text
+
+
+class Upstream:
+    """Slow fake call that counts how often it really runs."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return {"questions": [{"q": "Why is the sky blue?"}]}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_call():
+    flights, upstream = SingleFlight("test"), Upstream()
+    waiters = [asyncio.create_task(flights.do("optics", upstream)) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert flights.stats()["in_flight"] == 1
+    upstream.release.set()
+    results = await asyncio.gather(*waiters)
+
+    assert upstream.calls == 1
+    assert flights.stats() == {"in_flight": 0, "leader": 1, "coalesced": 4}
+    # Followers get their own copy
+    results[1]["questions"].clear()
+    assert results[0]["questions"] and results[2]["questions"]
+
+
+@pytest.mark.asyncio
+async def test_different_keys_and_later_calls_run_again():
+    flights, upstream = SingleFlight("test"), Upstream()
+    upstream.release.set()
+    await asyncio.gather(flights.do("optics", upstream), flights.do("waves", upstream))
+    await flights.do("optics", upstream)
+    assert upstream.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_waiter():
+    flights = SingleFlight("test")
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    results = await asyncio.gather(
+        *(flights.do("optics", failing) for _ in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flights.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_does_not_cancel_followers():
+    flights, upstream = SingleFlight("test"), Upstream()
+    leader = asyncio.create_task(flights.do("optics", upstream))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(flights.do("optics", upstream))
+    await asyncio.sleep(0)
+
+    leader.cancel()  # e.g. the client disconnected
+    await asyncio.sleep(0)
+    assert leader.cancelled()
+    upstream.release.set()
+    assert (await follower)["questions"]
+    assert upstream.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_work_finishes_when_every_caller_leaves():
+    flights, upstream = SingleFlight("test"), Upstream()
+    caller = asyncio.create_task(flights.do("optics", upstream))
+    await asyncio.sleep(0)
+    caller.cancel()
+    await asyncio.sleep(0)
+    task = flights._inflight["optics"]
+    upstream.release.set()
+    await task
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_normalize_text():
+    assert normalize_text("  Projectile   MOTION\n") == "projectile motion"
+    assert normalize_text(None) == ""
+
+
+@pytest.mark.asyncio
+async def test_notes_requests_differing_in_spelling_share_a_flight(monkeypatch):
+    upstream = Upstream()
+
+    async def generate(topic, variables, ocr_text=None, api_key=None):
+        return await upstream()
+
+    monkeypatch.setattr(ai_notes, "_generate_notes", generate)
+    monkeypatch.setattr(ai_notes, "notes_flights", SingleFlight("notes"))
+    requests = [
+        ai_notes.generate_notes("Projectile Motion", ["U", "g"]),
+        ai_notes.generate_notes("projectile  motion ", ["g", "u"]),
+        ai_notes.generate_notes("Projectile Motion", ["U"]),
+    ]
+    tasks = [asyncio.create_task(r) for r in requests]
+    await asyncio.sleep(0)
+    upstream.release.set()
+    await asyncio.gather(*tasks)
+    assert upstream.calls == 2
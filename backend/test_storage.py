@@ -0,0 +1,98 @@
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services import storage
+from services.storage import PNG_MAGIC, UploadError, UploadSizeLimit, _ingest
+
+PNG = PNG_MAGIC + bytes(range(256)) * 1000  # spans several chunks
+
+
+def stored_files(directory):
+    return sorted(os.listdir(directory))
+
+
+def test_ingest_stores_by_content_hash(tmp_path):
+    stored = _ingest(io.BytesIO(PNG), str(tmp_path), max_bytes=len(PNG))
+    digest = hashlib.sha256(PNG).hexdigest()
+    assert stored.sha256 == digest
+    assert stored.path == os.path.join(str(tmp_path), f"{digest}.png")
+    assert stored.size == len(PNG)
+    assert stored.content_type == "image/png"
+    assert not stored.deduplicated
+    assert stored_files(tmp_path) == [f"{digest}.png"]
+    with open(stored.path, "rb") as f:
+        assert f.read() == PNG
+    assert stored.view()[:] == PNG
+
+
+def test_same_bytes_are_stored_once(tmp_path):
+    first = _ingest(io.BytesIO(PNG), str(tmp_path), max_bytes=len(PNG))
+    second = _ingest(io.BytesIO(PNG), str(tmp_path), max_bytes=len(PNG))
+    assert second.deduplicated
+    assert second.path == first.path
+    assert len(stored_files(tmp_path)) == 1
+
+
+def test_truncated_copy_is_replaced_not_reused(tmp_path):
+    first = _ingest(io.BytesIO(PNG), str(tmp_path), max_bytes=len(PNG))
+    with open(first.path, "r+b") as f:
+        f.truncate(100)  # e.g. torn by a crash
+    second = _ingest(io.BytesIO(PNG), str(tmp_path), max_bytes=len(PNG))
+    assert not second.deduplicated
+    with open(second.path, "rb") as f:
+        assert f.read() == PNG
+
+
+def test_file_is_fsynced_before_it_takes_its_hash_name(tmp_path, monkeypatch):
+    events = []
+    real_fsync, real_replace = os.fsync, os.replace
+    monkeypatch.setattr(
+        storage.os, "fsync", lambda fd: events.append("fsync") or real_fsync(fd)
+    )
+    monkeypatch.setattr(
+        storage.os,
+        "replace",
+        lambda src, dst: events.append("replace") or real_replace(src, dst),
+    )
+    _ingest(io.BytesIO(PNG), str(tmp_path), max_bytes=len(PNG))
+    assert events == ["fsync", "replace"]
+
+
+@pytest.mark.parametrize(
+    "data, max_bytes, status",
+    [
+        (PNG, len(PNG) - 1, 413),
+        (b"GIF89a" + bytes(100), 1000, 415),
+        (b"", 1000, 400),
+    ],
+)
+def test_rejected_upload_leaves_nothing_behind(tmp_path, data, max_bytes, status):
+    with pytest.raises(UploadError) as excinfo:
+        _ingest(io.BytesIO(data), str(tmp_path), max_bytes=max_bytes)
+    assert excinfo.value.status_code == status
+    assert stored_files(tmp_path) == []
+
+
+def test_size_limit_rejects_from_content_length():
+    app = FastAPI()
+
+    @app.post("/scan/upload")
+    async def upload():
+        return {"ok": True}
+
+    @app.post("/other")
+    async def other():
+        return {"ok": True}
+
+    app.add_middleware(UploadSizeLimit, paths={"/scan/upload"}, max_bytes=100)
+    client = TestClient(app)
+    rejected = client.post("/scan/upload", content=b"x" * 101)
+    assert rejected.status_code == 413
+    assert "too large" in rejected.json()["detail"]
+    assert client.post("/scan/upload", content=b"x" * 100).status_code == 200
+    assert client.post("/other", content=b"x" * 101).status_code == 200
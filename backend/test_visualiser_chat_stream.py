@@ -0,0 +1,133 @@
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from auth import auth_middleware
+from routers import visualiser as visualiser_router
+from services import llm_gateway
+from services.ai_chat import stream_visualiser_chat
+from services.key_pool import KeyPool
+from services.llm_cache import LLMCache
+
+CHAT = {
+    "type": "chat",
+    "message": 'Increasing θ gives more "vertical" velocity,\nso the range first grows.',
+}
+UPDATE = {"type": "update", "changes": {"theta": 60}}
+
+
+def sse(*lines):
+    return "".join(f"data: {line}\n\n" for line in lines).encode()
+
+
+def chunks(text, size=7):
+    """Gemini SSE body carrying ``text`` in small pieces (splitting escapes)."""
+    parts = [text[i : i + size] for i in range(0, len(text), size)]
+    return sse(
+        *(
+            json.dumps({"candidates": [{"content": {"parts": [{"text": part}]}}]})
+            for part in parts
+        )
+    )
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Fake streamGenerateContent: answers with the SSE body set on ``gemini.body``."""
+
+    class Gemini:
+        body = b""
+        calls = 0
+
+    def handler(request):
+        Gemini.calls += 1
+        return httpx.Response(200, content=Gemini.body)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(llm_gateway, "get_client", lambda: client)
+    monkeypatch.setattr(llm_gateway, "llm_cache", LLMCache())
+    monkeypatch.setattr(llm_gateway, "key_pool", KeyPool(["AIza-pool-key"]))
+    return Gemini
+
+
+async def collect(message="What does the angle do?"):
+    return [
+        event
+        async for event in stream_visualiser_chat(
+            message, "Projectile Motion", {"theta": 45}
+        )
+    ]
+
+
+@pytest.mark.asyncio
+async def test_chat_reply_streams_its_message(gemini):
+    gemini.body = chunks(json.dumps(CHAT, ensure_ascii=False))
+    events = await collect()
+    tokens = [data["text"] for event, data in events if event == "token"]
+    assert len(tokens) > 1
+    assert "".join(tokens) == CHAT["message"]
+    assert events[-1] == ("done", CHAT)
+
+
+@pytest.mark.asyncio
+async def test_message_before_type_is_held_back(gemini):
+    reply = json.dumps({"message": CHAT["message"], "type": "chat"})
+    gemini.body = chunks(reply)
+    events = await collect()
+    tokens = [data["text"] for event, data in events if event == "token"]
+    assert "".join(tokens) == CHAT["message"]
+    assert events[-1] == ("done", CHAT)
+
+
+@pytest.mark.asyncio
+async def test_update_reply_sends_no_tokens(gemini):
+    gemini.body = chunks(json.dumps(UPDATE))
+    assert await collect() == [("done", UPDATE)]
+
+
+@pytest.mark.asyncio
+async def test_empty_message_needs_no_model_call(gemini):
+    events = await collect(message=" ")
+    assert [event for event, _ in events] == ["done"]
+    assert gemini.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_malformed_stream_ends_with_an_error_reply(gemini):
+    gemini.body = sse("{not json")
+    events = await collect()
+    assert events == [
+        (
+            "done",
+            {
+                "type": "chat",
+                "message": "Sorry, I encountered an error. Please try again.",
+            },
+        )
+    ]
+
+
+def test_endpoint_streams_server_sent_events(gemini, monkeypatch):
+    monkeypatch.setattr(auth_middleware, "ALLOW_DEV_AUTH_BYPASS", True)
+    gemini.body = chunks(json.dumps(CHAT))
+
+    app = FastAPI()
+    app.include_router(visualiser_router.router)
+    response = TestClient(app).post(
+        "/visualiser/chat/stream",
+        json={
+            "message": "What does the angle do?",
+            "topic": "Projectile Motion",
+            "parameters": {"theta": 45},
+            "history": [{"text": "Hi", "isUser": True}],
+        },
+        headers={"Authorization": "Bearer test-token"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    blocks = response.text.strip().split("\n\n")
+    assert blocks[0].startswith("event: token\n")
+    assert blocks[-1] == f"event: done\ndata: {json.dumps(CHAT, ensure_ascii=False)}"
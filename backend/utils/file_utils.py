@@ -1,5 +1,9 @@
 from pathlib import Path
 
+from utils.log import get_logger
+
+logger = get_logger("api")
+
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 STATIC_SCANS_DIR = (PROJECT_ROOT / "static" / "uploads").resolve()
 
@@ -22,10 +26,10 @@ def resolve_scan_path(image_path: str) -> Path:
     try:
         path.relative_to(STATIC_SCANS_DIR)
     except ValueError:
-        print(f"DEBUG: Path mismatch!")
-        print(f"  Input arg:      {image_path}")
-        print(f"  Input resolved: {path}")
-        print(f"  Expected root:  {STATIC_SCANS_DIR}")
+        logger.info(
+            "Rejected scan path outside the uploads directory",
+            extra={"image_path": image_path, "resolved": str(path), "expected_root": str(STATIC_SCANS_DIR)},
+        )
         raise ValueError("image_path must reference a saved scan asset.")
 
     if not path.is_file():
@@ -0,0 +1,379 @@
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from utils.log import get_logger
+
+logger = get_logger("llm")
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class TopLevelObjectStream:
+    """
+    Incrementally scan a streamed JSON object and yield its top-level members
+    as soon as each one is complete.
+
+    Text before the first ``{`` (e.g. a markdown code fence) is ignored. Each
+    character is inspected once, so the scan stays linear in the output size
+    however the text is chunked.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member: List[str] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume ``chunk`` and return the (key, value) pairs it completed."""
+        completed: List[Tuple[str, Any]] = []
+        for ch in chunk:
+            if self.done:
+                break
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._member.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._flush(completed)
+                    self.done = True
+                    continue
+            elif ch == "," and self._depth == 1:
+                self._flush(completed)
+                continue
+            self._member.append(ch)
+        return completed
+
+    def _flush(self, completed: List[Tuple[str, Any]]) -> None:
+        text = "".join(self._member).strip()
+        self._member = []
+        if not text:
+            return
+        try:
+            completed.extend(json.loads("{" + text + "}").items())
+        except json.JSONDecodeError:
+            logger.warning(
+                "Skipping malformed streamed JSON member",
+                extra={"member_chars": len(text)},
+            )
+
+
+_PENDING_HIGH_SURROGATE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}$")
+
+
+class StringFieldStream:
+    """
+    Incrementally decode one top-level string field of a streamed JSON object.
+
+    ``feed`` returns the newly decoded text of ``field`` (possibly empty), so a
+    long ``"message"`` can be forwarded to the client while the model is still
+    writing it. Escape sequences split across chunks are held back until they
+    are complete.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._token: List[str] = []
+        self._expect_key = True
+        self._last_key = None
+        self._capturing = False
+        self._raw: List[str] = []
+        self._raw_escape = False
+
+    def feed(self, chunk: str) -> str:
+        out: List[str] = []
+        for ch in chunk:
+            if self.finished:
+                break
+            if self._capturing:
+                if self._raw_escape:
+                    self._raw_escape = False
+                elif ch == "\\":
+                    self._raw_escape = True
+                elif ch == '"':
+                    out.append(self._decode(final=True))
+                    self._capturing = False
+                    self.finished = True
+                    continue
+                self._raw.append(ch)
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect_key:
+                        self._last_key = _loads_string(self._token)
+                        self._expect_key = False
+                    continue
+                if self._depth == 1 and self._expect_key:
+                    self._token.append(ch)
+                continue
+
+            if ch == '"':
+                if (
+                    self._depth == 1
+                    and not self._expect_key
+                    and self._last_key == self.field
+                ):
+                    self._capturing = True
+                else:
+                    self._in_string = True
+                    self._token = []
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+            elif ch == "," and self._depth == 1:
+                self._expect_key = True
+                self._last_key = None
+
+        if self._capturing:
+            out.append(self._decode(final=False))
+        return "".join(out)
+
+    def _decode(self, final: bool) -> str:
+        raw = "".join(self._raw)
+        keep = ""
+        if not final:
+            if self._raw_escape or "\\" in raw[-5:]:
+                cut = raw.rfind("\\")
+                run = len(raw[: cut + 1]) - len(raw[: cut + 1].rstrip("\\"))
+                # Only hold back an escape that is still incomplete (e.g. "\u00")
+                if self._raw_escape or (
+                    run % 2 == 1
+                    and raw[cut + 1 : cut + 2] == "u"
+                    and len(raw) - cut < 6
+                ):
+                    raw, keep = raw[:cut], raw[cut:]
+            match = _PENDING_HIGH_SURROGATE.search(raw)
+            if match:
+                raw, keep = raw[: match.start()], raw[match.start() :] + keep
+        self._raw = [keep] if keep else []
+        if not raw:
+            return ""
+        try:
+            return json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            return raw
+
+
+def _loads_string(chars: List[str]) -> str:
+    try:
+        return json.loads('"' + "".join(chars) + '"')
+    except json.JSONDecodeError:
+        return "".join(chars)
+
+
+_STRUCTURAL_CHARS = re.compile(r'[\[\]{}",:]')
+_STRING_REST = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_PARTIAL_ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{0,3})?$")
+_CLOSERS = {"{": "}", "[": "]"}
+_DECODER = json.JSONDecoder()
+
+
+class JSONExtractor:
+    """
+    Balanced-bracket scanner that pulls the first JSON value out of LLM output.
+
+    Surrounding prose and markdown fences are skipped, the input can arrive in
+    chunks via ``feed``, and output cut off mid-way (e.g. at maxOutputTokens)
+    can be closed off with ``repair``. Only structural characters are
+    inspected, so each chunk is scanned once.
+    """
+
+    def __init__(self, opening: str = "{["):
+        self._opener = re.compile("[" + re.escape(opening) + "]")
+        self.done = False
+        self.value: Any = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._started = False
+        self._chunks: List[str] = []
+        self._length = 0  # characters buffered before the current chunk
+        self._stack: List[str] = []  # expected closers
+        self._expect_key: List[bool] = []
+        self._in_string = False
+        self._string_is_key = False
+        self._escape_at = -2
+        self._safe_end = 0
+
+    def feed(self, chunk: str) -> Any:
+        """Consume ``chunk``; returns the parsed value once it is complete, else None."""
+        start = 0
+        while not self.done:
+            if not self._started:
+                match = self._opener.search(chunk, start)
+                if not match:
+                    return None
+                start = match.start()
+                self._started = True
+            end = self._scan(chunk, start)
+            if end is None:
+                self._chunks.append(chunk[start:])
+                self._length += len(chunk) - start
+                return None
+            self._chunks.append(chunk[start:end])
+            try:
+                self.value = json.loads("".join(self._chunks))
+                self.done = True
+            except json.JSONDecodeError:
+                # Balanced but not JSON (e.g. "{x}" in prose): keep looking
+                self._reset()
+                start = end
+        return self.value
+
+    def _mark_safe(self, position: int) -> None:
+        # Every push/pop marks a safe point, so the open brackets at the last
+        # safe point are always the current stack.
+        self._safe_end = position
+
+    def _scan(self, chunk: str, start: int) -> Optional[int]:
+        base = self._length - start
+        pos, end = start, len(chunk)
+        while pos < end:
+            if self._in_string:
+                if base + pos == self._escape_at + 1:
+                    pos += 1  # escaped character carried over from the previous chunk
+                    continue
+                match = _STRING_REST.match(chunk, pos)
+                if match is None:
+                    tail = chunk[pos:]
+                    if (len(tail) - len(tail.rstrip("\\"))) % 2:
+                        self._escape_at = base + end - 1
+                    return None
+                pos = match.end()
+                self._in_string = False
+                if not self._string_is_key:
+                    self._mark_safe(base + pos)
+                continue
+
+            match = _STRUCTURAL_CHARS.search(chunk, pos)
+            if match is None:
+                return None
+            i = match.start()
+            ch = chunk[i]
+            pos = i + 1
+            if ch == '"':
+                self._in_string = True
+                self._string_is_key = bool(self._expect_key) and self._expect_key[-1]
+            elif ch in "{[":
+                self._stack.append(_CLOSERS[ch])
+                self._expect_key.append(ch == "{")
+                self._mark_safe(base + pos)
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                    self._expect_key.pop()
+                if not self._stack:
+                    return pos
+                self._mark_safe(base + pos)
+            elif ch == ",":
+                self._mark_safe(base + i)
+                if self._stack[-1] == "}":
+                    self._expect_key[-1] = True
+            elif ch == ":" and self._stack[-1] == "}":
+                self._expect_key[-1] = False
+        return None
+
+    def repair(self) -> Any:
+        """
+        Best-effort value for input that ended before the JSON closed.
+
+        An unterminated string value is closed where it stopped; otherwise the
+        text is cut back to the last complete member. Open brackets are then
+        closed in order.
+        """
+        if self.done:
+            return self.value
+        if not self._started:
+            return None
+        text = "".join(self._chunks)
+        closers = "".join(reversed(self._stack))
+        candidates = []
+        if self._in_string and not self._string_is_key:
+            candidates.append(_PARTIAL_ESCAPE.sub("", text) + '"' + closers)
+        elif not self._in_string:
+            candidates.append(text.rstrip().rstrip(",") + closers)
+        candidates.append(text[: self._safe_end] + closers)
+        for candidate in candidates:
+            try:
+                return json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+        return None
+
+
+def extract_json(text: Optional[str], opening: str = "{[", repair: bool = True) -> Any:
+    """Parse the first JSON object/array in ``text`` (None if there isn't one)."""
+    if not text:
+        return None
+    # Fast path: let the C decoder try each candidate opening bracket in turn
+    opener = re.compile("[" + re.escape(opening) + "]")
+    match = opener.search(text)
+    while match:
+        try:
+            return _DECODER.raw_decode(text, match.start())[0]
+        except json.JSONDecodeError as e:
+            following = opener.search(text, match.start() + 1)
+            if following is None or following.start() <= e.pos:
+                break  # the failure is inside this value (e.g. truncated): scan it
+            match = following  # a stray bracket in prose; try the next one
+    if match is None:
+        return None
+    extractor = JSONExtractor(opening)
+    value = extractor.feed(text[match.start() :])
+    if extractor.done or not repair:
+        return value
+    return extractor.repair()
+
+
+def parse_model(
+    text: Optional[str],
+    model: Type[M],
+    prepare: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+) -> Optional[M]:
+    """Extract a JSON object from ``text`` and validate it as ``model`` (None on failure)."""
+    data = extract_json(text, opening="{")
+    if not isinstance(data, dict):
+        return None
+    if prepare:
+        data = prepare(data)
+    try:
+        return model.model_validate(data)
+    except ValidationError as e:
+        logger.warning(
+            "%s validation failed: %d error(s)", model.__name__, e.error_count()
+        )
+        return None
@@ -0,0 +1,169 @@
+"""
+Structured, non-blocking logging.
+
+Every module logs through ``get_logger(category)`` (``stemly.<category>``).
+Records go onto an in-memory queue and a single background thread formats
+them (one JSON object per line, or plain text with ``LOG_FORMAT=text``) and
+writes them to stdout, so a request handler never waits on a terminal or log
+collector.
+
+Levels: ``LOG_LEVEL`` for everything, overridden per category with
+``LOG_LEVELS`` (e.g. ``llm=DEBUG,auth=WARNING``). Large debug dumps (raw model
+output, OCR text) go through ``log_payload``, which is free unless the
+category is at DEBUG and then only keeps a ``LOG_PAYLOAD_SAMPLE_RATE`` share.
+
+Structured fields are passed with ``extra={...}`` and become JSON keys.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from config import (
+    LOG_FORMAT,
+    LOG_LEVEL,
+    LOG_LEVELS,
+    LOG_PAYLOAD_MAX_CHARS,
+    LOG_PAYLOAD_SAMPLE_RATE,
+)
+
+ROOT = "stemly"
+
+# Attributes every LogRecord has; anything else was passed via ``extra``
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_lock = threading.Lock()
+_atexit_registered = False
+
+
+def _fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {k: v for k, v in vars(record).items() if k not in _RESERVED}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread unformatted (so JSON keeps its fields)."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks hold frame references; render them before crossing threads
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """``"llm=DEBUG, auth=warning"`` -> {"llm": 10, "auth": 30}; bad entries are ignored."""
+    levels = {}
+    for item in spec.split(","):
+        category, _, level = item.partition("=")
+        value = logging.getLevelName(level.strip().upper())
+        if category.strip() and isinstance(value, int):
+            levels[category.strip()] = value
+    return levels
+
+
+def configure_logging() -> None:
+    """Install the queue handler and start the writer thread (idempotent)."""
+    global _listener, _atexit_registered
+    with _lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(
+            TextFormatter() if LOG_FORMAT == "text" else JSONFormatter()
+        )
+
+        root = logging.getLogger(ROOT)
+        root.setLevel(parse_levels(f"root={LOG_LEVEL}").get("root", logging.INFO))
+        root.propagate = False
+        root.handlers = [_QueueHandler(queue.SimpleQueue())]
+        for category, level in parse_levels(LOG_LEVELS).items():
+            logging.getLogger(f"{ROOT}.{category}").setLevel(level)
+
+        _listener = logging.handlers.QueueListener(
+            root.handlers[0].queue, output, respect_handler_level=False
+        )
+        _listener.start()
+        if not _atexit_registered:
+            atexit.register(shutdown_logging)
+            _atexit_registered = True
+
+
+def shutdown_logging() -> None:
+    """
+    Flush queued records and stop the writer thread. Records logged afterwards
+    (late shutdown messages, atexit hooks) are written directly to stdout.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            logging.getLogger(ROOT).handlers = list(_listener.handlers)
+            _listener = None
+
+
+def get_logger(category: str) -> logging.Logger:
+    configure_logging()
+    return logging.getLogger(f"{ROOT}.{category}")
+
+
+def log_payload(
+    logger: logging.Logger, message: str, payload: Any, **fields: Any
+) -> None:
+    """Sampled DEBUG dump of a large payload (model output, OCR text), truncated."""
+    if (
+        not logger.isEnabledFor(logging.DEBUG)
+        or random.random() >= LOG_PAYLOAD_SAMPLE_RATE
+    ):
+        return
+    text = (
+        payload
+        if isinstance(payload, str)
+        else json.dumps(payload, ensure_ascii=False, default=str)
+    )
+    if len(text) > LOG_PAYLOAD_MAX_CHARS:
+        fields["payload_chars"] = len(text)
+        text = text[:LOG_PAYLOAD_MAX_CHARS]
+    logger.debug(message, extra={**fields, "payload": text})
@@ -0,0 +1,139 @@
+"""
+Perceptual hashing and Hamming-radius search.
+
+``dhash`` reduces an image to 64 bits that survive re-encoding, resizing and
+small exposure changes (two photos of the same page usually land within a
+few bits of each other). ``MultiIndexHash`` finds every stored hash within a
+Hamming radius without scanning them all: each 64-bit code is split into 4
+chunks of 16 bits, each chunk indexes its own table, and by the pigeonhole
+principle any code within radius ``r`` matches the query exactly-or-nearly in
+at least one chunk (within ``r // 4`` bits), so only those buckets are probed
+and their candidates verified. Buckets keep the codes next to the ids so a
+probe is one sequential scan of a small array.
+
+Benchmark: ``python scripts/bench_phash_index.py``.
+"""
+
+import io
+from array import array
+from itertools import combinations
+from typing import BinaryIO, Dict, Generic, List, Optional, Tuple, TypeVar, Union
+
+from PIL import Image, ImageOps
+
+T = TypeVar("T")
+
+HASH_BITS = 64
+
+
+def dhash(image: Union[str, bytes, BinaryIO, Image.Image], size: int = 8) -> int:
+    """
+    Difference hash: one bit per horizontally adjacent pixel pair of a
+    (size+1)x(size) thumbnail. ``image`` is a path, bytes, a file-like object
+    (read from the start, e.g. a memory map) or an opened image.
+    """
+    if isinstance(image, Image.Image):
+        return _dhash(image, size)
+    if isinstance(image, bytes):
+        image = io.BytesIO(image)
+    elif not isinstance(image, str):
+        image.seek(0)
+    with Image.open(image) as img:
+        # JPEG: decode at reduced scale, much faster
+        img.draft("L", (size * 8, size * 8))
+        return _dhash(img, size)
+
+
+def _dhash(img: Image.Image, size: int) -> int:
+    img = (
+        ImageOps.exif_transpose(img)
+        .convert("L")
+        .resize((size + 1, size), Image.Resampling.BILINEAR)
+    )
+    pixels = img.tobytes()
+    code = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            code = (code << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return code
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def to_hex(code: int) -> str:
+    return f"{code:016x}"
+
+
+def from_hex(value: str) -> int:
+    return int(value, 16)
+
+
+class MultiIndexHash(Generic[T]):
+    """Hamming-radius index over 64-bit codes (multi-index hashing, 4 x 16-bit chunks)."""
+
+    def __init__(self, chunks: int = 4, bits: int = HASH_BITS):
+        if bits % chunks:
+            raise ValueError("bits must be divisible by chunks")
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        # chunk value -> (ids, full codes) of every entry with that chunk
+        self._tables: List[Dict[int, Tuple[array, array]]] = [{} for _ in range(chunks)]
+        self._items: List[T] = []
+        self._flips: Dict[int, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _split(self, code: int) -> List[int]:
+        return [
+            (code >> (i * self.chunk_bits)) & self._chunk_mask
+            for i in range(self.chunks)
+        ]
+
+    def _flip_masks(self, max_bits: int) -> List[int]:
+        """All chunk masks with at most ``max_bits`` bits set (probe offsets)."""
+        masks = self._flips.get(max_bits)
+        if masks is None:
+            masks = [0]
+            for k in range(1, max_bits + 1):
+                for positions in combinations(range(self.chunk_bits), k):
+                    masks.append(sum(1 << p for p in positions))
+            self._flips[max_bits] = masks
+        return masks
+
+    def add(self, code: int, item: T) -> None:
+        idx = len(self._items)
+        self._items.append(item)
+        for table, part in zip(self._tables, self._split(code)):
+            bucket = table.get(part)
+            if bucket is None:
+                table[part] = bucket = (array("I"), array("Q"))
+            bucket[0].append(idx)
+            bucket[1].append(code)
+
+    def search(
+        self, code: int, radius: int, limit: Optional[int] = None
+    ) -> List[Tuple[int, T]]:
+        """(distance, item) for every stored code within ``radius`` bits, nearest first."""
+        masks = self._flip_masks(min(radius // self.chunks, self.chunk_bits))
+        # id -> distance; an entry can match in several chunks
+        found: Dict[int, int] = {}
+        for table, part in zip(self._tables, self._split(code)):
+            get = table.get
+            for mask in masks:
+                bucket = get(part ^ mask)
+                if bucket is None:
+                    continue
+                ids, codes = bucket
+                for pos, other in enumerate(codes):
+                    distance = (other ^ code).bit_count()
+                    if distance <= radius:
+                        found[ids[pos]] = distance
+        ranked = sorted((distance, idx) for idx, distance in found.items())
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(distance, self._items[idx]) for distance, idx in ranked]
@@ -0,0 +1,64 @@
+"""
+Standalone background job worker.
+
+Usage:
+    cd backend
+    python worker.py [--concurrency 4] [--kinds notes,quiz,image]
+
+Runs alongside (or instead of) the in-process workers started by the API; any
+number of worker processes can share the same MongoDB queue.
+"""
+
+import argparse
+import asyncio
+
+from database.jobs_model import ensure_job_indexes, jobs_collection
+from services.job_queue import JOB_HANDLERS, create_worker
+from services.llm_gateway import close_client
+from utils.log import get_logger
+
+logger = get_logger("jobs")
+
+
+async def run(concurrency, kinds):
+    if jobs_collection is None:
+        logger.error("MONGO_URI is not set; the job queue needs MongoDB.")
+        return
+    await ensure_job_indexes()
+    worker = create_worker(concurrency, kinds)
+    try:
+        await worker.run_forever()
+    finally:
+        await close_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Process queued notes/quiz/image jobs."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="jobs processed at the same time"
+    )
+    parser.add_argument(
+        "--kinds",
+        default=",".join(JOB_HANDLERS),
+        help=f"comma-separated job kinds to handle (default: {','.join(JOB_HANDLERS)})",
+    )
+    args = parser.parse_args()
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    unknown = [k for k in kinds if k not in JOB_HANDLERS]
+    if unknown:
+        parser.error(
+            f"unknown job kind(s): {', '.join(unknown)} "
+            f"(choose from {', '.join(JOB_HANDLERS)})"
+        )
+    if not kinds:
+        parser.error("--kinds needs at least one job kind")
+    try:
+        asyncio.run(run(args.concurrency, kinds))
+    except KeyboardInterrupt:
+        logger.info("Worker stopped")
+
+
+if __name__ == "__main__":
+    main()